@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Alignment of speech and gestures on stage, with and without latency compensation.
+
+Plays pairs of speech and gesture nodes with the same start time on the virtual
+clock. Stub outputs take effect tts_latency (plus jitter) and gesture_latency
+seconds after the runner publishes them; TTS acknowledges with the start speech
+event, the gesture latency is configured. Reports how late each output took
+effect against its start time and how far apart the pairs were:
+
+    python bench/bench_latency.py --pairs 40 --tts-latency 0.35 --gesture-latency 0.08 --out latency.json
+"""
+from __future__ import division, print_function
+import argparse
+import random
+
+import harness
+from harness import BUS, stats
+from performances.clock import VirtualClock
+
+
+def performance(args):
+    nodes = []
+    for i in range(args.pairs):
+        start_time = 1.0 + i * args.spacing
+        nodes.append({'name': 'speech', 'text': 'utterance {}'.format(i), 'lang': 'en-US', 'start_time': start_time,
+                      'duration': args.spacing / 2})
+        nodes.append({'name': 'gesture', 'gesture': 'gesture-{}'.format(i), 'speed': 1, 'magnitude': 1,
+                      'start_time': start_time, 'duration': args.spacing / 2})
+    return {'id': 'bench/latency', 'nodes': nodes}
+
+
+def play(args, compensate):
+    from std_msgs.msg import String
+    world = harness.World()
+    clock = VirtualClock()
+    BUS.time = clock.time
+    BUS.set_param('/performances/latency', {'gesture': args.gesture_latency})
+    runner = world.runner(clock=clock)
+    harness.wait_idle(runner)
+    BUS.reconfigure_servers[BUS.node_name].update_configuration({'autopause': False, 'lookahead': 0,
+                                                                 'latency_compensation': compensate})
+    rng = random.Random(args.seed)
+    # text or gesture name -> time it took effect
+    effective = {}
+
+    def hook(channel, latency, name, acknowledge=None):
+        publisher = runner.topics[channel].publisher
+        publish = publisher.publish
+
+        def delayed(msg):
+            publish(msg)
+            at = clock.time() + latency()
+            effective[getattr(msg, name)] = at
+            if acknowledge:
+                clock.call_at(at, acknowledge)
+        publisher.publish = delayed
+
+    def speech_started():
+        # The runner tells its utterances from others' by the TTS requests it received
+        BUS.drain()
+        runner.speech_events_callback(String('start'))
+
+    hook('tts', lambda: max(0.0, args.tts_latency + rng.uniform(-args.jitter, args.jitter)), 'text',
+         speech_started)
+    hook('gesture', lambda: args.gesture_latency, 'name')
+
+    data = performance(args)
+    runner.load_performance(data)
+    runner.run(0)
+    started = runner.start_timestamp
+    harness.wait_idle(runner, 60)
+    report = runner.latency.report()
+    world.close()
+
+    speech_errors = []
+    gesture_errors = []
+    apart = []
+    for node in data['nodes']:
+        if node['name'] != 'speech':
+            continue
+        i = int(node['text'].split()[-1])
+        intended = started + node['start_time']
+        speech = effective.get(node['text'])
+        gesture = effective.get('gesture-{}'.format(i))
+        if speech is None or gesture is None:
+            continue
+        speech_errors.append((speech - intended) * 1000)
+        gesture_errors.append((gesture - intended) * 1000)
+        apart.append(abs(speech - gesture) * 1000)
+    return speech_errors, gesture_errors, apart, report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pairs', type=int, default=40)
+    parser.add_argument('--spacing', type=float, default=2.0, help='seconds between pairs')
+    parser.add_argument('--tts-latency', type=float, default=0.35, help='seconds')
+    parser.add_argument('--jitter', type=float, default=0.03, help='TTS latency jitter, seconds')
+    parser.add_argument('--gesture-latency', type=float, default=0.08, help='seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    harness.configure_logging(args.verbose)
+
+    metrics = {}
+    for name, compensate in [('without', False), ('with', True)]:
+        speech, gesture, apart, report = play(args, compensate)
+        metrics['latency_speech_error_ms_{}_compensation'.format(name)] = stats(speech)
+        metrics['latency_gesture_error_ms_{}_compensation'.format(name)] = stats(gesture)
+        metrics['latency_pair_apart_ms_{}_compensation'.format(name)] = stats(apart)
+        metrics['latency_tts_estimate_ms_{}_compensation'.format(name)] = report['channels']['tts']['latency_ms']
+    params = dict((k, v) for k, v in vars(args).items() if k not in ('out', 'verbose'))
+    harness.write_results('latency', params, metrics, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Memory of N runner processes, one per robot, against one process serving
+N robots with a shared library.
+
+Every robot loads each performance of a generated common/ library once,
+as a show cycling through its content would:
+
+    python bench/bench_multi.py --robots 4 --performances 20 --out multi.json
+"""
+from __future__ import division, print_function
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+import harness
+from harness import stats
+from performances.library import Library
+
+
+def write_common(root, args):
+    ids = []
+    for i in range(args.performances):
+        folder = 'shared/bench/perf{}'.format(i)
+        generate.write_library(root, 'common', args.timelines, args.nodes, seed=args.seed + i, folder=folder)
+        ids.append(folder)
+    return ids
+
+
+def child(args):
+    """ Runs robots in this process and prints RSS and load times as JSON """
+    robots = args.child
+    world = harness.World(robots[0], args.dir)
+    library = Library(args.dir)
+    before = harness.rss_bytes()
+    loads = []
+    runners = []
+    for robot in robots:
+        namespace = '~' if len(robots) == 1 else '~{}/'.format(robot)
+        # Private parameters are read per robot, trace next to the library as a single robot does
+        harness.BUS.set_param('/performances/' + namespace[1:] + 'trace_file',
+                              harness.BUS.get_param('/performances/trace_file'))
+        runner = world.runner(robot_name=robot, library=library, namespace=namespace)
+        harness.wait_idle(runner)
+        for id in args.ids:
+            began = time.time()
+            runner.load(id)
+            loads.append((time.time() - began) * 1000)
+        runners.append(runner)
+    print(json.dumps({'rss': harness.rss_bytes(), 'runners_rss': harness.rss_bytes() - before, 'loads': loads}))
+
+
+def spawn(args, robots, ids, directory):
+    command = [sys.executable, os.path.abspath(__file__), '--dir', directory, '--ids'] + ids + ['--child'] + robots
+    return subprocess.Popen(command, stdout=subprocess.PIPE)
+
+
+def collect(process):
+    out, _ = process.communicate()
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--robots', type=int, default=4)
+    parser.add_argument('--performances', type=int, default=20)
+    parser.add_argument('--timelines', type=int, default=3)
+    parser.add_argument('--nodes', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--child', nargs='*', help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    parser.add_argument('--ids', nargs='*', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    harness.configure_logging(args.verbose)
+    if args.child:
+        return child(args)
+
+    directory = tempfile.mkdtemp(prefix='performances-bench-')
+    try:
+        ids = write_common(directory, args)
+        robots = ['robot{}'.format(i) for i in range(args.robots)]
+        # One after another so that load times are not skewed by contention
+        separate = [collect(spawn(args, [robot], ids, directory)) for robot in robots]
+        shared = collect(spawn(args, robots, ids, directory))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    metrics = {
+        'multi_separate_rss_kb': sum(r['rss'] for r in separate) / 1024.0,
+        'multi_shared_rss_kb': shared['rss'] / 1024.0,
+        'multi_separate_runners_rss_kb': sum(r['runners_rss'] for r in separate) / 1024.0,
+        'multi_shared_runners_rss_kb': shared['runners_rss'] / 1024.0,
+        'multi_separate_load_ms': stats(sum([r['loads'] for r in separate], [])),
+        'multi_shared_load_ms': stats(shared['loads']),
+    }
+    params = dict((k, v) for k, v in vars(args).items() if k not in ('out', 'verbose', 'child', 'dir', 'ids'))
+    harness.write_results('multi', params, metrics, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,619 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Runner benchmark suite.
+
+Runs the real Runner and nodes against the in-process ROS stand-in and
+synthetic performances of N timelines x M nodes, and writes JSON results
+that bench/compare.py can diff across commits:
+
+    python bench/bench_runner.py --timelines 10 --nodes 50 --out base.json
+"""
+from __future__ import division, print_function
+import argparse
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import yaml
+
+import generate
+import harness
+from harness import BUS, stats, timed
+from performances.report import Report, FileSink
+from performances.trace import TraceReader, NODE_START, PUBLISH
+
+
+def bench_load(world, runner, args):
+    folder = generate.write_library(world.dir, world.robot_name, args.timelines, args.nodes, seed=args.seed)
+    runner.load_properties()
+    durations = timed(lambda: runner.load(folder), args.repeat)
+    BUS.published = []
+    return {'load_latency_ms': stats(durations)}
+
+
+def bench_instantiation(world, runner, args):
+    Node = harness.load_script('runner').Node
+    performance = generate.performance(args.timelines, args.nodes, seed=args.seed)
+    runner.load_performance(performance)
+    count = sum(len(t['nodes']) for t in performance['timelines'])
+
+    def instantiate():
+        for t in performance['timelines']:
+            [Node.createNode(n, runner, 0, t['id']) for n in t['nodes']]
+
+    durations = timed(instantiate, args.repeat)
+    return {'node_instantiation_us': stats(d * 1000 / count for d in durations)}
+
+
+def bench_start(world, runner, args):
+    """ Cost of Node.start() once the performance is loaded, per node type """
+    Node = harness.load_script('runner').Node
+    performance = generate.performance(args.timelines, args.nodes, seed=args.seed)
+    runner.load_performance(performance)
+    durations = {}
+    for _ in range(args.repeat):
+        for t in performance['timelines']:
+            for n in t['nodes']:
+                node = Node.createNode(n, runner, 0, t['id'])
+                began = time.time()
+                node.start(0)
+                durations.setdefault(n['name'], []).append((time.time() - began) * 1e6)
+    BUS.published = []
+    result = {'node_start_us': stats(sum(durations.values(), []))}
+    for name, values in durations.items():
+        result['node_start_us_' + name] = stats(values)
+    return result
+
+
+def long_running_performance(args, length):
+    rng = random.Random(args.seed)
+    t = generate.timeline(args.nodes, rng, length=length, duration=(1000, 1000))
+    t.update({'id': 'bench/ticks/0', 'name': '0', 'path': 'bench/ticks'})
+    return {'id': 'bench/ticks', 'name': 'ticks', 'path': 'bench', 'timelines': [t]}
+
+
+def count_ticks(runner):
+    """ Every worker tick reads the run time once, so counting reads counts ticks """
+    counter = [0]
+    get_run_time = runner.get_run_time
+
+    def counted():
+        counter[0] += 1
+        return get_run_time()
+
+    runner.get_run_time = counted
+    return counter
+
+
+def bench_ticks(world, runner, args):
+    runner.load_performance(long_running_performance(args, length=0.2))
+    counter = count_ticks(runner)
+    runner.run(0)
+    # let all nodes start before measuring the steady state
+    time.sleep(0.3)
+    rates = []
+    for _ in range(args.repeat):
+        before = counter[0]
+        time.sleep(args.window)
+        rates.append((counter[0] - before) / args.window)
+    runner.stop()
+    harness.wait_idle(runner)
+    del runner.get_run_time
+    BUS.published = []
+    return {'tick_throughput_per_s': stats(rates)}
+
+
+def play_probes(runner, args):
+    """ Plays gesture probes over background nodes, returns ms each probe was published after its start time """
+    rng = random.Random(args.seed)
+    background = generate.timeline(args.nodes, rng, length=args.jitter_nodes * args.jitter_spacing,
+                                   duration=(1000, 1000))['nodes']
+    probes = []
+    for i in range(args.jitter_nodes):
+        probes.append({'name': 'gesture', 'gesture': 'probe-{}'.format(i), 'speed': 1, 'magnitude': 1,
+                       'start_time': 0.1 + i * args.jitter_spacing, 'duration': 0.1})
+    performance = {'id': 'bench/jitter', 'name': 'jitter', 'path': 'bench', 'nodes': background + probes}
+    runner.load_performance(performance)
+    BUS.published = []
+    runner.run(0)
+    started = runner.start_timestamp
+    expected = dict((p['gesture'], p['start_time']) for p in probes)
+    harness.wait_for(lambda: len(BUS.messages('/blender_api/set_gesture')) >= len(probes) + 1,
+                     timeout=probes[-1]['start_time'] + 2)
+    runner.stop()
+    harness.wait_idle(runner)
+    jitter = [(p.time - started - expected[p.msg.name]) * 1000
+              for p in BUS.messages('/blender_api/set_gesture') if p.msg.name in expected]
+    BUS.published = []
+    return jitter
+
+
+def bench_jitter(world, runner, args):
+    return {'start_jitter_ms': stats(play_probes(runner, args))}
+
+
+class Pollers(object):
+    """ Threads calling the current service in a loop, as UIs showing the playback position do """
+
+    def __init__(self, runner, count, interval):
+        self.durations = []
+        self.done = threading.Event()
+        self.threads = [threading.Thread(target=self.poll, args=(runner, interval)) for _ in range(count)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def poll(self, runner, interval):
+        while not self.done.is_set():
+            self.durations += timed(lambda: runner.current_callback(None), 1)
+            if interval:
+                time.sleep(interval)
+
+    def stop(self):
+        self.done.set()
+        for thread in self.threads:
+            thread.join()
+        return self.durations
+
+
+def bench_polling(world, runner, args):
+    """
+    Worker tick gaps and node start jitter while threads poll the current service, and how long polls
+    take while performances are loaded
+    """
+    ticks = []
+    tick = runner.layers.tick
+
+    def timed_tick():
+        ticks.append(time.time())
+        tick()
+
+    runner.layers.tick = timed_tick
+    result = {}
+    for count in sorted({0, args.pollers}):
+        pollers = Pollers(runner, count, args.poll_interval)
+        del ticks[:]
+        began = time.time()
+        jitter = play_probes(runner, args)
+        elapsed = time.time() - began
+        polls = pollers.stop()
+        gaps = [(b - a) * 1000 for a, b in zip(ticks, ticks[1:])]
+        suffix = '_{}_pollers'.format(count)
+        result.update({
+            'polling_tick_gap_ms' + suffix: stats(gaps),
+            'polling_start_jitter_ms' + suffix: stats(jitter),
+            'polling_call_ms' + suffix: stats(polls),
+            'polling_calls_per_s' + suffix: len(polls) / elapsed,
+        })
+    del runner.layers.tick
+
+    folder = generate.write_library(world.dir, world.robot_name, args.timelines, args.nodes, seed=args.seed)
+    runner.load_properties()
+    pollers = Pollers(runner, max(1, args.pollers), args.poll_interval)
+    for _ in range(args.repeat):
+        runner.load(folder)
+    result['polling_call_ms_loading'] = stats(pollers.stop())
+    BUS.published = []
+    return result
+
+
+def bench_pause_resume(world, runner, args):
+    runner.load_performance(long_running_performance(args, length=0.2))
+    runner.run(0)
+    time.sleep(0.3)
+    pauses = []
+    resumes = []
+    for _ in range(args.repeat * 10):
+        pauses += timed(lambda: runner.pause_callback(None), 1)
+        time.sleep(0.005)
+        resumes += timed(lambda: runner.resume_callback(None), 1)
+        time.sleep(0.005)
+    runner.stop()
+    harness.wait_idle(runner)
+    BUS.published = []
+    return {'pause_latency_ms': stats(pauses), 'resume_latency_ms': stats(resumes)}
+
+
+def bench_regions(world, runner, args):
+    """ Cost of picking an attention point, as look_at and gaze_at nodes do every interval """
+    folder = generate.write_library(world.dir, world.robot_name, 1, 1, seed=args.seed)
+    runner.load_properties()
+    attention = harness.load_script('runner').Node.getClass('look_at')
+    node = attention({'name': 'look_at', 'start_time': 0, 'duration': 1, 'attention_region': 'face'}, runner)
+    node.id = folder + '/0'
+    count = 1000
+    durations = timed(lambda: [node.get_point('face') for _ in range(count)], args.repeat)
+    return {'region_sample_us': stats(d * 1000 / count for d in durations)}
+
+
+def bench_outputs(world, runner, args):
+    """ Target and soma messages reaching ROS per tick with overlapping attention and soma nodes """
+    folder = generate.write_library(world.dir, world.robot_name, 1, 1, seed=args.seed)
+    runner.load_properties()
+    nodes = []
+    for i in range(10):
+        nodes.append({'name': 'look_at', 'attention_region': 'face' if i % 2 else 'custom', 'interval': 0.05,
+                      'x': 1, 'y': 0, 'z': 0, 'speed': 1, 'start_time': 0, 'duration': 1000})
+        nodes.append({'name': 'soma', 'soma': 'breathing', 'start_time': i * 0.01, 'duration': 1000})
+    runner.load_performance({'id': folder + '/outputs', 'name': 'outputs', 'path': folder, 'nodes': nodes})
+    counter = count_ticks(runner)
+    runner.run(0)
+    time.sleep(args.window)
+    runner.stop()
+    harness.wait_idle(runner)
+    del runner.get_run_time
+    topics = ['/blender_api/set_face_target', '/blender_api/set_gaze_target', '/blender_api/set_soma_state']
+    published = sum(len(BUS.messages(t)) for t in topics)
+    BUS.published = []
+    return {'output_messages_per_tick': published / max(1, counter[0])}
+
+
+def bench_layers(world, runner, args):
+    """ Foreground switches while a background layer plays, and the longest gap in background ticks """
+    rng = random.Random(args.seed)
+    background = generate.timeline(args.nodes, rng, kinds=['soma', 'look_at', 'gaze_at'], length=1.0,
+                                   duration=(0.5, 1.0))
+    background['id'] = 'bench/background'
+    runner.run_layer('background', background, loop=True)
+    layer = runner.layers.get('background')
+    ticks = []
+    tick = layer.tick
+
+    def timed_tick():
+        ticks.append(time.time())
+        tick()
+
+    layer.tick = timed_tick
+    switches = []
+    for i in range(args.repeat * 4):
+        performance = generate.performance(1, args.nodes, seed=args.seed + i)
+        began = time.time()
+        runner.load_performance(performance)
+        runner.run(0)
+        switches.append((time.time() - began) * 1000)
+        time.sleep(0.05)
+    runner.stop()
+    harness.wait_idle(runner)
+    runner.layers.remove('background')
+    gaps = [(b - a) * 1000 for a, b in zip(ticks, ticks[1:])]
+    BUS.published = []
+    return {'layer_switch_ms': stats(switches), 'layer_tick_gap_ms': stats(gaps)}
+
+
+def bench_warm_up(world, runner, args):
+    """ First load with a cold library and after warm-up, and service latency while warming up """
+    Library = harness.load_script('runner').Library
+    folders = [generate.write_library(world.dir, world.robot_name, args.timelines, args.nodes, seed=args.seed + i,
+                                      folder='bench/library/perf{}'.format(i)) for i in range(args.repeat * 4)]
+    cold = []
+    for folder in folders[:args.repeat]:
+        runner.library = Library(world.dir)
+        cold.append(timed(lambda: runner.load(folder), 1)[0])
+    runner.library = Library(world.dir)
+    runner.start_warm_up()
+    current = []
+    while runner.warm_up_state.get('running'):
+        current.extend(timed(lambda: runner.current_callback(None), 1))
+        time.sleep(0.01)
+    warm = [timed(lambda: runner.load(folder), 1)[0] for folder in folders[args.repeat:args.repeat * 2]]
+    BUS.published = []
+    return {
+        'warm_up_first_load_cold_ms': stats(cold),
+        'warm_up_first_load_warm_ms': stats(warm),
+        'warm_up_current_ms': stats(current),
+        'warm_up_s': runner.warm_up_state['seconds'],
+        'warm_up_rss_kb': runner.warm_up_state['rss_kb'],
+    }
+
+
+def bench_properties(world, runner, args):
+    """ reload_properties of a large library: everything new, nothing changed and one edited file """
+    folders = [generate.write_library(world.dir, world.robot_name, 1, 1, seed=args.seed + i,
+                                      folder='bench/properties/perf{}'.format(i)) for i in range(200)]
+    Library = harness.load_script('runner').Library
+    # Counts round trips to the parameter server
+    master = harness.fakeros.MASTER
+
+    def reload_all():
+        runner.properties = {}
+        runner.library = Library(world.dir)
+        runner.load_properties()
+
+    requests = master.requests
+    full = timed(reload_all, args.repeat)
+    full_calls = (master.requests - requests) / args.repeat
+    requests = master.requests
+    unchanged = timed(runner.load_properties, args.repeat)
+    unchanged_calls = master.requests - requests
+    edited = []
+    requests = master.requests
+    for i in range(args.repeat):
+        filename = os.path.join(world.dir, world.robot_name, folders[i], '.properties')
+        with open(filename, 'a') as f:
+            f.write('edit{}: {}\n'.format(i, 'x' * i))
+        edited.extend(timed(runner.load_properties, 1))
+    edited_calls = (master.requests - requests) / args.repeat
+    return {
+        'properties_reload_full_ms': stats(full),
+        'properties_reload_unchanged_ms': stats(unchanged),
+        'properties_reload_edit_ms': stats(edited),
+        'properties_master_calls_full': full_calls,
+        'properties_master_calls_unchanged': unchanged_calls,
+        'properties_master_calls_edit': edited_calls,
+    }
+
+
+def bench_report(world, runner, args):
+    """ Caller cost of a performance report record against a warn log to a file handler, and drops in a burst """
+    count = 1000
+    directory = tempfile.mkdtemp(prefix='performances-bench-')
+    handler = logging.FileHandler(os.path.join(directory, 'log'))
+    log = logging.getLogger('bench.report')
+    log.propagate = False
+    log.addHandler(handler)
+    log.setLevel(logging.WARNING)
+    data = {'performance_report': True, 'performance_id': 'bench/perf', 'performance_time': 1.5,
+            'performance_action': 'run'}
+    logged = timed(lambda: [log.warn('Running performance #{} at: {}'.format('bench/perf', 1.5), extra={'data': data})
+                            for _ in range(count)], args.repeat)
+    log.removeHandler(handler)
+    handler.close()
+    report = Report([FileSink(os.path.join(directory, 'report'))], robot=world.robot_name)
+    recorded = timed(lambda: [report.record('run', 'bench/perf', 1.5) for _ in range(count)], args.repeat)
+    report.flush(5)
+    burst = Report([FileSink(os.path.join(directory, 'burst'))], size=64)
+    for i in range(count * 10):
+        burst.record('run', 'bench/perf', i)
+    burst.flush(5)
+    shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'report_log_warn_us': stats(d * 1000 / count for d in logged),
+        'report_record_us': stats(d * 1000 / count for d in recorded),
+        'report_burst_dropped': burst.stats()['dropped'] / float(count * 10),
+    }
+
+
+def bench_trace(world, runner, args):
+    """ Caller cost of trace records of node starts and outputs, and reading the trace back """
+    count = 1000
+    Node = harness.load_script('runner').Node
+    performance = generate.performance(1, 1, seed=args.seed)
+    runner.load_performance(performance)
+    node = Node.createNode(performance['timelines'][0]['nodes'][0], runner, 0, 'bench/perf/0')
+    msg = runner.topics['gesture'].publisher.data_class(name='blink', speed=1.0, magnitude=0.9)
+    nodes = timed(lambda: [runner.trace.node(NODE_START, node, 1.0, 1.0) for _ in range(count)], args.repeat)
+    outputs = timed(lambda: [runner.trace.output(PUBLISH, 'gesture', msg) for _ in range(count)], args.repeat)
+    runner.trace.flush()
+    began = time.time()
+    records = sum(1 for _ in TraceReader(runner.trace.ring.path).records())
+    return {
+        'trace_node_us': stats(d * 1000 / count for d in nodes),
+        'trace_output_us': stats(d * 1000 / count for d in outputs),
+        'trace_read_records_per_s': records / (time.time() - began),
+    }
+
+
+def bench_interrupt(world, runner, args):
+    """ Memory an interrupted performance keeps until resumed, and the latency of resuming it """
+    count = 4
+    # Resumed below instead of when the runner gets idle
+    runner.load_scheduled = lambda: False
+    performances = [generate.performance(args.timelines, args.nodes, seed=args.seed + i) for i in range(count)]
+    for performance in performances:
+        runner.load_performance(performance)
+        runner.run(0)
+        time.sleep(0.05)
+        runner.interrupt()
+        harness.wait_idle(runner)
+    runner.load_performance(generate.performance(1, 1, seed=args.seed))
+    interrupted = runner.interrupted_performances
+    runner.interrupted_performances = []
+    shared = set()
+    harness.deep_size(runner, shared)
+    runner.interrupted_performances = interrupted
+    retained = harness.deep_size(list(interrupted), shared)
+    resumes = []
+    for _ in range(count):
+        resumes += timed(runner.resume_interrupted, 1)
+        runner.stop()
+        harness.wait_idle(runner)
+    BUS.published = []
+    return {
+        'interrupt_retained_bytes': retained / count,
+        'interrupt_resume_ms': stats(resumes),
+    }
+
+
+def bench_reload(world, runner, args):
+    """ Patching an edited timeline into the playing performance against stop, load and run at the same time """
+    folder = generate.write_library(world.dir, world.robot_name, args.timelines, args.nodes, seed=args.seed)
+    runner.load_properties()
+    runner.autopause = False
+    runner.load(folder)
+    path = runner.get_timeline_path(folder + '/0')
+    with open(path) as f:
+        timeline = yaml.safe_load(f)
+    length = max(n['start_time'] + n['duration'] for n in timeline['nodes'])
+    runner.run(0)
+    diffs = []
+    applies = []
+    for i in range(args.repeat * 4):
+        # One node changed, one removed and one added
+        nodes = list(timeline['nodes'])
+        nodes[i % len(nodes)] = dict(nodes[i % len(nodes)], duration=1.0 + i)
+        nodes.pop((i + 1) % len(nodes))
+        nodes.append(dict(nodes[0], start_time=length * 2 + i))
+        with open(path, 'w') as f:
+            yaml.safe_dump(dict(timeline, nodes=nodes), f, default_flow_style=False)
+        patch = runner.reload_timeline(runner.running_performance, 0, path, runner.library.signature(path))
+        if patch:
+            diffs.append(patch.diff_seconds * 1000)
+            applies.append(patch.apply_seconds * 1000)
+
+    def restart():
+        runner.stop()
+        runner.load(folder)
+        runner.run(0.5)
+
+    restarts = timed(restart, args.repeat)
+    runner.stop()
+    harness.wait_idle(runner)
+    BUS.published = []
+    return {
+        'reload_diff_ms': stats(diffs),
+        'reload_apply_ms': stats(applies),
+        'reload_restart_ms': stats(restarts),
+    }
+
+
+def bench_tickets(world, runner, args):
+    """ Switching to another performance with run_full_performance against loading it ahead by ticket """
+    folder = generate.write_library(world.dir, world.robot_name, args.timelines, args.nodes, seed=args.seed)
+    runner.load_properties()
+    runner.autopause = False
+    runner.load(folder)
+    runner.run(0)
+    switches = timed(lambda: runner.run_full_performance(folder), args.repeat)
+    issues = []
+    loads = []
+    runs = []
+    for i in range(args.repeat):
+        began = time.time()
+        ticket = runner.load_async(folder)
+        issues.append((time.time() - began) * 1000)
+        ticket.done.wait(10)
+        loads.append(ticket.seconds * 1000)
+        began = time.time()
+        runner.run_ticket(ticket.number)
+        runs.append((time.time() - began) * 1000)
+    runner.stop()
+    harness.wait_idle(runner)
+    BUS.published = []
+    return {
+        'tickets_run_full_performance_ms': stats(switches),
+        'tickets_load_async_ms': stats(issues),
+        'tickets_load_ms': stats(loads),
+        'tickets_run_ticket_ms': stats(runs),
+    }
+
+
+def bench_sequence(world, runner, args):
+    """ One load_sequence against chained loads of the same performances, parsed from disk each time """
+    folders = [generate.write_library(world.dir, world.robot_name, args.timelines, args.nodes, seed=args.seed + i,
+                                      folder='bench/sequence{}'.format(i)) for i in range(4)]
+    runner.load_properties()
+
+    def chained():
+        runner.library.clear()
+        for folder in folders:
+            runner.load(folder)
+
+    def sequence():
+        runner.library.clear()
+        runner.load_sequence(folders)
+
+    BUS.published = []
+    chains = timed(chained, args.repeat)
+    chained_publishes = len(BUS.messages('/performances/running_performance')) / args.repeat
+    BUS.published = []
+    sequences = timed(sequence, args.repeat)
+    sequence_publishes = len(BUS.messages('/performances/running_performance')) / args.repeat
+    BUS.published = []
+    return {
+        'sequence_chained_load_ms': stats(chains),
+        'sequence_load_ms': stats(sequences),
+        'sequence_chained_publishes': chained_publishes,
+        'sequence_publishes': sequence_publishes,
+    }
+
+
+def bench_memory(world, runner, args):
+    Node = harness.load_script('runner').Node
+    before = harness.memory_snapshot()
+    performance = generate.performance(args.timelines, args.nodes, seed=args.seed)
+    runner.load_performance(performance)
+    loaded = harness.memory_snapshot()
+    nodes = [Node.createNode(n, runner, 0, t['id']) for t in performance['timelines'] for n in t['nodes']]
+    instantiated = harness.memory_snapshot()
+    # nodes reference the loaded performance and the runner, those are not per-node allocations
+    shared = set()
+    harness.deep_size(performance, shared)
+    harness.deep_size(runner, shared)
+    # Run state allocated per node, the specs are shared by runs
+    specs = [node.spec for node in nodes]
+    shared_specs = set()
+    harness.deep_size(specs, shared_specs)
+    rerun = [Node.createNode(n, runner, 0, t['id']) for t in performance['timelines'] for n in t['nodes']]
+    result = {
+        'memory_performance_bytes': harness.deep_size(performance),
+        'memory_node_bytes': harness.deep_size(nodes, shared) / max(1, len(nodes)),
+        'memory_run_bytes_per_node': harness.deep_size(rerun, shared | shared_specs) / max(1, len(rerun)),
+        'memory_rerun_shared_specs': sum(a.spec is b.spec for a, b in zip(nodes, rerun)) / max(1, len(rerun)),
+        'memory_load_rss_kb': (loaded['rss'] - before['rss']) / 1024.0,
+        'memory_nodes_rss_kb': (instantiated['rss'] - loaded['rss']) / 1024.0,
+    }
+    del nodes, rerun, specs
+    BUS.published = []
+    return result
+
+
+BENCHMARKS = [
+    ('load', bench_load),
+    ('instantiation', bench_instantiation),
+    ('start', bench_start),
+    ('ticks', bench_ticks),
+    ('jitter', bench_jitter),
+    ('polling', bench_polling),
+    ('pause_resume', bench_pause_resume),
+    ('regions', bench_regions),
+    ('outputs', bench_outputs),
+    ('layers', bench_layers),
+    ('warm_up', bench_warm_up),
+    ('properties', bench_properties),
+    ('report', bench_report),
+    ('trace', bench_trace),
+    ('interrupt', bench_interrupt),
+    ('reload', bench_reload),
+    ('tickets', bench_tickets),
+    ('sequence', bench_sequence),
+    ('memory', bench_memory),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timelines', type=int, default=10, help='timelines per performance (N)')
+    parser.add_argument('--nodes', type=int, default=50, help='nodes per timeline (M)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--window', type=float, default=1.0, help='tick throughput sampling window, seconds')
+    parser.add_argument('--jitter-nodes', type=int, default=40)
+    parser.add_argument('--jitter-spacing', type=float, default=0.05)
+    parser.add_argument('--pollers', type=int, default=4, help='threads polling the current service')
+    parser.add_argument('--poll-interval', type=float, default=0.002, help='seconds between polls of a thread')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='*', choices=[name for name, _ in BENCHMARKS])
+    parser.add_argument('--out', help='results file, stdout if omitted')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    harness.configure_logging(args.verbose)
+
+    metrics = {}
+    for name, bench in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        with harness.World() as world:
+            runner = world.runner()
+            harness.wait_idle(runner)
+            metrics.update(bench(world, runner, args))
+
+    params = dict((k, v) for k, v in vars(args).items() if k not in ('out', 'verbose', 'only'))
+    harness.write_results('runner', params, metrics, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Time to first service of the runner and WholeShow nodes, from process start.
+
+Each run starts a fresh interpreter with PERFORMANCES_STARTUP_PROFILE set and
+collects the marks the nodes report (imports, first_service, ready):
+
+    python bench/bench_startup.py --repeat 10 --out startup.json
+"""
+from __future__ import division, print_function
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import harness
+from harness import stats
+
+
+def child(node):
+    """ Starts the node the way its main block does """
+    world = harness.World()
+    if node == 'performances':
+        module = harness.load_script('runner')
+        harness.rospy.init_node('performances')
+        module.Runner()
+        module.startup.report()
+    else:
+        module = harness.load_script('wholeshow')
+        module.WholeShow()
+        harness.wait_for(lambda: module.startup.get('ready') is not None)
+    world.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--out')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    harness.configure_logging(args.verbose)
+    if args.child:
+        return child(args.child)
+
+    fd, path = tempfile.mkstemp(prefix='performances-startup-', suffix='.jsonl')
+    os.close(fd)
+    env = dict(os.environ, PERFORMANCES_STARTUP_PROFILE=path)
+    try:
+        for i in range(args.repeat):
+            for node in ['performances', 'wholeshow']:
+                subprocess.check_call([sys.executable, os.path.abspath(__file__), '--child', node], env=env)
+        with open(path) as f:
+            reports = [json.loads(line) for line in f if line.strip()]
+    finally:
+        os.remove(path)
+
+    marks = collections.defaultdict(list)
+    for report in reports:
+        node = 'runner' if report['node'] == 'performances' else report['node']
+        for name, seconds in report['marks'].items():
+            marks['startup_{}_{}_ms'.format(node, name)].append(seconds * 1000)
+    metrics = dict((name, stats(values)) for name, values in marks.items())
+    params = dict((k, v) for k, v in vars(args).items() if k not in ('out', 'verbose', 'child'))
+    harness.write_results('startup', params, metrics, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Loading a large generated performance with one load_performance request against
+load_begin, load_append chunks and load_commit.
+
+Each mode runs in a fresh interpreter, so the peak RSS growth it reports is
+the load alone. Time to run is from the first byte received until run(0) would
+succeed; the performance is not played meanwhile:
+
+    python bench/bench_stream.py --timelines 4 --nodes 20000 --chunk 500 --out stream.json
+"""
+from __future__ import division, print_function
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+import harness
+from harness import stats
+
+
+class Request(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def child(mode, path):
+    world = harness.World()
+    runner = world.runner()
+    harness.wait_idle(runner)
+    before = peak_rss_kb()
+    began = time.time()
+    to_run = None
+    with open(path) as f:
+        if mode == 'single':
+            runner.load_performance_callback(Request(performance=f.read()))
+            to_run = time.time() - began
+        else:
+            runner.load_begin_callback(Request(performance=f.readline()))
+            for line in f:
+                index, nodes = line.split('\t', 1)
+                runner.load_append_callback(Request(timeline=int(index), nodes=nodes))
+                if to_run is None and runner.loaded_time >= 0:
+                    to_run = time.time() - began
+            runner.load_commit_callback(None)
+    loaded = time.time() - began
+    print(json.dumps({'rss_kb': peak_rss_kb() - before, 'to_run': to_run, 'loaded': loaded}))
+    world.close()
+
+
+def write_documents(directory, args):
+    performance = generate.performance(args.timelines, args.nodes, seed=args.seed)
+    single = os.path.join(directory, 'single.json')
+    with open(single, 'w') as f:
+        json.dump(performance, f)
+    chunked = os.path.join(directory, 'chunked.jsonl')
+    with open(chunked, 'w') as f:
+        timelines = performance['timelines']
+        header = dict(performance, timelines=[dict(t, nodes=[]) for t in timelines])
+        f.write(json.dumps(header) + '\n')
+        for i, timeline in enumerate(timelines):
+            for j in range(0, len(timeline['nodes']), args.chunk):
+                f.write('{}\t{}\n'.format(i, json.dumps(timeline['nodes'][j:j + args.chunk])))
+    return single, chunked, os.path.getsize(single)
+
+
+def run(mode, path):
+    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', mode, path])
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--timelines', type=int, default=4)
+    parser.add_argument('--nodes', type=int, default=20000)
+    parser.add_argument('--chunk', type=int, default=500, help='nodes per load_append request')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    harness.configure_logging(args.verbose)
+    if args.child:
+        return child(*args.child)
+
+    directory = tempfile.mkdtemp(prefix='performances-bench-')
+    try:
+        single, chunked, size = write_documents(directory, args)
+        results = {'single': [], 'chunked': []}
+        for i in range(args.repeat):
+            results['single'].append(run('single', single))
+            results['chunked'].append(run('chunked', chunked))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    metrics = {'stream_document_kb': size / 1024.0}
+    for mode, runs in results.items():
+        metrics['stream_{}_peak_rss_kb'.format(mode)] = stats(r['rss_kb'] for r in runs)
+        metrics['stream_{}_to_run_ms'.format(mode)] = stats(r['to_run'] * 1000 for r in runs)
+        metrics['stream_{}_loaded_ms'.format(mode)] = stats(r['loaded'] * 1000 for r in runs)
+    params = dict((k, v) for k, v in vars(args).items() if k not in ('out', 'verbose', 'child'))
+    harness.write_results('stream', params, metrics, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Speech routing of WholeShow under load.
+
+Feeds utterances to WholeShow.speech_cb at a fixed rate, against a synthetic
+webui/performances tree and stub load_async and run_ticket services. A share
+of the utterances says a keyword of a random performance, the rest is chat.
+Parameter server calls can be slowed down to a round trip of a real master.
+Reports per utterance latency from speech_cb until it was handled, the time
+spent handling it, throughput and drops, for every library size and rate:
+
+    python bench/bench_wholeshow.py --performances 10 100 1000 --rates 2 10 50 --out wholeshow.json
+"""
+from __future__ import division, print_function
+import argparse
+import random
+import time
+
+import generate
+import harness
+from harness import BUS, stats
+
+
+def route(args, n_performances, rate):
+    from hr_msgs.msg import ChatMessage, Event
+    from std_srvs.srv import Trigger, TriggerResponse
+    from blender_api_msgs.srv import SetParam
+    import performances.srv as srv
+    rospy = harness.rospy
+    world = harness.World()
+    rospy.init_node('runner_stub')
+    events = rospy.Publisher('/performances/events', Event, queue_size=10)
+
+    def run_ticket(request):
+        events.publish(Event('running', 0))
+        events.publish(Event('finished', 0))
+        return srv.RunTicketResponse(True)
+
+    rospy.Service('/performances/load_async', srv.LoadAsync, lambda request: srv.LoadAsyncResponse(1))
+    rospy.Service('/performances/run_ticket', srv.RunTicket, run_ticket)
+    for name in ['/performances/reload_properties', '/performances/current']:
+        rospy.Service(name, Trigger, lambda request: TriggerResponse(True, ''))
+    rospy.Service('/blender_api/set_param', SetParam, lambda request: None)
+    tree = generate.performance_tree(n_performances, args.keywords, seed=args.seed)
+    BUS.set_param('/{}/webui/performances'.format(world.robot_name), tree)
+
+    get_param = rospy.get_param
+    if args.param_latency:
+        def slow_get_param(*a, **kw):
+            time.sleep(args.param_latency / 1000)
+            return get_param(*a, **kw)
+        rospy.get_param = slow_get_param
+    module = harness.load_script('wholeshow')
+    try:
+        show = module.WholeShow()
+        harness.wait_for(lambda: module.startup.get('ready') is not None)
+        # (seconds from speech_cb until handled, seconds handling, time handled)
+        handled = []
+        handle_speech = show.handle_speech
+
+        def timed_handle_speech(msg, received=None):
+            start = module.monotonic()
+            try:
+                handle_speech(msg, received)
+            finally:
+                now = module.monotonic()
+                handled.append((now - received, now - start, now))
+        show.handle_speech = timed_handle_speech
+
+        rng = random.Random(args.seed)
+        keywords = sum(keyword_lists(tree), [])
+        count = max(1, int(rate * args.duration))
+        began = module.monotonic()
+        for i in range(count):
+            delay = began + i / rate - module.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            words = [rng.choice(generate.WORDS) for _ in range(rng.randint(3, 12))]
+            if rng.random() < args.match:
+                words.insert(rng.randint(0, len(words)), rng.choice(keywords))
+            show.speech_cb(ChatMessage(utterance=' '.join(words), source='web'))
+        harness.wait_for(lambda: len(handled) + show.speech_dropped >= count, timeout=args.duration + 30)
+        finished = max(t for _, _, t in handled) if handled else module.monotonic()
+    finally:
+        rospy.get_param = get_param
+        world.close()
+    suffix = '_{}p_{:g}hz'.format(n_performances, rate)
+    return {
+        'wholeshow_route_ms' + suffix: stats(d * 1000 for d, _, _ in handled),
+        'wholeshow_handle_ms' + suffix: stats(d * 1000 for _, d, _ in handled),
+        'wholeshow_throughput_per_s' + suffix: len(handled) / max(1e-9, finished - began),
+        'wholeshow_dropped' + suffix: show.speech_dropped / count,
+    }
+
+
+def keyword_lists(tree):
+    """ Keyword lists of the performances in the tree """
+    result = []
+    for key, value in tree.items():
+        if key == 'properties':
+            if 'keywords' in value:
+                result.append(value['keywords'])
+        else:
+            result += keyword_lists(value)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--performances', type=int, nargs='+', default=[10, 100, 1000], help='library sizes')
+    parser.add_argument('--keywords', type=int, default=3, help='keywords per performance')
+    parser.add_argument('--rates', type=float, nargs='+', default=[2, 10, 50], help='utterances per second')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of speech per rate')
+    parser.add_argument('--match', type=float, default=0.2, help='share of utterances saying a keyword')
+    parser.add_argument('--param-latency', type=float, default=0.0, help='ms per parameter server call')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    harness.configure_logging(args.verbose)
+
+    metrics = {}
+    for n_performances in args.performances:
+        for rate in args.rates:
+            metrics.update(route(args, n_performances, rate))
+    params = dict((k, v) for k, v in vars(args).items() if k not in ('out', 'verbose'))
+    harness.write_results('wholeshow', params, metrics, args.out)
+
+
+if __name__ == '__main__':
+    main()
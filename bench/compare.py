@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Compares two benchmark result files:
+
+    python bench/compare.py base.json new.json [--stat p50] [--threshold 10]
+
+Exits with status 1 if any metric regressed by more than the threshold
+(percent). Metrics ending in _per_s are higher-is-better, all others
+lower-is-better.
+"""
+from __future__ import division, print_function
+import argparse
+import json
+import sys
+
+
+def flatten(metrics, prefix=''):
+    result = {}
+    for key, value in metrics.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            result.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            result[name] = value
+    return result
+
+
+def higher_is_better(name):
+    return name.split('.')[0].endswith('_per_s')
+
+
+def compare(base, new, stat, threshold):
+    base = flatten(base['metrics'])
+    new = flatten(new['metrics'])
+    rows = []
+    regressed = []
+    for name in sorted(set(base) & set(new)):
+        parts = name.split('.')
+        if len(parts) > 1 and parts[-1] in ('mean', 'min', 'p50', 'p95', 'p99', 'max') and parts[-1] != stat:
+            continue
+        if parts[-1] == 'n':
+            continue
+        b, n = base[name], new[name]
+        change = (n - b) / abs(b) * 100 if b else 0.0
+        worse = -change if higher_is_better(name) else change
+        if worse > threshold:
+            regressed.append(name)
+        rows.append((name, b, n, change, worse > threshold))
+    return rows, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--stat', default='p50', choices=['mean', 'min', 'p50', 'p95', 'p99', 'max'])
+    parser.add_argument('--threshold', type=float, default=10.0)
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print('base {} ({})  new {} ({})'.format(base['meta'].get('revision'), base['meta'].get('date'),
+                                              new['meta'].get('revision'), new['meta'].get('date')))
+    rows, regressed = compare(base, new, args.stat, args.threshold)
+    width = max([len(r[0]) for r in rows] + [6])
+    for name, b, n, change, bad in rows:
+        print('{:<{w}} {:>14.4f} {:>14.4f} {:>+9.1f}% {}'.format(name, b, n, change, 'REGRESSION' if bad else '',
+                                                                 w=width))
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,605 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+In-process stand-in for the ROS pieces used by the runner and WholeShow.
+
+Call install() before importing anything from performances. It registers
+fake rospy, rosgraph, hr_msgs, std_msgs, std_srvs, topic_tools,
+dynamic_reconfigure, rospkg and blender_api_msgs modules, and generates performances.srv/msg/cfg
+from the definitions in this repository, so the nodes can be exercised on a
+plain Linux box without a ROS master.
+
+All publishes are recorded on the shared BUS together with the wall time
+they happened at, which is what the benchmarks use to measure timing.
+"""
+from __future__ import print_function
+import collections
+import glob
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import types
+from SimpleXMLRPCServer import SimpleXMLRPCServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+
+logger = logging.getLogger('hr.performances.bench.fakeros')
+
+Published = collections.namedtuple('Published', ['time', 'topic', 'msg'])
+
+
+class Message(object):
+    """ Minimal genpy.Message look-alike: positional or keyword fields """
+    __slots__ = ['_connection_header']
+    _type = ''
+    _defaults = {}
+
+    def __init__(self, *args, **kwargs):
+        for i, name in enumerate(self.__slots__):
+            if i < len(args):
+                value = args[i]
+            elif name in kwargs:
+                value = kwargs[name]
+            else:
+                value = self._defaults.get(name)
+                if callable(value):
+                    value = value()
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return type(self) == type(other) and \
+               all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return '{}({})'.format(self._type, ', '.join('{}={!r}'.format(n, getattr(self, n)) for n in self.__slots__))
+
+
+def message(type_name, fields, **defaults):
+    cls = type(str(type_name.split('/')[-1]), (Message,), {'__slots__': list(fields)})
+    cls._type = type_name
+    cls._defaults = defaults
+    return cls
+
+
+class Duration(object):
+    def __init__(self, secs=0, nsecs=0):
+        self.secs = secs
+        self.nsecs = nsecs
+
+    @classmethod
+    def from_sec(cls, sec):
+        secs = int(sec)
+        return cls(secs, int((sec - secs) * 1e9))
+
+    def to_sec(self):
+        return self.secs + self.nsecs / 1e9
+
+    def __eq__(self, other):
+        return isinstance(other, Duration) and self.to_sec() == other.to_sec()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'Duration({}, {})'.format(self.secs, self.nsecs)
+
+
+class Time(Duration):
+    @classmethod
+    def now(cls):
+        return cls.from_sec(BUS.time())
+
+
+# ROS type name -> python default
+_PRIMITIVES = {
+    'bool': lambda: False, 'string': lambda: '', 'duration': Duration, 'time': Time,
+}
+
+
+def _default(ros_type):
+    if ros_type.endswith(']'):
+        return list
+    if ros_type in _PRIMITIVES:
+        return _PRIMITIVES[ros_type]
+    if 'int' in ros_type or 'float' in ros_type:
+        return lambda: 0
+    return lambda: None
+
+
+def parse_definition(name, text):
+    """ Builds message classes from .msg or .srv definition text """
+    sections = []
+    for part in re.split(r'^---\s*$', text, flags=re.M):
+        fields = []
+        defaults = {}
+        for line in part.splitlines():
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            ros_type, field = line.split()[:2]
+            fields.append(field)
+            defaults[field] = _default(ros_type)
+        sections.append((fields, defaults))
+    return sections
+
+
+class Bus(object):
+    """ Shared in-process topic, service and parameter registry """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.RLock()
+        self.params = {}
+        self.subscribers = collections.defaultdict(list)
+        # Last message of latched topics, delivered to later subscribers
+        self.latched = {}
+        self.services = {}
+        self.reconfigure_servers = {}
+        self.published = []
+        self.record = True
+        self.service_calls = collections.Counter()
+        self.node_name = '/unnamed'
+        # Wall time source. Simulations replace it with a virtual clock.
+        self.time = time.time
+        self._deliveries = collections.deque()
+        self._delivery_ready = threading.Event()
+        self._dispatcher = None
+
+    # Names
+    def resolve(self, name):
+        if name.startswith('~'):
+            return (self.node_name + '/' + name[1:]).rstrip('/')
+        if not name.startswith('/'):
+            return '/' + name
+        return name
+
+    # Topics
+    def publish(self, topic, msg, latch=False):
+        if latch:
+            self.latched[topic] = msg
+        if self.record:
+            self.published.append(Published(self.time(), topic, msg))
+        callbacks = list(self.subscribers.get(topic, []))
+        if callbacks:
+            self._deliveries.append((callbacks, msg))
+            self._start_dispatcher()
+            self._delivery_ready.set()
+
+    def _start_dispatcher(self):
+        # Subscriber callbacks run on a separate thread like they do in rospy,
+        # so publishing while holding a lock does not re-enter the publisher.
+        if self._dispatcher is None:
+            self._dispatcher = threading.Thread(target=self._dispatch, args=(self._deliveries, self._delivery_ready))
+            self._dispatcher.daemon = True
+            self._dispatcher.start()
+
+    @staticmethod
+    def _dispatch(deliveries, ready):
+        while True:
+            ready.wait()
+            ready.clear()
+            while deliveries:
+                callbacks, msg = deliveries.popleft()
+                for cb in callbacks:
+                    try:
+                        cb(msg)
+                    except Exception as ex:
+                        logger.exception(ex)
+
+    def drain(self, timeout=1.0):
+        """ Waits until all queued subscriber callbacks were delivered """
+        end = time.time() + timeout
+        while self._deliveries and time.time() < end:
+            time.sleep(0.001)
+
+    def messages(self, topic):
+        return [p for p in self.published if p.topic == topic]
+
+    # Parameters
+    def _split(self, name):
+        return [p for p in self.resolve(name).split('/') if p]
+
+    def get_param(self, name, default=KeyError):
+        with self.lock:
+            value = self.params
+            for key in self._split(name):
+                if not isinstance(value, dict) or key not in value:
+                    if default is KeyError:
+                        raise KeyError(name)
+                    return default
+                value = value[key]
+            return value
+
+    def set_param(self, name, value):
+        with self.lock:
+            keys = self._split(name)
+            d = self.params
+            for key in keys[:-1]:
+                if not isinstance(d.get(key), dict):
+                    d[key] = {}
+                d = d[key]
+            d[keys[-1]] = value
+
+    def has_param(self, name):
+        return self.get_param(name, None) is not None
+
+    def delete_param(self, name):
+        with self.lock:
+            keys = self._split(name)
+            d = self.params
+            for key in keys[:-1]:
+                d = d.get(key, {})
+            if keys[-1] not in d:
+                raise KeyError(name)
+            del d[keys[-1]]
+
+
+BUS = Bus()
+
+
+class Master(object):
+    """ Parameter API of the ROS master over XML-RPC, backed by BUS, with system.multicall as rosmaster has """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.server = None
+        # XML-RPC requests served, a multicall is one
+        self.requests = 0
+
+    def uri(self):
+        with self.lock:
+            if self.server is None:
+                master = self
+
+                class Server(SimpleXMLRPCServer):
+                    def _marshaled_dispatch(self, *args, **kwargs):
+                        master.requests += 1
+                        return SimpleXMLRPCServer._marshaled_dispatch(self, *args, **kwargs)
+
+                self.server = Server(('127.0.0.1', 0), logRequests=False, allow_none=True)
+                self.server.register_multicall_functions()
+                for name in ['getParam', 'setParam', 'deleteParam']:
+                    self.server.register_function(getattr(self, name), name)
+                thread = threading.Thread(target=self.server.serve_forever)
+                thread.setDaemon(True)
+                thread.start()
+            return 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def getParam(self, caller_id, key):
+        try:
+            return [1, key, BUS.get_param(key)]
+        except KeyError:
+            return [-1, 'Parameter [{}] is not set'.format(key), 0]
+
+    def setParam(self, caller_id, key, value):
+        BUS.set_param(key, value)
+        return [1, 'parameter {} set'.format(key), 0]
+
+    def deleteParam(self, caller_id, key):
+        try:
+            BUS.delete_param(key)
+        except KeyError:
+            return [-1, 'parameter [{}] is not set'.format(key), 0]
+        return [1, 'parameter {} deleted'.format(key), 0]
+
+
+MASTER = Master()
+
+
+# rospy
+class ROSException(Exception):
+    pass
+
+
+class ServiceException(ROSException):
+    pass
+
+
+class ParameterInvalid(ValueError):
+    pass
+
+
+class Publisher(object):
+    def __init__(self, name, data_class, queue_size=None, latch=False):
+        self.name = BUS.resolve(name)
+        self.data_class = data_class
+        self.latch = latch
+
+    def publish(self, *args, **kwargs):
+        if len(args) == 1 and isinstance(args[0], self.data_class):
+            msg = args[0]
+        else:
+            msg = self.data_class(*args, **kwargs)
+        # rospy tells subscribers which node published
+        msg._connection_header = {'callerid': BUS.node_name}
+        BUS.publish(self.name, msg, self.latch)
+
+    def get_num_connections(self):
+        return len(BUS.subscribers.get(self.name, []))
+
+    def unregister(self):
+        pass
+
+
+class Subscriber(object):
+    def __init__(self, name, data_class, callback=None, queue_size=None):
+        self.name = BUS.resolve(name)
+        self.callback = callback
+        BUS.subscribers[self.name].append(callback)
+        if callback and self.name in BUS.latched:
+            BUS._deliveries.append(([callback], BUS.latched[self.name]))
+            BUS._start_dispatcher()
+            BUS._delivery_ready.set()
+
+    def unregister(self):
+        if self.callback in BUS.subscribers.get(self.name, []):
+            BUS.subscribers[self.name].remove(self.callback)
+
+
+class Service(object):
+    def __init__(self, name, service_class, handler):
+        self.name = BUS.resolve(name)
+        BUS.services[self.name] = (service_class, handler)
+
+    def shutdown(self, reason=''):
+        BUS.services.pop(self.name, None)
+
+
+class ServiceProxy(object):
+    """ Calls in-process services. Services nobody provides succeed silently """
+
+    def __init__(self, name, service_class, persistent=False):
+        self.name = BUS.resolve(name)
+        self.service_class = service_class
+
+    def __call__(self, *args, **kwargs):
+        BUS.service_calls[self.name] += 1
+        if BUS.record:
+            BUS.published.append(Published(BUS.time(), self.name, args))
+        if self.name in BUS.services:
+            service_class, handler = BUS.services[self.name]
+            request = args[0] if len(args) == 1 and isinstance(args[0], service_class._request_class) \
+                else service_class._request_class(*args, **kwargs)
+            return handler(request)
+        return None
+
+    call = __call__
+
+    def close(self):
+        pass
+
+
+def _global_name(name):
+    def validator(param, context):
+        if not param or not str(param).startswith('/'):
+            raise ParameterInvalid("{} must be a global name".format(name))
+        return param
+    return validator
+
+
+def _rospy():
+    rospy = types.ModuleType('rospy')
+    names = types.ModuleType('rospy.names')
+    names.global_name = _global_name
+    names.ParameterInvalid = ParameterInvalid
+    rospy.names = names
+    log = logging.getLogger('rospy')
+
+    def init_node(name, **kwargs):
+        BUS.node_name = BUS.resolve(name)
+
+    rospy.init_node = init_node
+    rospy.spin = lambda: None
+    rospy.is_shutdown = lambda: False
+    rospy.on_shutdown = lambda hook: None
+    rospy.sleep = time.sleep
+    rospy.get_name = lambda: BUS.node_name
+    rospy.get_param = BUS.get_param
+    rospy.set_param = BUS.set_param
+    rospy.has_param = BUS.has_param
+    rospy.delete_param = BUS.delete_param
+    rospy.wait_for_service = lambda name, timeout=None: None
+    rospy.wait_for_message = lambda name, data_class, timeout=None: data_class()
+    rospy.logdebug = log.debug
+    rospy.loginfo = log.info
+    rospy.logwarn = log.warning
+    rospy.logerr = log.error
+    rospy.logfatal = log.critical
+    rospy.Publisher = Publisher
+    rospy.Subscriber = Subscriber
+    rospy.Service = Service
+    rospy.ServiceProxy = ServiceProxy
+    rospy.Duration = Duration
+    rospy.Time = Time
+    rospy.ROSException = ROSException
+    rospy.ServiceException = ServiceException
+    return {'rospy': rospy, 'rospy.names': names}
+
+
+def _module(name, **attrs):
+    m = types.ModuleType(name)
+    for k, v in attrs.items():
+        setattr(m, k, v)
+    return m
+
+
+def _service(type_name, request, response):
+    srv = type(str(type_name.split('/')[-1]), (object,), {})
+    srv._type = type_name
+    srv._request_class = message(type_name + 'Request', request[0], **request[1])
+    srv._response_class = message(type_name + 'Response', response[0], **response[1])
+    return srv
+
+
+def _add_service(module, srv):
+    name = srv.__name__
+    setattr(module, name, srv)
+    setattr(module, name + 'Request', srv._request_class)
+    setattr(module, name + 'Response', srv._response_class)
+
+
+def _hr_msgs():
+    msg = _module('hr_msgs.msg')
+    for name, fields, defaults in [
+        ('ChatMessage', ['utterance', 'lang', 'confidence', 'source', 'audio_path'], {}),
+        ('Event', ['event', 'time'], {}),
+        ('MakeFaceExpr', ['exprname', 'intensity'], {}),
+        ('PlayAnimation', ['animation', 'fps'], {}),
+        ('SetGesture', ['name', 'repeat', 'speed', 'magnitude'], {}),
+        ('EmotionState', ['name', 'magnitude', 'duration'], {'duration': Duration}),
+        ('Target', ['x', 'y', 'z', 'speed'], {}),
+        ('SomaState', ['name', 'magnitude', 'rate', 'ease_in'], {'ease_in': Duration}),
+        ('TTS', ['text', 'lang'], {}),
+    ]:
+        setattr(msg, name, message('hr_msgs/' + name, fields, **defaults))
+    return {'hr_msgs': _module('hr_msgs', msg=msg), 'hr_msgs.msg': msg}
+
+
+def _std():
+    msg = _module('std_msgs.msg')
+    for name in ['String', 'Int32', 'Float32', 'Float64', 'Bool']:
+        setattr(msg, name, message('std_msgs/' + name, ['data']))
+    std_srvs = _module('std_srvs.srv')
+    _add_service(std_srvs, _service('std_srvs/Trigger', ([], {}), (['success', 'message'], {})))
+    _add_service(std_srvs, _service('std_srvs/Empty', ([], {}), ([], {})))
+    topic_tools = _module('topic_tools.srv')
+    _add_service(topic_tools, _service('topic_tools/MuxSelect', (['topic'], {}), (['prev_topic'], {})))
+    blender = _module('blender_api_msgs.srv')
+    _add_service(blender, _service('blender_api_msgs/SetParam', (['key', 'value'], {}), (['success'], {})))
+    return {
+        'std_msgs': _module('std_msgs', msg=msg), 'std_msgs.msg': msg,
+        'std_srvs': _module('std_srvs', srv=std_srvs), 'std_srvs.srv': std_srvs,
+        'topic_tools': _module('topic_tools', srv=topic_tools), 'topic_tools.srv': topic_tools,
+        'blender_api_msgs': _module('blender_api_msgs', srv=blender), 'blender_api_msgs.srv': blender,
+    }
+
+
+class Config(dict):
+    """ dynamic_reconfigure config: both item and attribute access """
+    __getattr__ = dict.__getitem__
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+def _cfg_defaults(path):
+    defaults = Config()
+    with open(path) as f:
+        for m in re.finditer(r'gen\.add\(\s*"(\w+)"\s*,\s*(\w+)\s*,[^,]*,\s*"[^"]*"\s*,\s*([^,)]+)', f.read()):
+            name, kind, value = m.groups()
+            value = value.strip()
+            if kind == 'bool_t':
+                value = value == 'True'
+            elif kind == 'int_t':
+                value = int(value)
+            elif kind == 'double_t':
+                value = float(value)
+            else:
+                value = value.strip('"\'')
+            defaults[name] = value
+    return defaults
+
+
+class ReconfigureServer(object):
+    def __init__(self, config_type, callback, namespace=None):
+        self.callback = callback
+        self.config = self.callback(Config(config_type.defaults), 0) or Config(config_type.defaults)
+        name = namespace or BUS.node_name
+        BUS.reconfigure_servers[BUS.resolve(name)] = self
+
+    def update_configuration(self, changes):
+        config = Config(self.config)
+        config.update(changes)
+        self.config = self.callback(config, 0) or config
+        return self.config
+
+
+class ReconfigureClient(object):
+    def __init__(self, name, timeout=None, config_callback=None):
+        name = BUS.resolve(name)
+        if name not in BUS.reconfigure_servers:
+            raise ROSException('Timeout waiting for {}'.format(name))
+        self.server = BUS.reconfigure_servers[name]
+
+    def update_configuration(self, changes):
+        return self.server.update_configuration(changes)
+
+    def get_configuration(self, timeout=None):
+        return self.server.config
+
+    def close(self):
+        pass
+
+
+def _dynamic_reconfigure():
+    server = _module('dynamic_reconfigure.server', Server=ReconfigureServer)
+    client = _module('dynamic_reconfigure.client', Client=ReconfigureClient)
+    return {
+        'dynamic_reconfigure': _module('dynamic_reconfigure', server=server, client=client),
+        'dynamic_reconfigure.server': server,
+        'dynamic_reconfigure.client': client,
+    }
+
+
+def _performances():
+    """ Generates the catkin build products of this package from srv/, msg/ and cfg/ """
+    if SRC not in sys.path:
+        sys.path.insert(0, SRC)
+    import performances
+    srv = _module('performances.srv')
+    for path in sorted(glob.glob(os.path.join(ROOT, 'srv', '*.srv'))):
+        name = os.path.basename(path)[:-4]
+        with open(path) as f:
+            sections = parse_definition(name, f.read())
+        _add_service(srv, _service('performances/' + name, sections[0], sections[1]))
+    msg = _module('performances.msg')
+    for path in sorted(glob.glob(os.path.join(ROOT, 'msg', '*.msg'))):
+        name = os.path.basename(path)[:-4]
+        with open(path) as f:
+            fields, defaults = parse_definition(name, f.read())[0]
+        setattr(msg, name, message('performances/' + name, fields, **defaults))
+    cfg = _module('performances.cfg')
+    for path in sorted(glob.glob(os.path.join(ROOT, 'cfg', '*.cfg'))):
+        name = os.path.basename(path)[:-4]
+        config_type = type(str(name + 'Config'), (object,), {'defaults': _cfg_defaults(path)})
+        setattr(cfg, name + 'Config', config_type)
+    performances.srv = srv
+    performances.msg = msg
+    performances.cfg = cfg
+    return {'performances.srv': srv, 'performances.msg': msg, 'performances.cfg': cfg}
+
+
+class RosPack(object):
+    def get_path(self, name):
+        return ROOT
+
+
+def install():
+    """ Registers the stand-in modules. Safe to call more than once """
+    if 'rospy' in sys.modules and getattr(sys.modules['rospy'], '__fake__', False):
+        return BUS
+    modules = {}
+    modules.update(_rospy())
+    modules.update(_hr_msgs())
+    modules.update(_std())
+    modules.update(_dynamic_reconfigure())
+    modules['rospkg'] = _module('rospkg', RosPack=RosPack)
+    modules['rosgraph'] = _module('rosgraph', get_master_uri=lambda env=None: MASTER.uri())
+    sys.modules.update(modules)
+    sys.modules['rospy'].__fake__ = True
+    sys.modules.update(_performances())
+    return BUS
+
+
+def reset():
+    """ Forgets all topics, services and parameters between scenarios """
+    BUS.reset()
+    return BUS
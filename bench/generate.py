@@ -0,0 +1,118 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Synthetic performance generators for the benchmarks.
+
+Nodes carry the same fields the web UI writes, so they go through the same
+code paths as authored content. Everything is driven by a seeded
+random.Random so runs are comparable across commits.
+"""
+import os
+import random
+
+import yaml
+
+# Node types which do not pause the runner or block the worker thread
+NON_BLOCKING = ['speech', 'gesture', 'arm_animation', 'emotion', 'soma', 'look_at', 'gaze_at', 'kfanimation',
+                'head_rotation']
+# Types that call services or sleep on the worker thread
+BLOCKING = ['expression', 'interaction']
+
+WORDS = ['hello', 'robot', 'people', 'today', 'wonderful', 'science', 'future', 'kindness', 'music', 'light',
+         'question', 'answer', 'story', 'morning', 'evening', 'friend']
+REGION_TYPES = ['face', 'audience', 'poi']
+
+
+def speech(rng):
+    text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 20)))
+    if rng.random() < 0.2:
+        text += ' {name}'
+    return {'text': text, 'lang': rng.choice(['en-US', 'en', 'zh']), 'pitch': rng.choice([1.0, 1.1]),
+            'speed': rng.choice([1.0, 0.9]), 'volume': 1.0}
+
+
+GENERATORS = {
+    'speech': speech,
+    'gesture': lambda rng: {'gesture': rng.choice(['nod-1', 'shake-2', 'blink']), 'speed': 1,
+                            'magnitude': rng.choice([0.9, [0.5, 1.0]])},
+    'arm_animation': lambda rng: {'arm_animation': 'wave', 'speed': 1, 'magnitude': 1},
+    'emotion': lambda rng: {'emotion': rng.choice(['happy', 'sad', 'surprised']), 'magnitude': [0.3, 0.9]},
+    'soma': lambda rng: {'soma': rng.choice(['normal', 'breathing', 'normal-saccades'])},
+    'look_at': lambda rng: {'attention_region': rng.choice(REGION_TYPES + ['custom']), 'interval': 1,
+                            'x': 1, 'y': rng.uniform(-0.5, 0.5), 'z': rng.uniform(-0.3, 0.3), 'speed': 1},
+    'gaze_at': lambda rng: {'attention_region': rng.choice(REGION_TYPES), 'interval': 0.5, 'x': 1, 'y': 0, 'z': 0},
+    'kfanimation': lambda rng: {'animation': 'anim-{}'.format(rng.randint(1, 9)), 'fps': 48,
+                                'blender_mode': rng.choice(['off', 'face'])},
+    'head_rotation': lambda rng: {'angle': rng.uniform(-0.3, 0.3)},
+    'expression': lambda rng: {'expression': rng.choice(['happy', 'sad']), 'magnitude': 0.8},
+    'interaction': lambda rng: {'mode': 1, 'chat': ''},
+}
+
+
+def node(kind, start_time, duration, rng):
+    data = GENERATORS[kind](rng)
+    data.update({'name': kind, 'start_time': round(start_time, 3), 'duration': round(duration, 3)})
+    return data
+
+
+def timeline(m_nodes, rng, kinds=None, length=None, duration=(0.5, 3.0)):
+    """ Timeline with m_nodes spread evenly over length seconds """
+    kinds = kinds or NON_BLOCKING
+    length = length if length is not None else m_nodes * 0.5
+    nodes = []
+    for i in range(m_nodes):
+        start = length * i / float(max(1, m_nodes))
+        nodes.append(node(kinds[i % len(kinds)], start, rng.uniform(*duration), rng))
+    return {'nodes': nodes}
+
+
+def performance(n_timelines, m_nodes, seed=0, **kwargs):
+    """ In-memory performance in the format Runner.load produces """
+    rng = random.Random(seed)
+    timelines = []
+    for i in range(n_timelines):
+        t = timeline(m_nodes, rng, **kwargs)
+        t.update({'id': 'bench/perf/{}'.format(i), 'name': str(i), 'path': 'bench/perf'})
+        timelines.append(t)
+    return {'id': 'bench/perf', 'name': 'perf', 'path': 'bench', 'timelines': timelines}
+
+
+def regions(rng, count=6):
+    result = []
+    for i in range(count):
+        result.append({'type': REGION_TYPES[i % len(REGION_TYPES)], 'x': rng.uniform(-1, 0.5),
+                       'y': rng.uniform(-0.5, 0.8), 'width': rng.uniform(0.1, 0.6), 'height': rng.uniform(0.1, 0.4)})
+    return result
+
+
+def performance_tree(n_performances, n_keywords, seed=0, per_folder=10):
+    """
+    webui/performances parameter of a library of n_performances in folders of per_folder, each with
+    n_keywords keywords. Keywords end with a number, so utterances made of WORDS never match them.
+    """
+    rng = random.Random(seed)
+    tree = {}
+    for i in range(n_performances):
+        folder = tree.setdefault('folder-{}'.format(i // per_folder), {'properties': {}})
+        keywords = ['{} {}'.format(rng.choice(WORDS), i * n_keywords + k) for k in range(n_keywords)]
+        folder['perf-{}'.format(i)] = {'properties': {'keywords': keywords, 'variables': {'name': 'friend'}}}
+    return tree
+
+
+def write_library(root, robot_name, n_timelines, m_nodes, seed=0, folder='bench/perf', **kwargs):
+    """
+    Writes a performance folder with n_timelines YAML files to
+    PERFORMANCES_DIR/<robot_name>/<folder> and returns its id
+    """
+    rng = random.Random(seed)
+    path = os.path.join(root, robot_name, folder)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for i in range(n_timelines):
+        with open(os.path.join(path, '{}.yaml'.format(i)), 'w') as f:
+            yaml.safe_dump(timeline(m_nodes, rng, **kwargs), f, default_flow_style=False)
+    with open(os.path.join(path, '.properties'), 'w') as f:
+        yaml.safe_dump({'regions': regions(rng), 'variables': {'name': 'friend'}}, f, default_flow_style=False)
+    common = os.path.join(root, 'common')
+    if not os.path.isdir(common):
+        os.makedirs(common)
+    return folder
@@ -0,0 +1,210 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Shared plumbing for the benchmarks: fake ROS world setup, loading the
+runner script as a module, statistics and machine-readable results.
+"""
+from __future__ import division, print_function
+import datetime
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import fakeros
+
+BUS = fakeros.install()
+import rospy  # noqa: E402, the stand-in registered by install()
+ROOT = fakeros.ROOT
+ROBOT_NAME = 'bench_robot'
+
+
+def load_script(name):
+    """ Imports scripts/<name>.py as a module without running its main block """
+    path = os.path.join(ROOT, 'scripts', name + '.py')
+    module_name = 'performances_' + name
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    try:
+        import imp
+        return imp.load_source(module_name, path)
+    except ImportError:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+        return module
+
+
+class World(object):
+    """ PERFORMANCES_DIR (temporary unless given) plus a fresh fake ROS graph """
+
+    def __init__(self, robot_name=ROBOT_NAME, performances_dir=None):
+        fakeros.reset()
+        self.robot_name = robot_name
+        self.temporary = performances_dir is None
+        self.dir = tempfile.mkdtemp(prefix='performances-bench-') if self.temporary else performances_dir
+        for name in ['common', robot_name]:
+            if not os.path.isdir(os.path.join(self.dir, name)):
+                os.makedirs(os.path.join(self.dir, name))
+        os.environ['PERFORMANCES_DIR'] = self.dir
+        BUS.set_param('/robot_name', robot_name)
+        BUS.set_param('/performances/trace_file', os.path.join(self.dir, 'performances-{robot}.trace'))
+
+    def runner(self, **kwargs):
+        rospy.init_node('performances')
+        return load_script('runner').Runner(**kwargs)
+
+    def close(self):
+        if self.temporary:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def wait_for(predicate, timeout=5.0, interval=0.001):
+    end = time.time() + timeout
+    while not predicate():
+        if time.time() >= end:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def wait_idle(runner, timeout=5.0):
+    """ Waits until the worker thread is parked on its run condition again """
+    condition = runner.run_condition
+    waiters = getattr(condition, '_Condition__waiters', None)
+    if waiters is None:
+        waiters = condition._waiters
+    return wait_for(lambda: len(waiters) > 0, timeout)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def stats(values):
+    values = list(values)
+    if not values:
+        return {'n': 0}
+    return {
+        'n': len(values),
+        'mean': sum(values) / len(values),
+        'min': min(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values),
+    }
+
+
+def timed(fn, repeat):
+    """ Calls fn repeat times, returns durations in milliseconds """
+    result = []
+    for _ in range(repeat):
+        t = time.time()
+        fn()
+        result.append((time.time() - t) * 1000)
+    return result
+
+
+def rss_bytes():
+    """ Resident set size of this process """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def deep_size(obj, seen=None):
+    """
+    Bytes reachable from obj, not counting objects whose id is in seen.
+    Deterministic, unlike RSS, so it compares well across commits.
+    """
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        else:
+            if hasattr(o, '__dict__'):
+                stack.append(o.__dict__)
+            for cls in type(o).__mro__:
+                for name in cls.__dict__.get('__slots__', ()):
+                    if hasattr(o, name) and name != '__weakref__':
+                        stack.append(getattr(o, name))
+    return size
+
+
+def memory_snapshot():
+    gc.collect()
+    return {'rss': rss_bytes(), 'objects': len(gc.get_objects())}
+
+
+def memory_delta(before, after):
+    return {'rss_kb': (after['rss'] - before['rss']) / 1024.0, 'objects': after['objects'] - before['objects']}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=open(os.devnull, 'w')).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def metadata(params):
+    return {
+        'revision': git_revision(),
+        'date': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+        'params': params,
+    }
+
+
+def write_results(name, params, metrics, out=None):
+    results = {'benchmark': name, 'meta': metadata(params), 'metrics': metrics}
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if out:
+        with open(out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return results
+
+
+def configure_logging(verbose=False):
+    logging.basicConfig(level=logging.INFO if verbose else logging.ERROR,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Stub TTS consumer of the runner lookahead topic.
+
+StubTTS models a synthesis engine which needs base + per_char seconds per
+utterance and handles one utterance at a time. With lookahead it starts
+synthesizing announced speech ahead of time, so by the time the TTS message
+arrives the audio is often ready already. attach() hooks it to the ROS
+topics of a running robot.
+
+Run as a script it plays a synthetic speech performance on the virtual
+clock with and without lookahead and reports time from the TTS message to
+audio ready:
+
+    python bench/lookahead_tts.py --lookahead 5 --out lookahead.json
+"""
+from __future__ import division, print_function
+import argparse
+import json
+import shutil
+import tempfile
+
+import generate
+import harness
+import simulate
+from harness import stats
+
+
+class StubTTS(object):
+    def __init__(self, base=0.3, per_char=0.01, use_lookahead=True):
+        self.base = base
+        self.per_char = per_char
+        self.use_lookahead = use_lookahead
+        # (text, lang) -> time audio is ready
+        self.ready = {}
+        self.busy_until = 0
+        self.latencies = []
+        self.hits = 0
+
+    def synthesize(self, key, now):
+        start = max(now, self.busy_until)
+        self.busy_until = start + self.base + self.per_char * len(key[0])
+        self.ready[key] = self.busy_until
+        return self.busy_until
+
+    def on_lookahead(self, data, now):
+        if not self.use_lookahead or data.get('event') != 'upcoming':
+            return
+        for node in data['nodes']:
+            if node['name'] == 'speech':
+                key = (node['text'], node['lang'])
+                if key not in self.ready:
+                    self.synthesize(key, now)
+
+    def on_tts(self, text, lang, now):
+        key = (text, lang)
+        if key in self.ready:
+            self.hits += 1
+            ready = self.ready.pop(key)
+        else:
+            ready = self.synthesize(key, now)
+            del self.ready[key]
+        latency = max(0.0, ready - now)
+        self.latencies.append(latency)
+        return latency
+
+    def attach(self, robot_name):
+        """ Subscribes to the runner topics, using wall clock time """
+        import time
+        import rospy
+        from hr_msgs.msg import TTS
+        from std_msgs.msg import String
+        rospy.Subscriber('/performances/lookahead', String, lambda msg: self.on_lookahead(json.loads(msg.data),
+                                                                                          time.time()))
+        rospy.Subscriber('/{}/tts'.format(robot_name), TTS, lambda msg: self.on_tts(msg.text, msg.lang, time.time()))
+
+
+def announced_at(record):
+    # Announcements are published in background, the virtual clock may have moved on since the worker made them
+    if record['topic'] != '/performances/lookahead':
+        return record['t']
+    nodes = json.loads(record['msg']['data']).get('nodes', [])
+    return min([n['stamp'] - n['eta'] for n in nodes] or [record['t']])
+
+
+def replay(trace, robot_name, tts):
+    """ Feeds a simulated trace to the consumer in announcement and publish order """
+    for t, record in sorted(((announced_at(r), r) for r in trace), key=lambda entry: entry[0]):
+        if record['topic'] == '/performances/lookahead':
+            tts.on_lookahead(json.loads(record['msg']['data']), t)
+        elif record['topic'] == '/{}/tts'.format(robot_name):
+            tts.on_tts(record['msg']['text'], record['msg']['lang'], t)
+    return tts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lookahead', type=float, default=5.0, help='horizon, seconds')
+    parser.add_argument('--utterances', type=int, default=60)
+    parser.add_argument('--spacing', type=float, default=2.0, help='seconds between speech nodes')
+    parser.add_argument('--base', type=float, default=0.3, help='synthesis time per utterance, seconds')
+    parser.add_argument('--per-char', type=float, default=0.01, help='synthesis time per character, seconds')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    harness.configure_logging(args.verbose)
+
+    performances_dir = tempfile.mkdtemp(prefix='performances-bench-')
+    robot_name = harness.ROBOT_NAME
+    folder = generate.write_library(performances_dir, robot_name, 1, args.utterances * 2, seed=args.seed,
+                                    kinds=['speech', 'gesture'], length=args.utterances * args.spacing)
+    metrics = {}
+    for name, horizon in [('without', 0.0), ('with', args.lookahead)]:
+        events = [{'time': 0, 'action': 'config', 'values': {'lookahead': horizon, 'autopause': False}}]
+        summary, trace = simulate.simulate(performances_dir, robot_name, folder, events)
+        tts = replay(trace, robot_name, StubTTS(args.base, args.per_char, use_lookahead=horizon > 0))
+        metrics['tts_latency_ms_' + name + '_lookahead'] = stats(l * 1000 for l in tts.latencies)
+        metrics['tts_cache_hits_' + name + '_lookahead'] = tts.hits
+    shutil.rmtree(performances_dir, ignore_errors=True)
+    params = dict((k, v) for k, v in vars(args).items() if k not in ('out', 'verbose'))
+    harness.write_results('lookahead_tts', params, metrics, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Plays a performance on a virtual clock, faster than real time, and writes
+the trace of everything the runner published.
+
+    python bench/simulate.py $PERFORMANCES_DIR sophia shared/wakeup \\
+        --script events.yaml --trace trace.jsonl
+
+The script is a YAML list of events run at their virtual time (seconds
+since the performance started):
+
+    - {time: 12.5, action: speech, text: 'yes please'}   # SPEECH event for pause nodes
+    - {time: 30, action: pause}
+    - {time: 35, action: resume}
+    - {time: 40, action: event, name: HAND, data: 'raise'}
+    - {time: 41, action: param, name: /sophia/some_flag, value: true}
+    - {time: 0, action: config, values: {autopause: false}}   # dynamic reconfigure
+    - {time: 60, action: run, start: 120}               # seek
+    - {time: 90, action: stop}
+
+Playback ends when the runner goes idle, or stops when the worker waits for
+an external event (chat, pause nodes without timeout) and the script has
+nothing left to deliver.
+"""
+from __future__ import division, print_function
+import argparse
+import collections
+import json
+import sys
+import threading
+import time
+
+import yaml
+
+import harness
+from harness import BUS
+from fakeros import Duration, Message
+from performances.clock import VirtualClock
+
+
+def to_data(value):
+    if isinstance(value, Message):
+        return dict((name, to_data(getattr(value, name))) for name in value.__slots__)
+    if isinstance(value, Duration):
+        return value.to_sec()
+    if isinstance(value, (list, tuple)):
+        return [to_data(v) for v in value]
+    return value
+
+
+def script_action(runner, event, threads):
+    action = event['action']
+    if action == 'pause':
+        return runner.pause
+    if action == 'resume':
+        return runner.resume
+    if action == 'stop':
+        return runner.stop
+    if action == 'run':
+        # run() waits for the worker to go idle, so it can't be called from the worker thread
+        def seek():
+            runner.stop()
+            threads.append(threading.Thread(target=runner.run, args=(event.get('start', 0),)))
+            threads[-1].start()
+        return seek
+    if action == 'speech':
+        return lambda: runner.notify('SPEECH', event['text'])
+    if action == 'event':
+        return lambda: runner.notify(event['name'], event.get('data'))
+    if action == 'param':
+        return lambda: BUS.set_param(event['name'], event['value'])
+    if action == 'config':
+        return lambda: BUS.reconfigure_servers[BUS.node_name].update_configuration(event['values'])
+    raise ValueError('Unknown action {}'.format(action))
+
+
+def simulate(performances_dir, robot_name, id, events=(), start=0.0, limit=None, timeout=60):
+    world = harness.World(robot_name, performances_dir)
+    stalled = []
+    runner_ref = []
+    threads = []
+
+    def on_stall():
+        stalled.append(clock.time())
+        runner_ref[0].stop()
+
+    clock = VirtualClock(limit=limit, on_stall=on_stall)
+    BUS.time = clock.time
+    runner = world.runner(clock=clock)
+    runner_ref.append(runner)
+    harness.wait_idle(runner)
+
+    for event in events:
+        clock.call_at(float(event['time']), script_action(runner, event, threads))
+
+    began = time.time()
+    if not (runner.load_folder(id) or runner.load(id)):
+        raise ValueError('Performance {} not found'.format(id))
+    BUS.published = []
+    runner.run(start)
+    # Finished performances can schedule others (pause nodes, queue), wait until nothing is left
+    while time.time() - began < timeout:
+        harness.wait_idle(runner, timeout)
+        BUS.drain()
+        time.sleep(0.01)
+        if harness.wait_idle(runner, 0) and runner.lookahead.idle() and not BUS._deliveries and \
+                not any(t.is_alive() for t in threads):
+            break
+    wall = time.time() - began
+    world.close()
+
+    trace = [{'t': p.time, 'topic': p.topic, 'msg': to_data(p.msg)} for p in BUS.published]
+    summary = {
+        'id': id,
+        'virtual_seconds': clock.time(),
+        'wall_seconds': wall,
+        'speedup': clock.time() / wall if wall else 0,
+        'stalled_at': stalled[0] if stalled else None,
+        'messages': dict(collections.Counter(p.topic for p in BUS.published)),
+    }
+    return summary, trace
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('performances_dir')
+    parser.add_argument('robot_name')
+    parser.add_argument('id', help='performance id or folder, as for run_full_performance')
+    parser.add_argument('--script', help='YAML list of scripted events')
+    parser.add_argument('--start', type=float, default=0.0)
+    parser.add_argument('--limit', type=float, help='stop after this many virtual seconds')
+    parser.add_argument('--timeout', type=float, default=60, help='wall clock timeout, seconds')
+    parser.add_argument('--trace', help='JSON lines output of published messages, stdout if omitted')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    harness.configure_logging(args.verbose)
+
+    events = []
+    if args.script:
+        with open(args.script) as f:
+            events = yaml.safe_load(f) or []
+    summary, trace = simulate(args.performances_dir, args.robot_name, args.id, events, args.start, args.limit,
+                              args.timeout)
+    out = open(args.trace, 'w') if args.trace else sys.stdout
+    for record in trace:
+        out.write(json.dumps(record, sort_keys=True) + '\n')
+    if args.trace:
+        out.close()
+    sys.stderr.write(json.dumps(summary, indent=2, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+"""
+Reads the trace the performances runner keeps in ~trace_file, by default
+/tmp/performances-<robot>.trace, and the one of the previous session in .1.
+
+Lateness of nodes against their planned start and stop times, and outputs per channel:
+
+    read_trace.py /tmp/performances-sophia.trace
+
+What the robot did, one record per line, or as JSON lines:
+
+    read_trace.py /tmp/performances-sophia.trace --timeline --last 200
+    read_trace.py /tmp/performances-sophia.trace --json --event node_start --event publish
+"""
+from __future__ import print_function
+import argparse
+import datetime
+import json
+
+from performances.trace import TraceReader
+
+
+def line(record):
+    wall = datetime.datetime.fromtimestamp(record['stamp']).strftime('%H:%M:%S.%f')[:-3]
+    fields = [wall, record['event'] + (' FAILED' if record['failed'] else '')]
+    if record['run_time'] is not None:
+        fields.append('t={:.3f}'.format(record['run_time']))
+    if record['planned'] is not None:
+        late = record['run_time'] - record['planned'] + (record['lead'] if record['event'] == 'node_start' else 0)
+        fields.append('planned={:.3f} late={:+.1f}ms'.format(record['planned'], late * 1000))
+    # None if the string table was not written yet or was full, or the payload was overwritten
+    for name in ['layer', 'timeline', 'node', 'channel']:
+        if record[name] is None or record[name]:
+            fields.append('{}={}'.format(name, '?' if record[name] is None else record[name]))
+    if record['payload'] is None or record['payload']:
+        fields.append('?' if record['payload'] is None else ' '.join(record['payload'].split()))
+    return '  '.join(fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='trace file')
+    parser.add_argument('--timeline', action='store_true', help='print the records')
+    parser.add_argument('--json', action='store_true', help='print the records as JSON lines')
+    parser.add_argument('--event', action='append', help='only these events, e.g. node_start, publish, service')
+    parser.add_argument('--performance', help='only records of timelines or performances with ids starting so')
+    parser.add_argument('--last', type=int, help='only the last records')
+    args = parser.parse_args()
+
+    reader = TraceReader(args.path)
+    if not (args.timeline or args.json):
+        print(json.dumps(reader.lateness(), indent=2, sort_keys=True))
+        return
+    records = [r for r in reader.records() if (not args.event or r['event'] in args.event) and
+               (not args.performance or (r['timeline'] or '').startswith(args.performance))]
+    if args.last:
+        records = records[-args.last:]
+    for record in records:
+        print(json.dumps(record, sort_keys=True) if args.json else line(record))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,17 @@ import json
 import time
 import yaml
 import os
-import fnmatch
 import random
 import copy
-
+import itertools
+from collections import deque
+import resource
+import tempfile
+import xmlrpclib
+import multiprocessing
+import sys
+
+import rosgraph
 import rospy
 import performances.srv as srv
 from dynamic_reconfigure.server import Server
@@ -18,103 +25,401 @@ from hr_msgs.msg import Event
 from hr_msgs.msg import MakeFaceExpr, PlayAnimation
 from hr_msgs.msg import SetGesture, EmotionState, Target, SomaState
 from hr_msgs.msg import TTS
-from natsort import natsorted, ns
 from performances.cfg import PerformancesConfig
+from performances.clock import Clock, PlaybackClock
+from performances.lookahead import Lookahead
+from performances.latency import Latencies, ACK_TIMEOUT
+from performances.layers import Layer, Layers
+from performances.library import Library
 from performances.nodes import Node
+from performances.outputs import Outputs, FOREGROUND
+from performances.profiler import Profiler
+from performances.regions import RegionSampler
+from performances.reload import Patch
+from performances.report import Report, FileSink, TopicSink
+from performances.snapshot import Snapshot
+from performances.startup import LazyModule, StartupProfile
+from performances.tickets import Tickets, READY, FAILED
+from performances.trace import NullTrace, Trace, TraceRing, TracedService
 from performances.weak_method import WeakMethod
-from std_msgs.msg import String, Int32, Float32
+from std_msgs.msg import String, Int32, Float32, Bool
 from std_srvs.srv import Trigger, TriggerResponse
 from topic_tools.srv import MuxSelect
 
 logger = logging.getLogger('hr.performances')
 
+natsort = LazyModule('natsort')
+# Seconds from process start to the first service of the node
+startup = StartupProfile('performances')
+startup.mark('imports')
+
+
+class Runner(PlaybackClock):
+    # Nodes scheduled closer than that are started on the same virtual clock tick
+    EVENT_EPSILON = 1e-6
+    # Seconds between layer ticks while no foreground performance is running
+    LAYER_TICK_INTERVAL = 0.01
 
-class Runner:
-    def __init__(self):
-        self.robot_name = rospy.get_param('/robot_name')
+    def __init__(self, robot_name=None, clock=None, library=None, namespace='~'):
+        """
+        :param robot_name: robot to serve, /robot_name parameter by default
+        :param clock: time source for playback. VirtualClock plays performances faster than real time.
+        :param library: performance files cache, shared by runners serving several robots from one process
+        :param namespace: prefix of runner topics, services and parameters
+        """
+        self.clock = clock or Clock()
+        self.robot_name = robot_name or rospy.get_param('/robot_name')
+        self.namespace = namespace
+        # Robot topics outside of its namespace are moved under it if the process serves several robots
+        self.robot_ns = '' if namespace == '~' else '/' + self.robot_name
         self.performances_dir = os.path.join(os.environ.get('PERFORMANCES_DIR'))
-        self.running = False
-        self.paused = False
+        self.library = library or Library(self.performances_dir)
         self.autopause = False
-        self.pause_time = 0
-        self.start_time = 0
-        self.start_timestamp = 0
         self.lock = Lock()
         self.run_condition = Condition()
-        self.running_performance = None
         self.running_nodes = []
+        # Performance loaded in chunks is incomplete until load_commit
+        self.streaming = False
+        # Nodes starting up to this run time are loaded, and the last timeline nodes were added to
+        self.loaded_time = 0
+        self.loaded_timeline = 0
+        # Durations of the timelines loaded so far
+        self.loaded_durations = []
+        # Timeline index -> (YAML file, signature) of the loaded performance, patched into it when edited
+        self.watched = {}
+        # Patches of the playing performance for the worker to apply
+        self.patches = []
+        # Bumped holding the lock whenever nodes of the loaded performance change in place
+        self.performance_version = 0
+        # (performance, version, JSON) last served by current
+        self.serialized = (None, 0, 'null')
+        # Performances playing alongside the running one
+        self.layers = Layers()
+        # Node specs with messages rendered on load: id(node data) -> (node data, spec)
+        self.prepared = {}
+        # Attention region samplers: (performance path, region type) -> RegionSampler
+        self.region_samplers = {}
         self.unload_finished = False
         # in memory set of properties with priority over params
         self.variables = {}
+        # Performance folder -> ((.properties file, its signature), properties) last published
+        self.properties = {}
         # References to event subscribing node callbacks
         self.observers = {}
-        self.interrupted_performances = []
+        # Keywords pause nodes wait for in speech, by listener
+        self.keyword_listeners = {}
+        self.keyword_ids = itertools.count(1)
+        self.keywords_lock = Lock()
+        # Published by WholeShow when the behavior tree is switched, cached for the worker
+        self.behavior_enabled = rospy.get_param(self.robot_ns + '/behavior_enabled', False)
+        # Snapshots of interrupted performances, the oldest are forgotten beyond ~interrupt_depth
+        self.interrupted_performances = deque(maxlen=max(1, rospy.get_param(self.namespace + 'interrupt_depth', 8)))
+        # Snapshot the next run continues from, and the timeline the worker is playing
+        self.resume_snapshot = None
+        self.running_timeline = 0
+        self.running_offset = 0
         # Performances that already played as alternatives. Used to maximize different performance in single demo
         self.performances_played = {}
         self.worker = Thread(target=self.worker)
         self.worker.setDaemon(True)
         self.queue = []
-        rospy.init_node('performances')
-        logger.info('Starting performances node')
+        # Performances loading or loaded in background, not run yet
+        self.tickets = Tickets(max(1, rospy.get_param(self.namespace + 'load_tickets', 8)))
+        # Outcome of parsing the whole library in background
+        self.warm_up_state = {}
+        logger.info('Starting performances runner for {}'.format(self.robot_name))
+        # Node lifecycle, outputs and service calls kept in a ring file for investigating shows afterwards
+        self.trace = self.open_trace()
+        rospy.on_shutdown(self.trace.flush)
 
         self.services = {
             'head_pau_mux': rospy.ServiceProxy('/' + self.robot_name + '/head_pau_mux/select', MuxSelect),
             'neck_pau_mux': rospy.ServiceProxy('/' + self.robot_name + '/neck_pau_mux/select', MuxSelect),
             'eyes_pau_mux': rospy.ServiceProxy('/' + self.robot_name + '/eyes_pau_mux/select', MuxSelect)
         }
-        self.topics = {
-            'running_performance': rospy.Publisher('~running_performance', String, queue_size=1),
-            'look_at': rospy.Publisher('/blender_api/set_face_target', Target, queue_size=1),
-            'gaze_at': rospy.Publisher('/blender_api/set_gaze_target', Target, queue_size=1),
-            'head_rotation': rospy.Publisher('/blender_api/set_head_rotation', Float32, queue_size=1),
-            'emotion': rospy.Publisher('/blender_api/set_emotion_state', EmotionState, queue_size=3),
-            'gesture': rospy.Publisher('/blender_api/set_gesture', SetGesture, queue_size=3),
-            'arm_animation': rospy.Publisher('/blender_api/set_arm_animation', SetGesture, queue_size=3),
+        for name, proxy in self.services.items():
+            self.services[name] = TracedService(self.trace, name, proxy)
+        # Publishers wrapped to drop repeated and superseded node messages
+        self.topics = Outputs({
+            'running_performance': rospy.Publisher(self.namespace + 'running_performance', String, queue_size=1),
+            'look_at': rospy.Publisher(self.robot_ns + '/blender_api/set_face_target', Target, queue_size=1),
+            'gaze_at': rospy.Publisher(self.robot_ns + '/blender_api/set_gaze_target', Target, queue_size=1),
+            'head_rotation': rospy.Publisher(self.robot_ns + '/blender_api/set_head_rotation', Float32, queue_size=1),
+            'emotion': rospy.Publisher(self.robot_ns + '/blender_api/set_emotion_state', EmotionState, queue_size=3),
+            'gesture': rospy.Publisher(self.robot_ns + '/blender_api/set_gesture', SetGesture, queue_size=3),
+            'arm_animation': rospy.Publisher(self.robot_ns + '/blender_api/set_arm_animation', SetGesture,
+                                             queue_size=3),
             'expression': rospy.Publisher('/' + self.robot_name + '/make_face_expr', MakeFaceExpr, queue_size=3),
             'kfanimation': rospy.Publisher('/' + self.robot_name + '/play_animation', PlayAnimation, queue_size=3),
-            'interaction': rospy.Publisher('/behavior_switch', String, queue_size=1),
-            'bt_control': rospy.Publisher('/behavior_control', Int32, queue_size=1),
-            'events': rospy.Publisher('~events', Event, queue_size=1),
+            'interaction': rospy.Publisher(self.robot_ns + '/behavior_switch', String, queue_size=1),
+            'bt_control': rospy.Publisher(self.robot_ns + '/behavior_control', Int32, queue_size=1),
+            'events': rospy.Publisher(self.namespace + 'events', Event, queue_size=1),
             'chatbot': rospy.Publisher('/' + self.robot_name + '/speech', ChatMessage, queue_size=1),
             'speech_events': rospy.Publisher('/' + self.robot_name + '/speech_events', String, queue_size=1),
-            'soma_state': rospy.Publisher("/blender_api/set_soma_state", SomaState, queue_size=2),
+            'soma_state': rospy.Publisher(self.robot_ns + '/blender_api/set_soma_state', SomaState, queue_size=2),
             'tts': rospy.Publisher('/' + self.robot_name + '/tts', TTS, queue_size=1),
-            'tts_control': rospy.Publisher('/' + self.robot_name + '/tts_control', String, queue_size=1)
-        }
+            'tts_control': rospy.Publisher('/' + self.robot_name + '/tts_control', String, queue_size=1),
+            'lookahead': rospy.Publisher(self.namespace + 'lookahead', String, queue_size=10),
+            'load_tickets': rospy.Publisher(self.namespace + 'load_tickets', String, queue_size=10)
+        }, self.trace)
+        # Keywords pause nodes wait for, so WholeShow doesn't forward them to the chatbot
+        self.keywords_pub = rospy.Publisher(self.namespace + 'keywords_listening', String, queue_size=1, latch=True)
+        self.publish_keywords()
+        # Announces upcoming nodes of the running timeline
+        self.lookahead = Lookahead(self.topics['lookahead'], self.clock)
+        # TTS acknowledges speech by the start speech event
+        self.latency = Latencies(self.clock, rospy.get_param(self.namespace + 'latency', {}), acknowledged=['tts'])
+        # (clock time, text) of utterances anyone asked TTS to say, in order, to tell whose speech started
+        self.tts_requests = deque(maxlen=32)
+        # Profile of the worker thread, written to ~profile_dir when stopped
+        profile_dir = rospy.get_param(self.namespace + 'profile_dir', tempfile.gettempdir())
+        self.profiler = Profiler(os.path.expanduser(profile_dir))
+        self.profile_config = False
+        # Run, pause, resume, stop and finish records, written in background
+        sinks = [TopicSink(rospy.Publisher(self.namespace + 'report', String, queue_size=100))]
+        if rospy.get_param(self.namespace + 'report_file', ''):
+            sinks.append(FileSink(os.path.expanduser(rospy.get_param(self.namespace + 'report_file'))))
+        self.report = Report(sinks, size=rospy.get_param(self.namespace + 'report_buffer', 1024), clock=self.clock,
+                             robot=self.robot_name)
         self.load_properties()
-        rospy.Service('~reload_properties', Trigger, self.reload_properties_callback)
-        rospy.Service('~set_properties', srv.SetProperties, self.set_properties_callback)
-        rospy.Service('~load', srv.Load, self.load_callback)
-        rospy.Service('~load_performance', srv.LoadPerformance, self.load_performance_callback)
-        rospy.Service('~unload', Trigger, self.unload_callback)
-        rospy.Service('~run', srv.Run, self.run_callback)
-        rospy.Service('~run_by_name', srv.RunByName, self.run_by_name_callback)
-        rospy.Service('~run_full_performance', srv.RunByName, self.run_full_performance_callback)
-        rospy.Service('~resume', srv.Resume, self.resume_callback)
-        rospy.Service('~pause', srv.Pause, self.pause_callback)
-        rospy.Service('~stop', srv.Stop, self.stop_callback)
-        rospy.Service('~current', srv.Current, self.current_callback)
+        rospy.Service(self.namespace + 'reload_properties', Trigger, self.reload_properties_callback)
+        startup.mark('first_service')
+        rospy.Service(self.namespace + 'set_properties', srv.SetProperties, self.set_properties_callback)
+        rospy.Service(self.namespace + 'load', srv.Load, self.load_callback)
+        rospy.Service(self.namespace + 'load_sequence', srv.LoadSequence, self.load_sequence_callback)
+        rospy.Service(self.namespace + 'load_performance', srv.LoadPerformance, self.load_performance_callback)
+        rospy.Service(self.namespace + 'load_begin', srv.LoadPerformance, self.load_begin_callback)
+        rospy.Service(self.namespace + 'load_append', srv.LoadAppend, self.load_append_callback)
+        rospy.Service(self.namespace + 'load_commit', Trigger, self.load_commit_callback)
+        rospy.Service(self.namespace + 'unload', Trigger, self.unload_callback)
+        rospy.Service(self.namespace + 'run', srv.Run, self.run_callback)
+        rospy.Service(self.namespace + 'run_by_name', srv.RunByName, self.run_by_name_callback)
+        rospy.Service(self.namespace + 'run_full_performance', srv.RunByName, self.run_full_performance_callback)
+        rospy.Service(self.namespace + 'load_async', srv.LoadAsync, self.load_async_callback)
+        rospy.Service(self.namespace + 'run_ticket', srv.RunTicket, self.run_ticket_callback)
+        rospy.Service(self.namespace + 'resume', srv.Resume, self.resume_callback)
+        rospy.Service(self.namespace + 'pause', srv.Pause, self.pause_callback)
+        rospy.Service(self.namespace + 'stop', srv.Stop, self.stop_callback)
+        rospy.Service(self.namespace + 'current', srv.Current, self.current_callback)
+        rospy.Service(self.namespace + 'output_stats', Trigger, self.output_stats_callback)
+        rospy.Service(self.namespace + 'latency', Trigger, self.latency_callback)
+        rospy.Service(self.namespace + 'layer_run', srv.LayerRun, self.layer_run_callback)
+        rospy.Service(self.namespace + 'layer_pause', srv.LayerCommand, self.layer_pause_callback)
+        rospy.Service(self.namespace + 'layer_resume', srv.LayerCommand, self.layer_resume_callback)
+        rospy.Service(self.namespace + 'layer_stop', srv.LayerCommand, self.layer_stop_callback)
+        rospy.Service(self.namespace + 'layer_seek', srv.LayerSeek, self.layer_seek_callback)
+        rospy.Service(self.namespace + 'layers', Trigger, self.layers_callback)
+        rospy.Service(self.namespace + 'warm_up', Trigger, self.warm_up_callback)
+        rospy.Service(self.namespace + 'profile_start', Trigger, self.profile_start_callback)
+        rospy.Service(self.namespace + 'profile_stop', Trigger, self.profile_stop_callback)
         # Shared subscribers for nodes
-        rospy.Subscriber('~events', Event, self.runner_event_callback)
-        rospy.Subscriber('/' + self.robot_name + '/speech_events', String,
-                         lambda msg: self.notify('speech_events', msg))
+        rospy.Subscriber(self.namespace + 'events', Event, self.runner_event_callback)
+        rospy.Subscriber('/' + self.robot_name + '/speech_events', String, self.speech_events_callback)
+        rospy.Subscriber('/' + self.robot_name + '/tts', TTS, self.tts_callback)
         rospy.Subscriber('/' + self.robot_name + '/speech', ChatMessage, self.speech_callback)
         # Shared subscribers for nodes
-        rospy.Subscriber('/hand_events', String, self.hand_callback)
-        Server(PerformancesConfig, self.reconfig)
-        rospy.Subscriber('/face_training_event', String, self.training_callback)
+        rospy.Subscriber(self.robot_ns + '/hand_events', String, self.hand_callback)
+        Server(PerformancesConfig, self.reconfig, namespace=self.namespace.rstrip('/'))
+        rospy.Subscriber(self.robot_ns + '/face_training_event', String, self.training_callback)
+        rospy.Subscriber(self.robot_ns + '/behavior_enabled', Bool, self.behavior_enabled_callback)
         self.worker.start()
-        rospy.spin()
+        startup.mark('ready')
+        if rospy.get_param(self.namespace + 'warm_up', False):
+            self.start_warm_up()
+        self.watch_interval = rospy.get_param(self.namespace + 'watch_interval', 1.0)
+        if self.watch_interval > 0:
+            watcher = Thread(target=self.watch)
+            watcher.setDaemon(True)
+            watcher.start()
 
     def reconfig(self, config, level):
         with self.lock:
             self.autopause = config.autopause
+            self.lookahead.horizon = config.lookahead
+            self.latency.enabled = config.latency_compensation
+            profile, self.profile_config = config.profile != self.profile_config, config.profile
+        if profile and config.profile:
+            self.start_profile()
+        elif profile:
+            # Written in background, reconfigure doesn't wait for the worker
+            thread = Thread(target=self.stop_profile)
+            thread.setDaemon(True)
+            thread.start()
 
         return config
 
+    def open_trace(self):
+        # Runners of one process serving several robots trace to files of their own
+        path = rospy.get_param(self.namespace + 'trace_file',
+                               os.path.join(tempfile.gettempdir(), 'performances-{robot}.trace'))
+        if not path:
+            return NullTrace()
+        path = os.path.expanduser(path.replace('{robot}', self.robot_name))
+        try:
+            ring = TraceRing(path, max(1, rospy.get_param(self.namespace + 'trace_records', 100000)),
+                             max(1, rospy.get_param(self.namespace + 'trace_strings', 50000)),
+                             max(1, rospy.get_param(self.namespace + 'trace_payloads', 20000)))
+        except EnvironmentError as ex:
+            logger.warn('Can not trace to {}: {}'.format(path, ex))
+            return NullTrace()
+        return Trace(ring)
+
+    # Report record of the running performance, also kept in the trace
+    def record(self, action, performance_id, run_time, **data):
+        self.report.record(action, performance_id, run_time, **data)
+        self.trace.performance(action, performance_id, run_time)
+
     def reload_properties_callback(self, request):
-        self.load_properties()
-        return TriggerResponse(success=True)
+        return TriggerResponse(success=True, message=json.dumps(self.load_properties()))
+
+    def latency_callback(self, request):
+        return TriggerResponse(success=True, message=json.dumps(self.latency.report()))
+
+    def tts_callback(self, msg):
+        self.tts_requests.append((self.clock.time(), msg.text))
+
+    def speech_events_callback(self, msg):
+        # Interaction nodes of this runner publish speech events too
+        own = getattr(msg, '_connection_header', {}).get('callerid') == rospy.get_name()
+        if msg.data == 'start' and not own:
+            self.speech_started()
+        self.notify('speech_events', msg)
+
+    def speech_started(self):
+        """ TTS says utterances in order, so the oldest one not started yet started. Others' speech is ignored. """
+        now = self.clock.time()
+        while self.tts_requests:
+            requested, text = self.tts_requests.popleft()
+            if now - requested <= ACK_TIMEOUT:
+                self.latency.acknowledge('tts', text)
+                return
+
+    def output_stats_callback(self, request):
+        stats = self.topics.stats()
+        stats['report'] = self.report.stats()
+        stats['trace'] = self.trace.stats()
+        return TriggerResponse(success=True, message=json.dumps(stats))
+
+    def layer_run_callback(self, request):
+        performance = json.loads(request.performance) if request.performance else self.read(request.id)
+        priorities = json.loads(request.priorities) if request.priorities else {}
+        return srv.LayerRunResponse(self.run_layer(request.name, performance, request.start_time,
+                                                   request.priority, priorities, request.loop))
+
+    def layer_pause_callback(self, request):
+        return self.layer_command(request.name, lambda layer: (layer.pause(), layer.get_run_time()))
+
+    def layer_resume_callback(self, request):
+        return self.layer_command(request.name, lambda layer: (layer.resume(), layer.get_run_time()))
+
+    def layer_stop_callback(self, request):
+        layer = self.layers.remove(request.name)
+        return srv.LayerCommandResponse(bool(layer), layer.get_run_time() if layer else 0)
+
+    def layer_seek_callback(self, request):
+        layer = self.layers.get(request.name)
+        return srv.LayerSeekResponse(bool(layer) and layer.seek(request.time))
+
+    def layers_callback(self, request):
+        return TriggerResponse(success=True, message=json.dumps([layer.state() for layer in self.layers.all()]))
+
+    def warm_up_callback(self, request):
+        self.start_warm_up()
+        with self.lock:
+            state = dict(self.warm_up_state)
+        return TriggerResponse(success=True, message=json.dumps(state))
+
+    def profile_start_callback(self, request):
+        return TriggerResponse(success=self.start_profile())
+
+    def profile_stop_callback(self, request):
+        summary = self.stop_profile()
+        return TriggerResponse(success=summary is not None, message=json.dumps(summary))
+
+    def start_profile(self):
+        if not self.profiler.start():
+            return False
+        self.wake_worker()
+        return True
+
+    def stop_profile(self):
+        """ Stops profiling the worker and writes the profile, returns its summary """
+        if not self.profiler.stop():
+            return None
+        self.wake_worker()
+        return self.profiler.write()
+
+    def start_warm_up(self):
+        with self.lock:
+            if self.warm_up_state.get('running'):
+                return False
+            self.warm_up_state = {'running': True}
+        thread = Thread(target=self.warm_up)
+        thread.setDaemon(True)
+        thread.start()
+        return True
+
+    def warm_up(self):
+        """ Parses and validates all timelines of the robot so that first loads are served from the library """
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        roots = [self.get_path_by_robot_name('common'), self.get_path_by_robot_name(self.robot_name)]
+        try:
+            result = self.library.warm_up(roots, rospy.get_param(self.namespace + 'warm_up_processes', 0))
+        except Exception as ex:
+            logger.error('Warm-up failed: {}'.format(ex))
+            result = {'parsed': [], 'errors': {'': str(ex)}, 'seconds': 0}
+        errors = result['errors']
+        for path in result['parsed']:
+            try:
+                self.validate_timeline(self.library.get_timeline(path))
+            except Exception as ex:
+                errors[path] = 'invalid timeline: {}'.format(ex)
+        for path, error in errors.items():
+            logger.warn('Warm-up can not read {}: {}'.format(path, error))
+        state = {
+            'running': False,
+            'timelines': len(result['parsed']),
+            'errors': errors,
+            'seconds': result['seconds'],
+            # Peak resident memory growth, kB on Linux
+            'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+        }
+        logger.info('Warm-up parsed {} timelines in {:.2f}s, memory grew by {} kB'.format(
+            state['timelines'], state['seconds'], state['rss_kb']))
+        with self.lock:
+            self.warm_up_state = state
+
+    def layer_command(self, name, command):
+        layer = self.layers.get(name)
+        if not layer:
+            return srv.LayerCommandResponse(False, 0)
+        success, run_time = command(layer)
+        return srv.LayerCommandResponse(success, run_time)
+
+    def run_layer(self, name, performance, start_time=0.0, priority=0, priorities=None, loop=False):
+        """
+        Plays performance in the named layer alongside the foreground performance, replacing what the
+        layer played before
+        :param priority: output priority, the foreground performance has Outputs.FOREGROUND_PRIORITY
+        :param priorities: channel -> priority for channels with different priority
+        """
+        if not name or not performance:
+            return False
+        layer = Layer(self, name, priority, priorities, loop)
+        layer.load(performance)
+        self.layers.add(layer)
+        return layer.run(start_time)
+
+    def wake_worker(self):
+        # Worker waits for run() while idle, or ticks layers itself when running
+        while not self.run_condition.acquire(False):
+            if self.running:
+                return
+            time.sleep(0.001)
+        try:
+            self.run_condition.notify()
+        finally:
+            self.run_condition.release()
 
     def unload_callback(self, request):
         self.unload()
@@ -126,6 +431,8 @@ class Runner:
             if self.running_performance:
                 logger.info('unloading')
                 self.running_performance = None
+                self.streaming = False
+                self.watched = {}
                 self.unload_attention_regions()
                 self.topics['running_performance'].publish(String(json.dumps(None)))
 
@@ -136,10 +443,24 @@ class Runner:
     def load_callback(self, request):
         return srv.LoadResponse(success=True, performance=json.dumps(self.load(request.id)))
 
+    def load_sequence_callback(self, request):
+        performance, timing = self.load_sequence(request.ids)
+        return srv.LoadSequenceResponse(performance is not None, json.dumps(performance), json.dumps(timing))
+
     def load_performance_callback(self, request):
         self.load_performance(json.loads(request.performance))
         return srv.LoadPerformanceResponse(True)
 
+    def load_begin_callback(self, request):
+        return srv.LoadPerformanceResponse(self.load_begin(json.loads(request.performance)))
+
+    def load_append_callback(self, request):
+        success = self.load_append(request.timeline, json.loads(request.nodes))
+        return srv.LoadAppendResponse(success, self.loaded_time)
+
+    def load_commit_callback(self, request):
+        return TriggerResponse(success=self.load_commit())
+
     def run_by_name_callback(self, request):
         self.stop()
         if not self.load(request.id):
@@ -156,22 +477,90 @@ class Runner:
     def run_full_performance_callback(self, request):
         return self.run_full_performance(request.id, unload_finished=True)
 
+    def load_async_callback(self, request):
+        return srv.LoadAsyncResponse(self.load_async(request.id, request.full).number)
+
+    def run_ticket_callback(self, request):
+        return srv.RunTicketResponse(self.run_ticket(request.ticket, request.start_time))
+
+    def load_async(self, id, full=False):
+        """
+        Starts loading the performance in background, whatever plays meanwhile keeps playing
+        :param full: pick a sub-performance of the folder like run_full_performance
+        :return: ticket, announced on load_tickets once the performance is ready to run
+        """
+        ticket = self.tickets.issue(id, full)
+        thread = Thread(target=self.load_ticket, args=(ticket,))
+        thread.setDaemon(True)
+        thread.start()
+        return ticket
+
+    def load_ticket(self, ticket):
+        """ Reads, validates and prepares the performance of the ticket without loading it """
+        began = time.time()
+        try:
+            performance = None
+            if ticket.full:
+                picked = self.pick_folder(ticket.id)
+                performance = self.read(picked) if picked else None
+            performance = performance or self.read(ticket.id)
+            if performance:
+                self.validate_performance(performance)
+                ticket.prepared = self.prepare_performance(performance)
+                self.prepare_region_samplers(performance)
+                ticket.watched = self.watched_files(performance)
+                ticket.regions = self.get_attention_regions(performance.get('id', 'invalid'))
+                ticket.performance = performance
+            else:
+                ticket.error = 'not found'
+        except Exception as ex:
+            logger.error('Can not load {}: {}'.format(ticket.id, ex))
+            ticket.error = str(ex)
+        ticket.seconds = time.time() - began
+        ticket.state = READY if ticket.performance else FAILED
+        ticket.done.set()
+        self.topics['load_tickets'].publish(String(json.dumps(ticket.to_dict())))
+
+    def run_ticket(self, number, start_time=0.0, timeout=10.0):
+        """
+        Runs the performance of the ticket. Waits if it still loads, the current performance stops only then.
+        Performances picked from a folder unload once finished, like run_full_performance.
+        """
+        ticket = self.tickets.get(number)
+        if not ticket or not ticket.done.wait(timeout) or not self.tickets.take(number) or not ticket.performance:
+            return False
+        self.stop()
+        self.load_prepared(ticket)
+        return self.run(start_time, unload_finished=ticket.full)
+
+    def load_prepared(self, ticket):
+        """ Loads the performance of the ticket, no I/O left """
+        with self.lock:
+            performance = ticket.performance
+            logger.info('load: {0}'.format(performance.get('id', 'NO ID')))
+            self.load_attention_regions(performance.get('id', 'invalid'), ticket.regions)
+            self.prepared = ticket.prepared
+            self.running_performance = performance
+            self.streaming = False
+            self.watched = ticket.watched
+            self.topics['running_performance'].publish(String(json.dumps(performance)))
+
     def load_folder(self, id):
-        if id.startswith('shared'):
-            robot_name = 'common'
-        else:
-            robot_name = rospy.get_param('/robot_name')
+        id = self.pick_folder(id)
+        return self.load(id) if id else []
 
+    def pick_folder(self, id):
+        """ Performance id to play for the folder, a random sub-performance if it has no timelines itself """
+        robot_name = 'common' if id.startswith('shared') else self.robot_name
         dir_path = os.path.join(self.get_path_by_robot_name(robot_name), id)
-        if os.path.isdir(dir_path):
-            root, dirs, files = next(os.walk(dir_path))
-
-            files = fnmatch.filter(files, "*.yaml")
+        listing = self.library.listdir(dir_path)
+        if listing:
+            dirs, files = listing
             if not files:
                 # If no folder is picked one directory
                 # Sub-directories are counted as sub-performances
                 if not dirs:
-                    return []
+                    return None
                 if id in self.performances_played:
                     # All performances played. Pick any but last played
                     if set(self.performances_played[id]) == set(dirs):
@@ -185,47 +574,89 @@ class Runner:
                 # Pick random performance
                 p = random.choice(dirs)
                 self.performances_played[id].append(p)
-                return self.load_folder(os.path.join(id, p))
+                return self.pick_folder(os.path.join(id, p))
             # make names in folder/file format
-            return self.load(id)
-        return []
+            return id
+        return None
 
     def load(self, id):
-        robot_name = 'common' if id.startswith('shared') else rospy.get_param('/robot_name')
-        p = os.path.join(self.get_path_by_robot_name(robot_name), id)
+        performance = self.read(id)
+        if performance:
+            self.load_performance(performance)
+            return performance
+        else:
+            return None
+
+    def load_sequence(self, ids):
+        """
+        Loads performances to play one after another as one performance with the timelines of all of them.
+        Timelines not parsed yet are parsed in one batch, by the parsing processes if there are several.
+        :param ids: performance or folder ids
+        :return: the performance, None if any of them can't be read, and the load timing
+        """
+        began = time.time()
+        timeline_ids = [self.get_timeline_ids(id) or [id] for id in ids]
+        paths = [self.get_timeline_path(i) for timelines in timeline_ids for i in timelines]
+        result = self.library.parse_all(paths, rospy.get_param(self.namespace + 'load_processes', 0))
+        for path, error in result['errors'].items():
+            logger.warn('Can not parse {}: {}'.format(path, error))
+        timing = {'parsed': len(result['parsed']), 'parse_ms': round((time.time() - began) * 1000, 3), 'ids': []}
+        timelines = []
+        for id in ids:
+            read_began = time.time()
+            performance = self.read(id)
+            read = performance['timelines'] if performance and 'timelines' in performance else [performance]
+            timing['ids'].append({'id': id, 'timelines': len(read) if performance else 0,
+                                  'read_ms': round((time.time() - read_began) * 1000, 3)})
+            if not performance:
+                logger.warn('Can not load sequence, {} not found'.format(id))
+                return None, timing
+            timelines += read
+        performance = {'id': ','.join(ids), 'name': 'sequence', 'path': '', 'timelines': timelines,
+                       'nodes': self.get_merged_timeline_nodes(timelines)}
+        self.load_performance(performance)
+        timing['total_ms'] = round((time.time() - began) * 1000, 3)
+        logger.info('Loaded sequence of {} performances in {} ms'.format(len(ids), timing['total_ms']))
+        return performance, timing
+
+    def get_timeline_ids(self, id):
+        """ Timelines of the performance folder in natural order, None if the id is no folder """
+        robot_name = 'common' if id.startswith('shared') else self.robot_name
+        listing = self.library.listdir(os.path.join(self.get_path_by_robot_name(robot_name), id))
+        if not listing:
+            return None
+        files = natsort.natsorted(listing[1], key=lambda f: f.lower())
+        return ["{}/{}".format(id, f[:-5]) for f in files]
 
-        if os.path.isdir(p):
-            root, dirs, files = next(os.walk(p))
-            files = natsorted(fnmatch.filter(files, "*.yaml"), key=lambda f: f.lower())
-            ids = ["{}/{}".format(id, f[:-5]) for f in files]
+    def read(self, id):
+        """ Reads performance or folder of timelines without loading it """
+        ids = self.get_timeline_ids(id)
+
+        if ids is not None:
             timelines = [self.get_timeline(i) for i in ids]
             timelines = [t for t in timelines if t]
             performance = {'id': id, 'name': os.path.basename(id), 'path': os.path.dirname(id), 'timelines': timelines,
                            'nodes': self.get_merged_timeline_nodes(timelines)}
         else:
             performance = self.get_timeline(id)
-
-        if performance:
-            self.load_performance(performance)
-            return performance
-        else:
-            return None
+        return performance
 
     def get_path_by_robot_name(self, name):
         return os.path.join(self.performances_dir, name)
 
+    def get_timeline_path(self, id):
+        robot_name = 'common' if id.startswith('shared') else self.robot_name
+        return os.path.join(self.get_path_by_robot_name(robot_name), id) + '.yaml'
+
     def get_timeline(self, id):
-        timeline = None
-        robot_name = 'common' if id.startswith('shared') else rospy.get_param('/robot_name')
-        p = os.path.join(self.get_path_by_robot_name(robot_name), id) + '.yaml'
-
-        if os.path.isfile(p):
-            with open(p, 'r') as f:
-                timeline = yaml.load(f.read())
-                timeline['id'] = id
-                timeline['name'] = os.path.basename(id)
-                timeline['path'] = os.path.dirname(id)
-                self.validate_timeline(timeline)
+        p = self.get_timeline_path(id)
+
+        timeline = self.library.get_timeline(p) if os.path.isfile(p) else None
+        if timeline is not None:
+            timeline['id'] = id
+            timeline['name'] = os.path.basename(id)
+            timeline['path'] = os.path.dirname(id)
+            self.validate_timeline(timeline)
         return timeline
 
     def get_timeline_duration(self, timeline):
@@ -279,45 +710,285 @@ class Runner:
 
         return timeline
 
-    def load_performance(self, performance):
+    def load_performance(self, performance, publish=True):
         with self.lock:
             logger.info('load: {0}'.format(performance.get('id', 'NO ID')))
             self.validate_performance(performance)
             self.load_attention_regions(performance.get('id','invalid'))
+            self.prepared = self.prepare_performance(performance)
+            self.prepare_region_samplers(performance)
             self.running_performance = performance
+            self.streaming = False
+            self.watched = self.watched_files(performance)
+            if publish:
+                self.topics['running_performance'].publish(String(json.dumps(performance)))
+
+    def load_begin(self, performance):
+        """
+        Loads the performance without nodes. Nodes are added by load_append() in start time order and the
+        performance can run once the nodes up to the start time are there.
+        :param performance: performance, or timeline headers in 'timelines' with nodes sent later
+        """
+        timelines = performance['timelines'] if 'timelines' in performance else [performance]
+        chunks = [timeline.pop('nodes', None) or [] for timeline in timelines]
+        for timeline in timelines:
+            timeline['nodes'] = []
+        self.load_performance(performance, publish=False)
+        with self.lock:
+            self.streaming = True
+            self.watched = {}
+            self.loaded_time = -1
+            self.loaded_timeline = 0
+            self.loaded_durations = [0] * len(timelines)
+        for i, nodes in enumerate(chunks):
+            if nodes:
+                self.load_append(i, nodes)
+        return True
+
+    def load_append(self, index, nodes):
+        """
+        Adds nodes to the performance being loaded. Nodes appended to the running timeline start when they are due.
+        :param index: timeline index, 0 if the performance has no timelines
+        :param nodes: list of nodes
+        """
+        with self.lock:
+            performance = self.running_performance
+            if not self.streaming or not performance:
+                return False
+        timelines = performance['timelines'] if 'timelines' in performance else [performance]
+        if not 0 <= index < len(timelines):
+            return False
+        chunk = self.validate_timeline({'id': timelines[index].get('id', ''), 'nodes': nodes})
+        nodes = chunk['nodes']
+        prepared = self.prepare_performance(chunk)
+        self.prepare_region_samplers(chunk)
+        with self.lock:
+            if performance is not self.running_performance:
+                return False
+            self.prepared.update(prepared)
+            timelines[index]['nodes'].extend(nodes)
+            self.performance_version += 1
+            self.loaded_durations[index] = max([self.loaded_durations[index]] + [
+                node['start_time'] + node['duration'] for node in nodes])
+            if nodes:
+                offset = sum(d for t, d in zip(timelines[:index], self.loaded_durations) if t.get('enabled', True))
+                self.loaded_time = max(self.loaded_time, offset + max(node['start_time'] for node in nodes))
+            self.loaded_timeline = max(self.loaded_timeline, index)
+        return True
+
+    def load_commit(self):
+        """ Completes the performance being loaded """
+        with self.lock:
+            if not self.streaming:
+                return False
+            self.streaming = False
+            logger.info('loaded: {0}'.format(self.running_performance.get('id', 'NO ID')))
+            self.topics['running_performance'].publish(String(json.dumps(self.running_performance)))
+        return True
+
+    def watched_files(self, performance):
+        """ YAML files of the performance timelines and their signatures """
+        timelines = performance['timelines'] if 'timelines' in performance else [performance]
+        watched = {}
+        for i, timeline in enumerate(timelines):
+            path = self.get_timeline_path(timeline['id']) if timeline.get('id') else None
+            signature = self.library.signature(path) if path else None
+            if signature:
+                watched[i] = (path, signature)
+        return watched
+
+    def watch(self):
+        """ Patches timelines of the loaded performance edited on disk into it, also while it plays """
+        while True:
+            time.sleep(self.watch_interval)
+            with self.lock:
+                performance = self.running_performance
+                watched = list(self.watched.items())
+            for index, (path, signature) in watched:
+                current = self.library.signature(path)
+                if current is None or current == signature:
+                    continue
+                try:
+                    self.reload_timeline(performance, index, path, current)
+                except Exception as ex:
+                    logger.error('Can not reload {}: {}'.format(path, ex))
+                    with self.lock:
+                        if performance is self.running_performance and index in self.watched:
+                            self.watched[index] = (path, current)
+
+    def reload_timeline(self, performance, index, path, signature):
+        """
+        Diffs the edited timeline against the loaded one and patches the added, removed and changed nodes in.
+        The worker patches the timeline it plays between ticks, without stopping.
+        :return: the applied patch, None if not patched
+        """
+        began = time.time()
+        timelines = performance['timelines'] if 'timelines' in performance else [performance]
+        timeline = timelines[index]
+        edited = self.get_timeline(timeline['id'])
+        if edited is None:
+            return None
+        with self.lock:
+            loaded = timeline['nodes']
+        patch = Patch(performance, index, loaded, edited['nodes'])
+        new = {'id': timeline['id'], 'nodes': patch.new_nodes()}
+        patch.prepared = self.prepare_performance(new)
+        self.prepare_region_samplers(new)
+        patch.diff_seconds = time.time() - began
+        with self.lock:
+            if performance is not self.running_performance or self.watched.get(index, (None,))[0] != path:
+                return None
+            self.watched[index] = (path, signature)
+            playing = self.running
+            if playing:
+                self.patches.append(patch)
+            else:
+                self.patch_timeline(patch)
+                patch.apply_seconds = time.time() - began - patch.diff_seconds
+                patch.applied.set()
+        if playing and not patch.applied.wait(5.0):
+            logger.warn('Reload of {} waits for the worker'.format(timeline['id']))
+            return None
+        if not patch.success:
+            return None
+        with self.lock:
+            if 'timelines' in performance:
+                performance['nodes'] = self.get_merged_timeline_nodes(performance['timelines'])
+                self.performance_version += 1
+            run_time = self.get_run_time() if playing else 0
+            self.record('reload', performance.get('id', ''), run_time, timeline=timeline['id'], **patch.stats())
             self.topics['running_performance'].publish(String(json.dumps(performance)))
+        logger.info('Reloaded {}: {added} added, {removed} removed, {changed} changed, diff {diff_ms} ms, '
+                    'apply {apply_ms} ms'.format(timeline['id'], **patch.stats()))
+        return patch
+
+    def patch_timeline(self, patch):
+        """ Replaces the nodes of the patched timeline, called holding the lock """
+        timelines = patch.performance['timelines'] if 'timelines' in patch.performance else [patch.performance]
+        patch.success = patch.performance is self.running_performance and \
+            timelines[patch.index]['nodes'] is patch.loaded
+        if patch.success:
+            self.prepared.update(patch.prepared)
+            for node in patch.dropped_nodes():
+                self.prepared.pop(id(node), None)
+            timelines[patch.index]['nodes'] = patch.nodes
+            self.performance_version += 1
+        return patch.success
+
+    def apply_patches(self, index, offset, pid):
+        """
+        Applies patches queued while playing. Called by the worker between ticks.
+        :param index: index of the timeline playing
+        :param offset: run time the timeline started at
+        """
+        with self.lock:
+            patches, self.patches = self.patches, []
+            run_time = self.get_run_time() - offset
+        for patch in patches:
+            began = time.time()
+            with self.lock:
+                self.patch_timeline(patch)
+            if patch.success and patch.index == index:
+                self.patch_running_nodes(patch, run_time, pid)
+            patch.apply_seconds = time.time() - began
+            patch.applied.set()
+
+    def patch_running_nodes(self, patch, run_time, pid):
+        # Running nodes were created from the loaded nodes in order
+        nodes = dict((id(data), node) for data, node in zip(patch.loaded, self.running_nodes) if node)
+        running_nodes = []
+        for data in patch.nodes:
+            node = nodes.pop(id(data), None)
+            if node is None:
+                node = Node.createNode(data, self, run_time, pid)
+                # Edited nodes which should be playing now start right away, the others when due
+                if node and run_time < node.end_time():
+                    node.started = node.finished = False
+            running_nodes.append(node)
+        # Removed and changed nodes end
+        for node in nodes.values():
+            if node.started and not node.finished:
+                try:
+                    node.stop(run_time)
+                except Exception as ex:
+                    logger.error(ex)
+        self.running_nodes = running_nodes
+        self.lookahead.reset('reloaded')
+        self.lookahead.set_nodes(running_nodes, pid)
+
+    @staticmethod
+    def prepare_performance(performance):
+        """
+        Normalizes the nodes into shared specs and renders their outgoing messages, so starting a node is
+        little more than a publish. Nodes equal to ones loaded before reuse their specs.
+        :param performance: validated performance
+        :return: dictionary of id(node data) -> (node data, spec)
+        """
+        prepared = {}
+        timelines = performance['timelines'] if 'timelines' in performance else [performance]
+        for timeline in timelines:
+            for node in timeline['nodes']:
+                try:
+                    prepared[id(node)] = (node, Node.prepareNode(node))
+                except Exception as ex:
+                    # Node will fail the same way once it starts
+                    logger.debug('Can not prepare node {}: {}'.format(node, ex))
+        return prepared
+
+    def get_spec(self, data):
+        entry = self.prepared.get(id(data))
+        return entry[1] if entry and entry[0] is data else None
+
+    def prepare_region_samplers(self, performance):
+        timelines = performance['timelines'] if 'timelines' in performance else [performance]
+        for timeline in timelines:
+            path = os.path.dirname(timeline.get('id', ''))
+            for node in timeline['nodes']:
+                if node.get('name') in ['look_at', 'gaze_at'] and node.get('attention_region', 'custom') != 'custom':
+                    self.get_region_sampler(path, node['attention_region'])
+
+    def get_region_sampler(self, path, region_type):
+        """
+        Sampler for the regions in performance properties. Built once, properties reload rebuilds them.
+        :param path: performance path
+        :param region_type: region type
+        """
+        key = (path, region_type)
+        sampler = self.region_samplers.get(key)
+        if sampler is None:
+            sampler = RegionSampler(self.get_property(path, 'regions') or [], region_type)
+            self.region_samplers[key] = sampler
+        return sampler
 
     def run_callback(self, request):
         return srv.RunResponse(self.run(request.startTime))
 
-    def load_attention_regions(self, id):
-        regions = rospy.get_param(
+    def get_attention_regions(self, id):
+        return rospy.get_param(
             '/' + os.path.join(self.robot_name, "webui/performances", id,
                                "properties/regions"), [])
+
+    def load_attention_regions(self, id, regions=None):
+        if regions is None:
+            regions = self.get_attention_regions(id)
         rospy.set_param('/{}/performance_regions'.format(self.robot_name), regions)
 
     def unload_attention_regions(self):
         rospy.set_param('/{}/performance_regions'.format(self.robot_name), [])
 
-    def run(self, start_time, unload_finished=False):
+    def run(self, start_time, unload_finished=False, snapshot=None):
         start_time = float(start_time or 0)
         self.stop()
         # Wait for worker to stop performance and enter waiting before proceeding
         self.run_condition.acquire()
         with self.lock:
-            success = self.running_performance and len(self.running_performance) > 0
+            success = self.running_performance and len(self.running_performance) > 0 and \
+                (not self.streaming or start_time <= self.loaded_time)
             if success:
                 self.unload_finished = unload_finished
-                self.running = True
-                self.start_time = start_time
-                self.start_timestamp = time.time()
-                log_data = {
-                    'performance_report': True,
-                    'performance_id': self.running_performance.get('id', ''),
-                    'performance_time': start_time,
-                    'performance_action': 'run'
-                }
-                logger.warn('Running performance #{} at: {}'.format(log_data['performance_id'], start_time), extra={'data': log_data})
+                self.resume_snapshot = snapshot
+                self.set_playback(running=True, start_time=start_time, start_timestamp=self.clock.time())
+                self.record('run', self.running_performance.get('id', ''), start_time)
                 # notify worker thread
                 self.run_condition.notify()
 
@@ -327,27 +998,18 @@ class Runner:
 
     def resume_callback(self, request):
         success = self.resume()
-        with self.lock:
-            run_time = self.get_run_time()
-
-        return srv.ResumeResponse(success, run_time)
+        return srv.ResumeResponse(success, self.get_run_time())
 
     def resume(self):
         success = False
         with self.lock:
             if self.running and self.paused:
                 run_time = self.get_run_time()
-                self.paused = False
-                self.start_timestamp = time.time() - run_time
-                self.start_time = 0
+                self.set_playback(paused=False, start_timestamp=self.clock.time() - run_time, start_time=0)
+                # Whoever took over while paused may have changed targets and soma
+                self.topics.reset()
                 self.topics['events'].publish(Event('resume', run_time))
-                log_data = {
-                    'performance_report': True,
-                    'performance_id': self.running_performance.get('id', ''),
-                    'performance_time': run_time,
-                    'performance_action': 'resume'
-                }
-                logger.warn('Resume performance #{} at: {}'.format(log_data['performance_id'], run_time), extra={'data': log_data})
+                self.record('resume', self.running_performance.get('id', ''), run_time)
                 success = True
 
         return success
@@ -357,16 +1019,12 @@ class Runner:
         with self.lock:
             if self.running:
                 stop_time = self.get_run_time()
-                self.running = False
-                self.paused = False
+                self.set_playback(running=False, paused=False)
                 self.topics['tts_control'].publish('shutup')
-                log_data = {
-                    'performance_report': True,
-                    'performance_id': self.running_performance.get('id', '') if self.running_performance else '',
-                    'performance_time': stop_time,
-                    'performance_action': 'stop'
-                }
-                logger.warn('Stopping performance #{} at: {}'.format(log_data['performance_id'], stop_time), extra={'data': log_data})
+                self.tts_requests.clear()
+                self.lookahead.reset('stopped')
+                performance_id = self.running_performance.get('id', '') if self.running_performance else ''
+                self.record('stop', performance_id, stop_time)
         return stop_time
 
     def stop_callback(self, request=None):
@@ -374,8 +1032,7 @@ class Runner:
 
     def pause_callback(self, request):
         if self.pause():
-            with self.lock:
-                return srv.PauseResponse(True, self.get_run_time())
+            return srv.PauseResponse(True, self.get_run_time())
         else:
             return srv.PauseResponse(False, 0)
 
@@ -383,54 +1040,75 @@ class Runner:
     def pause(self):
         with self.lock:
             if self.running and not self.paused:
-                self.pause_time = time.time()
-                self.paused = True
+                self.set_playback(paused=True, pause_time=self.clock.time())
                 paused_time = self.get_run_time()
                 self.topics['events'].publish(Event('paused', paused_time))
-                log_data = {
-                    'performance_report': True,
-                    'performance_id': self.running_performance.get('id', ''),
-                    'performance_time': paused_time,
-                    'performance_action': 'paused'
-                }
-                logger.warn('Pause performance #{} at: {}'.format(log_data['performance_id'], paused_time), extra={'data': log_data})
+                self.lookahead.reset('paused')
+                self.record('paused', self.running_performance.get('id', ''), paused_time)
                 return True
             else:
                 return False
 
     # Returns current performance
     def current_callback(self, request):
+        state = self.playback
+        return srv.CurrentResponse(performance=self.serialized_performance(),
+                                   current_time=state.run_time(self.clock.time()),
+                                   running=state.running and not state.paused)
+
+    def serialized_performance(self):
+        """
+        JSON of the loaded performance. Serialized holding the lock once after it was loaded or changed,
+        as loads and patches change it from other threads, and served without the lock until then.
+        """
+        performance, version, data = self.serialized
+        if performance is self.running_performance and version == self.performance_version:
+            return data
         with self.lock:
-            current_time = self.get_run_time()
-            running = self.running and not self.paused
-            return srv.CurrentResponse(performance=json.dumps(self.running_performance),
-                                       current_time=current_time,
-                                       running=running)
+            performance = self.running_performance
+            self.serialized = (performance, self.performance_version, json.dumps(performance))
+            return self.serialized[2]
 
     def interrupt(self):
         with self.lock:
             if self.running_performance:
-                self.interrupted_performances.append({
-                    'performance': self.running_performance,
-                    'time': self.get_run_time(),
-                    # need to store this for node objects to stay alive and for callbacks to work
-                    'nodes': self.running_nodes
-                })
+                interrupted = self.interrupted_performances
+                if len(interrupted) == interrupted.maxlen:
+                    logger.warn('Forgetting interrupted #{0} at {1}, more than {2} interrupted'.format(
+                        interrupted[0].id, interrupted[0].time, interrupted.maxlen))
+                running_nodes = self.running_nodes if self.running else []
+                interrupted.append(Snapshot(self.running_performance, self.get_run_time(), self.running_timeline,
+                                            running_nodes, self.running_offset, self.prepared))
         self.stop()
 
     def resume_interrupted(self):
-        found = len(self.interrupted_performances)
+        with self.lock:
+            found = len(self.interrupted_performances)
+            snapshot = self.interrupted_performances.pop() if found else None
 
         if found:
-            data = self.interrupted_performances.pop()
-            time = data['time']
-            logger.info('Resuming interrupted #{0} at {1}. {2} performances left'.format(data['performance']
-                                                                                       .get('id', ''), time, found - 1))
-            self.load_performance(data['performance'])
-            self.run(time)
+            logger.info('Resuming interrupted #{0} at {1}. {2} performances left'.format(snapshot.id, snapshot.time,
+                                                                                       found - 1))
+            self.restore(snapshot)
+            self.run(snapshot.time, snapshot=snapshot)
 
         return found
 
+    def restore(self, snapshot):
+        """ Loads the interrupted performance without validating or preparing it again """
+        prepared = snapshot.prepared()
+        if prepared is None:
+            prepared = self.prepare_performance({'nodes': snapshot.remaining()})
+        with self.lock:
+            performance = snapshot.performance
+            logger.info('load: {0}'.format(performance.get('id', 'NO ID')))
+            self.load_attention_regions(performance.get('id', 'invalid'))
+            self.prepared = prepared
+            self.running_performance = performance
+            self.streaming = False
+            self.watched = self.watched_files(performance)
+            self.topics['running_performance'].publish(String(json.dumps(performance)))
+
     def append_to_queue(self, id, time=0):
         logger.info('Adding performance #{0} to the queue scheduled to run at {1}'.format(id, time))
         self.queue.append({'id': id, 'time': time})
@@ -454,12 +1132,12 @@ class Runner:
         self.run_condition.acquire()
         while True:
             with self.lock:
-                self.paused = False
-                self.running = False
+                self.set_playback(running=False, paused=False)
 
             self.topics['events'].publish(Event('idle', 0))
-            self.run_condition.wait()
+            self.wait_for_run()
             self.topics['events'].publish(Event('running', self.start_time))
+            self.topics.reset()
 
             with self.lock:
                 if not self.running_performance:
@@ -478,9 +1156,16 @@ class Runner:
                 running = True
                 self.running_nodes = [Node.createNode(node, self, self.start_time - offset, timeline.get('id', '')) for node in
                          timeline['nodes']]
+                with self.lock:
+                    self.running_timeline = i
+                    self.running_offset = offset
+                    if self.resume_snapshot and self.resume_snapshot.restore(i, self.running_nodes):
+                        self.resume_snapshot = None
                 pid = timeline.get('id', '')
+                self.lookahead.set_nodes(self.running_nodes, pid)
                 finished = None
                 run_time = 0
+                held = False
                 pause = pid and self.get_property(os.path.dirname(pid), 'pause_behavior')
                 # Pause must be either enabled or not set (by default all performances are
                 # pausing behavior if its not set)
@@ -488,14 +1173,7 @@ class Runner:
 
                 if (pause or pause is None) and behavior:
                     # Only pause behavior if its already running. Otherwise Pause behavior have no effect
-                    behavior_enabled = False
-
-                    try:
-                        behavior_enabled = rospy.get_param("/behavior_enabled")
-                    except KeyError:
-                        pass
-
-                    if behavior_enabled:
+                    if self.behavior_enabled:
                         self.topics['interaction'].publish('btree_off')
                         behavior = False
 
@@ -504,32 +1182,71 @@ class Runner:
                         break
 
                 while running:
+                    if self.profiler.changed:
+                        self.profiler.switch()
+                    if self.patches:
+                        self.apply_patches(i, offset, pid)
                     with self.lock:
                         run_time = self.get_run_time()
                         if not self.running:
                             self.topics['events'].publish(Event('finished', run_time))
                             break
-
-                        if self.paused:
-                            continue
+                        paused = self.paused
+                        # More nodes of this timeline may come while the performance is loaded in chunks
+                        streaming = self.streaming and self.loaded_timeline <= i
+                        # Playback holds at the loaded time until the nodes after it are appended
+                        if streaming and not paused and run_time > self.loaded_time:
+                            if not held:
+                                logger.warn('Waiting for nodes after {:.3f} of {}'.format(self.loaded_time, pid))
+                            self.set_playback(start_timestamp=self.start_timestamp + run_time - self.loaded_time)
+                            run_time = self.loaded_time
+                            held = True
+                        else:
+                            held = False
+                        streamed = timeline['nodes'][len(self.running_nodes):] \
+                            if len(timeline['nodes']) > len(self.running_nodes) else None
+                    if streamed:
+                        late = [node for node in streamed if node['start_time'] < run_time - offset]
+                        if late:
+                            logger.warn('{} nodes of {} appended after their start time start late'.format(
+                                len(late), pid))
+                        nodes = [Node.createNode(node, self, min(run_time - offset, node['start_time']), pid)
+                                 for node in streamed]
+                        self.lookahead.add_nodes(nodes, len(self.running_nodes))
+                        self.running_nodes += nodes
 
                     running = False
-                    # checks if any nodes still running
-                    for k, node in enumerate(self.running_nodes):
-                        running = node.run(run_time - offset) or running
+                    self.topics.begin_tick()
+                    try:
+                        self.layers.tick()
+                        if not paused:
+                            # checks if any nodes still running
+                            for k, node in enumerate(self.running_nodes):
+                                running = node.run(run_time - offset) or running
+                            running = running or streaming
+                    finally:
+                        self.topics.end_tick()
+
+                    if paused:
+                        self.clock.wait_until(self.layers.next_timestamp())
+                        running = True
+                        continue
+                    self.lookahead.update(run_time - offset)
+                    if held and self.clock.event_driven:
+                        # Nothing moves until more nodes are appended
+                        self.clock.wait_until(self.layers.next_timestamp())
+                        continue
+
+                    if running and self.clock.event_driven:
+                        self.clock.wait_until(self.get_next_event_timestamp(run_time, offset))
 
                     if finished is None:
                         # true if all performance nodes are already finished
                         finished = not running
 
-                log_data = {
-                    'performance_report': True,
-                    'performance_id': self.running_performance.get('id', '') if self.running_performance else '',
-                    'performance_time': run_time,
-                    'performance_action': 'finished'
-                }
                 if i == len(timelines) - 1:
-                    logger.warn('Finished performance #{} at: {}'.format(log_data['performance_id'], run_time), extra={'data': log_data})
+                    performance_id = self.running_performance.get('id', '') if self.running_performance else ''
+                    self.record('finished', performance_id, run_time)
 
                 offset += self.get_timeline_duration(timeline)
 
@@ -541,26 +1258,64 @@ class Runner:
 
             if not behavior:
                 self.topics['interaction'].publish('btree_on')
+            # Pause nodes of a stopped performance aren't stopped
+            self.stop_listening()
+            # Layers may take over the channels the performance used
+            self.topics.release(FOREGROUND)
 
             if self.unload_finished:
                 self.unload_finished = False
                 self.unload()
 
-    def get_run_time(self):
+    def wait_for_run(self):
+        """ Waits until run() is called, ticking layers meanwhile. Called by the worker holding run_condition. """
+        while True:
+            if self.profiler.changed:
+                self.profiler.switch()
+            with self.lock:
+                if self.running:
+                    return
+            if not self.layers.running():
+                self.run_condition.wait()
+                continue
+            self.topics.begin_tick()
+            try:
+                self.layers.tick()
+            finally:
+                self.topics.end_tick()
+            timestamp = self.layers.next_timestamp()
+            if self.clock.event_driven and timestamp is not None:
+                self.clock.wait_until(timestamp)
+                # let run() in
+                self.run_condition.wait(0.001)
+            else:
+                self.run_condition.wait(self.LAYER_TICK_INTERVAL)
+
+    def get_next_event_timestamp(self, run_time, offset):
         """
-        Must acquire self.lock in order to safely use this method
-        :return:
+        Clock timestamp of the next state change of the running nodes
+        :param run_time: current run time
+        :param offset: offset of the running timeline
+        :return: timestamp or None if nodes only wait for external events
         """
-        run_time = 0
+        times = [node.next_time(run_time - offset) for node in self.running_nodes]
+        times.append(self.lookahead.next_time(run_time - offset))
+        times = [t for t in times if t is not None]
+        layers = self.layers.next_timestamp()
+        with self.lock:
+            if not self.running or self.paused or not times:
+                return layers
+            timestamp = self.start_timestamp + min(times) + offset - self.start_time + self.EVENT_EPSILON
+            return min(timestamp, layers) if layers is not None else timestamp
 
-        if self.running:
-            run_time = self.start_time
-            if self.paused:
-                run_time += self.pause_time - self.start_timestamp
-            else:
-                run_time += time.time() - self.start_timestamp
+    # Loaded performance, part of the playback state. Set holding self.lock.
+    @property
+    def running_performance(self):
+        return self.playback.performance
 
-        return run_time
+    @running_performance.setter
+    def running_performance(self, performance):
+        self.set_playback(performance=performance)
 
     # Notifies register nodes on the events from ROS.
     def notify(self, event, msg):
@@ -590,28 +1345,105 @@ class Runner:
                 logger.info('Unregistering event handler for "{0}" which now has {1} handlers'
                             .format(event, len(self.observers[event])))
 
+    # Pause nodes listening for keywords. Returns the reference to stop listening.
+    def listen_keywords(self, keywords):
+        with self.keywords_lock:
+            ref = next(self.keyword_ids)
+            self.keyword_listeners[ref] = str(keywords)
+            self.publish_keywords()
+        return ref
+
+    # Stops the listener, or all of them if no reference given
+    def stop_listening(self, ref=None):
+        with self.keywords_lock:
+            if ref is None:
+                changed = bool(self.keyword_listeners)
+                self.keyword_listeners.clear()
+            else:
+                changed = self.keyword_listeners.pop(ref, None) is not None
+            if changed:
+                self.publish_keywords()
+
+    def publish_keywords(self):
+        keywords = sorted(set(self.keyword_listeners.values()))
+        self.keywords_pub.publish(String(json.dumps(keywords)))
+        # Parameter kept for clients not subscribed to the topic
+        rospy.set_param(self.namespace + 'keywords_listening', ','.join(keywords) or False)
+
+    def behavior_enabled_callback(self, msg):
+        self.behavior_enabled = msg.data
+
     def hand_callback(self, msg):
         self.notify('HAND', msg)
         self.notify(msg.data, msg)
 
     def load_properties(self):
-        robot_name = rospy.get_param('/robot_name')
-        robot_path = os.path.join(self.performances_dir, robot_name)
+        """
+        Reads .properties files changed since the last call and publishes the properties of the folders changed
+        under /<robot>/webui/performances, leaving the rest of the tree to other writers
+        :return: performance folders with changed properties
+        """
+        robot_path = os.path.join(self.performances_dir, self.robot_name)
         common_path = os.path.join(self.performances_dir, 'common')
+        # Folder -> .properties file, robot folders override common ones
+        files = {}
         for path in [common_path, robot_path]:
             for root, dirnames, filenames in os.walk(path):
                 if '.properties' in filenames:
-                    filename = os.path.join(root, '.properties')
-                    if os.path.isfile(filename):
-                        try:
-                            with open(filename) as f:
-                                properties = yaml.load(f.read())
-                                dir = os.path.relpath(root, path)
-                                rospy.set_param('/' + os.path.join(self.robot_name, 'webui/performances', dir).strip(
-                                    "/.") + '/properties', properties)
-                        except:
-                            rospy.logerr("Cant load properties file for {}".format(dir))
+                    files[os.path.relpath(root, path).strip("/.")] = os.path.join(root, '.properties')
+        properties = {}
+        for dir, filename in files.items():
+            signature = (filename, self.library.signature(filename))
+            cached = self.properties.get(dir)
+            if cached and cached[0] == signature:
+                properties[dir] = cached
+                continue
+            try:
+                properties[dir] = (signature, self.library.get_timeline(filename))
+            except:
+                rospy.logerr("Cant load properties file for {}".format(dir))
+                if cached:
+                    properties[dir] = cached
+        changed = sorted(dir for dir in set(properties) | set(self.properties)
+                         if dir not in properties or dir not in self.properties or
+                         properties[dir][1] != self.properties[dir][1])
+        self.properties = properties
+        if changed:
+            self.region_samplers = {}
+        values = []
+        deleted = []
+        for dir in changed:
+            param_name = os.path.join('/', self.robot_name, 'webui/performances', dir, 'properties')
+            # Removed or empty file
+            if properties.get(dir, (None, None))[1] is None:
+                deleted.append(param_name)
+            else:
+                values.append((param_name, properties[dir][1]))
+        self.update_params(values, deleted)
+        return changed
 
+    def update_params(self, values, deleted=()):
+        """
+        Sets and deletes parameters in one round trip to the master
+        :param values: list of (name, value) to set
+        :param deleted: names to delete, those not set are ignored
+        """
+        if not values and not deleted:
+            return
+        master = xmlrpclib.MultiCall(xmlrpclib.ServerProxy(rosgraph.get_master_uri(), allow_none=True))
+        caller_id = rospy.get_name()
+        for name, value in values:
+            master.setParam(caller_id, name, value)
+        for name in deleted:
+            master.deleteParam(caller_id, name)
+        try:
+            results = list(master())
+        except Exception as ex:
+            logger.error('Can not update parameters: {}'.format(ex))
+            return
+        for (name, value), (code, message, _) in zip(values, results):
+            if code != 1:
+                logger.error('Can not set {}: {}'.format(name, message))
 
     def get_property(self, path, name):
         param_name = os.path.join('/', self.robot_name, 'webui/performances', path, 'properties', name)
@@ -619,7 +1451,7 @@ class Runner:
 
     def set_variable(self, id, properties):
         for key, val in properties.iteritems():
-            rospy.logerr("id {} key {} val {}".format(id, key, val))
+            logger.debug("id {} key {} val {}".format(id, key, val))
             if id in self.variables:
                 self.variables[id][key] = val
             else:
@@ -669,5 +1501,38 @@ class Runner:
         self.notify('FACE_TRAINING', msg.data)
 
 
+def pool_processes(argv):
+    """
+    Number of parsing processes for the ~warm_up_processes and ~load_processes parameters given on the
+    command line, e.g. _load_processes:=1, as the pool is forked before rospy.init_node() can read them.
+    :return: 0 if both parse in the node process
+    """
+    values = {'warm_up_processes': [], 'load_processes': []}
+    for arg in argv:
+        name, remap, value = arg.partition(':=')
+        name = name[1:].rsplit('/', 1)[-1] if name.startswith('_') and not name.startswith('__') else None
+        if remap and name in values:
+            values[name].append(yaml.safe_load(value) or 0)
+    sizes = [size for name in values for size in values[name] or [0] if size != 1]
+    if not sizes:
+        return 0
+    # Unset or 0 parses in one process per CPU, also for warm up with a single CPU
+    return max(size or multiprocessing.cpu_count() for size in sizes)
+
+
 if __name__ == '__main__':
-    Runner()
+    # Parsing processes are forked before rospy starts its threads
+    library = Library(os.environ.get('PERFORMANCES_DIR'))
+    processes = pool_processes(sys.argv)
+    if processes:
+        library.start_pool(processes)
+    rospy.init_node('performances')
+    logger.info('Parsing processes: %d', processes)
+    robots = rospy.get_param('~robots', [])
+    if robots:
+        # One process serving several robots, each under its own namespace
+        runners = [Runner(robot_name, library=library, namespace='~{}/'.format(robot_name)) for robot_name in robots]
+    else:
+        runner = Runner(library=library)
+    startup.report()
+    rospy.spin()
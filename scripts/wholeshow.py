@@ -1,12 +1,13 @@
 #!/usr/bin/env python
 # Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved 
+import json
 import logging
 import os
 import re
-import time
 import random
 import subprocess
 import threading
+from collections import deque
 
 from transitions import *
 from transitions.extensions import HierarchicalMachine
@@ -18,22 +19,34 @@ from hr_msgs.msg import ChatMessage
 from hr_msgs.msg import Event
 from hr_msgs.msg import Target, SomaState
 from performances.cfg import WholeshowConfig
+from performances.clock import monotonic
+from performances.latency import summary
 from performances.nodes import pause
+from performances.startup import LazyModule, StartupProfile
 from std_msgs.msg import String, Bool
-import dynamic_reconfigure.client
+from std_srvs.srv import Trigger, TriggerResponse
 import performances.srv as srv
 
 logger = logging.getLogger('hr.performance.wholeshow')
 rospack = rospkg.RosPack()
+dynamic_reconfigure_client = LazyModule('dynamic_reconfigure.client')
+# Seconds from process start to speech being handled
+startup = StartupProfile('wholeshow')
+startup.mark('imports')
 
 
 class WholeShow(HierarchicalMachine):
     OPENCOG_ENTER = ['enable advanced', 'start advanced', 'activate advanced']
     OPENCOG_EXIT = ['disable advanced', 'deactivate advanced', 'exit advanced']
 
-    def __init__(self):
-        rospy.wait_for_service('/performances/reload_properties')
+    # Speech waiting to be routed, also until the services are available. Oldest is dropped first
+    SPEECH_BUFFER_SIZE = 20
+    # Utterance to performance latencies kept for speech_stats
+    LATENCY_WINDOW = 200
+    # Seconds to wait for Blender after its services appear
+    BLENDER_SETTLE_TIME = 2
 
+    def __init__(self):
         # States for wholeshow
         states = [{'name': 'sleeping', 'children': ['shutting']},
                   {'name': 'interacting', 'children': ['nonverbal']},
@@ -56,37 +69,54 @@ class WholeShow(HierarchicalMachine):
         self.on_enter_sleeping_shutting("system_shutdown")
         # ROS Handling
         rospy.init_node('WholeShow')
-        self.btree_pub = rospy.Publisher("/behavior_switch", String, queue_size=5)
-        self.btree_sub = rospy.Subscriber("/behavior_switch", String, self.btree_cb)
-        self.soma_pub = rospy.Publisher('/blender_api/set_soma_state', SomaState, queue_size=10)
-        self.look_pub = rospy.Publisher('/blender_api/set_face_target', Target, queue_size=10)
-        self.gaze_pub = rospy.Publisher('/blender_api/set_gaze_target', Target, queue_size=10)
-        self.performance_runner = rospy.ServiceProxy('/performances/run_full_performance', srv.RunByName)
+        # With ~multi_robot the runner serves several robots, its services and topics are under
+        # <runner>/<robot> and robot topics under /<robot>, as the runner names them
+        self.robot_name = rospy.get_param('~robot_name', '') or rospy.get_param('/robot_name')
+        self.robot_ns = ''
+        self.runner_ns = rospy.get_param('~runner', '/performances').rstrip('/')
+        if rospy.get_param('~multi_robot', False):
+            self.robot_ns = '/' + self.robot_name
+            self.runner_ns += self.robot_ns
+        # Speech is ingested by the subscriber, routed by one thread and performances are triggered by another,
+        # so an utterance doesn't wait for the performance of the one before to load
+        self.ready = False
+        self.speech_condition = threading.Condition()
+        # (message, time received)
+        self.speech_buffer = deque(maxlen=self.SPEECH_BUFFER_SIZE)
+        self.speech_received = 0
+        self.speech_dropped = 0
+        # (performance, time the utterance was received) to run next, a newer one supersedes it
+        self.trigger_condition = threading.Condition()
+        self.pending_trigger = None
+        self.triggers_superseded = 0
+        # Time the utterance of the performance being started was received
+        self.starting_trigger = None
+        # Seconds from receiving the utterance until it was routed, dispatched, and the performance was running
+        self.latencies = dict((stage, deque(maxlen=self.LATENCY_WINDOW))
+                              for stage in ['routed', 'triggered', 'dispatched', 'running'])
+        self.btree_pub = rospy.Publisher(self.robot_ns + "/behavior_switch", String, queue_size=5)
+        self.btree_sub = rospy.Subscriber(self.robot_ns + "/behavior_switch", String, self.btree_cb)
+        self.soma_pub = rospy.Publisher(self.robot_ns + '/blender_api/set_soma_state', SomaState, queue_size=10)
+        self.look_pub = rospy.Publisher(self.robot_ns + '/blender_api/set_face_target', Target, queue_size=10)
+        self.gaze_pub = rospy.Publisher(self.robot_ns + '/blender_api/set_gaze_target', Target, queue_size=10)
+        # Performances load in background, what plays stops once the next one is ready
+        self.performance_loader = rospy.ServiceProxy(self.runner_ns + '/load_async', srv.LoadAsync)
+        self.ticket_runner = rospy.ServiceProxy(self.runner_ns + '/run_ticket', srv.RunTicket)
+        self.blender_param = rospy.ServiceProxy(self.robot_ns + '/blender_api/set_param', SetParam)
         # Wholeshow starts with behavior enabled, unless set otherwise
-        rospy.set_param("/behavior_enabled", rospy.get_param("/behavior_enabled", True))
-        # Start sleeping. Wait for Blender to load
-        rospy.wait_for_service('/blender_api/set_param')
-        rospy.wait_for_service('/performances/current')
-        self.blender_param = rospy.ServiceProxy('/blender_api/set_param', SetParam)
-        time.sleep(2)
-        self.sleeping = rospy.get_param('start_sleeping', False)
-        if self.sleeping:
-            t = threading.Timer(1, self.to_sleeping)
-            t.start()
+        self.behavior_enabled = rospy.get_param(self.robot_ns + "/behavior_enabled", True)
+        self.behavior_pub = rospy.Publisher(self.robot_ns + "/behavior_enabled", Bool, queue_size=1, latch=True)
+        self.set_behavior_enabled(self.behavior_enabled)
+        # Keywords pause nodes of the running performance wait for
+        self.keywords_listening = []
+        rospy.Subscriber(self.runner_ns + '/keywords_listening', String, self.keywords_cb)
         # Performance id as key and keyword array as value
         self.performances_keywords = {}
         # Parse on load.
         # TODO make sure we reload those once performances are saved.
         self.after_performance = False
-        # Speech handler. Receives all speech input, and forwards to chatbot if its not a command input,
-        #  or chat is enabled
-        self.speech_sub = rospy.Subscriber('speech', ChatMessage, self.speech_cb)
-        self.speech_pub = rospy.Publisher('chatbot_speech', ChatMessage, queue_size=10)
-        # Sleep
-        self.performance_events = rospy.Subscriber('/performances/events', Event, self.performances_cb)
         # Dynamic reconfigure
         self.config = {}
-        self.cfg_srv = Server(WholeshowConfig, self.config_cb)
         # Behavior was paused entering into state
         self.behavior_paused = False
         # Chatbot was paused entering the state
@@ -95,11 +125,92 @@ class WholeShow(HierarchicalMachine):
         # Preferred speech source
         self.speech_provider = rospy.get_param("active_stt", 'cloudspeech')
         self.speech_provider_active = False
+        # Speech handler. Receives all speech input, and forwards to chatbot if its not a command input,
+        #  or chat is enabled
+        self.speech_sub = rospy.Subscriber('speech', ChatMessage, self.speech_cb)
+        self.speech_pub = rospy.Publisher('chatbot_speech', ChatMessage, queue_size=10)
+        # Sleep
+        self.performance_events = rospy.Subscriber(self.runner_ns + '/events', Event, self.performances_cb)
+        self.cfg_srv = Server(WholeshowConfig, self.config_cb)
         rospy.Subscriber('{}/status'.format(self.speech_provider), Bool, self.stt_status_cb)
+        rospy.Service('~speech_stats', Trigger, self.speech_stats_callback)
+        startup.mark('first_service')
+        t = threading.Thread(target=self.wait_for_services)
+        t.setDaemon(True)
+        t.start()
+
+    def wait_for_services(self):
+        rospy.wait_for_service(self.runner_ns + '/reload_properties')
+        rospy.wait_for_service(self.runner_ns + '/current')
+        rospy.wait_for_service(self.robot_ns + '/blender_api/set_param')
+        # Start sleeping once Blender is loaded
+        if self.sleeping:
+            t = threading.Timer(self.BLENDER_SETTLE_TIME + 1, self.to_sleeping)
+            t.start()
+        dispatcher = threading.Thread(target=self.dispatch)
+        dispatcher.setDaemon(True)
+        dispatcher.start()
+        with self.speech_condition:
+            self.ready = True
+        startup.mark('ready')
+        startup.report()
+        # Speech received meanwhile first, in order
+        self.route_speech()
+
+    def route_speech(self):
+        """ Routes utterances in the order received """
+        while True:
+            with self.speech_condition:
+                while not self.speech_buffer:
+                    self.speech_condition.wait()
+                msg, received = self.speech_buffer.popleft()
+            self.record_latency('routed', received)
+            try:
+                self.handle_speech(msg, received)
+            except Exception as ex:
+                logger.error('Can not handle speech {}: {}'.format(msg.utterance, ex))
+
+    def trigger(self, performance, received=None):
+        """ Runs the performance from the dispatcher thread. Performance waiting to run is superseded. """
+        with self.trigger_condition:
+            if self.pending_trigger:
+                self.triggers_superseded += 1
+                logger.info('Performance {} superseded by {}'.format(self.pending_trigger[0], performance))
+            self.pending_trigger = (performance, received)
+            self.trigger_condition.notify()
+        self.record_latency('triggered', received)
+
+    def dispatch(self):
+        while True:
+            with self.trigger_condition:
+                while not self.pending_trigger:
+                    self.trigger_condition.wait()
+                performance, received = self.pending_trigger
+                self.pending_trigger = None
+            # Runner may publish the running event before the service returns
+            self.starting_trigger = received
+            try:
+                ticket = self.performance_loader(performance, True).ticket
+                success = self.ticket_runner(ticket, 0.0).success
+            except Exception as ex:
+                logger.error('Can not run performance {}: {}'.format(performance, ex))
+                success = False
+            if not success:
+                self.starting_trigger = None
+                continue
+            self.record_latency('dispatched', received)
 
+    def record_latency(self, stage, received):
+        if received is not None:
+            self.latencies[stage].append(monotonic() - received)
 
-
-
+    def speech_stats_callback(self, request):
+        with self.speech_condition:
+            stats = {'received': self.speech_received, 'dropped': self.speech_dropped,
+                     'waiting': len(self.speech_buffer)}
+        stats['superseded'] = self.triggers_superseded
+        stats['latency_ms'] = dict((stage, summary(list(values))) for stage, values in self.latencies.items())
+        return TriggerResponse(success=True, message=json.dumps(stats))
 
     def start_sleeping(self):
         """States callbacks """
@@ -128,6 +239,17 @@ class WholeShow(HierarchicalMachine):
 
     def speech_cb(self, msg):
         """ ROS Callbacks """
+        with self.speech_condition:
+            if not self.ready:
+                logger.info("Speech before services are available %s" % msg)
+            if len(self.speech_buffer) == self.speech_buffer.maxlen:
+                self.speech_dropped += 1
+                logger.warn('Dropping speech {}, too much speech waiting'.format(self.speech_buffer[0][0].utterance))
+            self.speech_buffer.append((msg, monotonic()))
+            self.speech_received += 1
+            self.speech_condition.notify()
+
+    def handle_speech(self, msg, received=None):
         logger.info("Incoming speech %s" % msg)
         if self.config.get('filter_stt', True) and not self.filter_stt(msg):
             return
@@ -150,13 +272,13 @@ class WholeShow(HierarchicalMachine):
                 # use to_performng() instead of perform() so it can be called from other than interaction states
                 self.to_performing()
                 self.after_performance = self.to_sleeping
-                self.performance_runner('shared/sleep')
+                self.trigger('shared/sleep', received)
                 return False
             except:
                 pass
         if 'wake' in speech or 'makeup' in speech:
             try:
-                self.do_wake_up()
+                self.do_wake_up(received)
                 return False
             except:
                 pass
@@ -186,7 +308,7 @@ class WholeShow(HierarchicalMachine):
                 pass
             # Try wake up
             try:
-                self.do_wake_up()
+                self.do_wake_up(received)
                 return False
             except:
                 pass
@@ -216,26 +338,29 @@ class WholeShow(HierarchicalMachine):
             try:
                 self.perform()
                 on = False
-                self.performance_runner(random.choice(performances))
+                self.trigger(random.choice(performances), received)
             except:
                 pass
 
         if self.state == 'analysis' and len(analysis_performances):
             # Run performances explicitly in the analysis state (Only testing performances)
             on = False
-            self.performance_runner(random.choice(analysis_performances))
+            self.trigger(random.choice(analysis_performances), received)
 
         # Check if performance is not waiting for same keyword while its running
         if self.state == 'performing' and self.config['chat_during_performance']:
-            keywords = rospy.get_param('/performances/keywords_listening', False)
             # Don't pass the keywords if pause node waits for same keyword (i.e resume performance).
-            if keywords and pause.event_matched(keywords, msg.utterance):
+            if any(pause.event_matched(keywords, msg.utterance) for keywords in self.keywords_listening):
                 on = False
         if on:
             self.speech_pub.publish(msg)
 
     def performances_cb(self, msg):
         if msg.event == 'running':
+            received, self.starting_trigger = self.starting_trigger, None
+            self.record_latency('running', received)
+            if received is not None:
+                logger.info('Performance running {:.0f} ms after the utterance'.format((monotonic() - received) * 1000))
             try:
                 # Only go to performance state if robot is in interaction state
                 self.perform()
@@ -254,12 +379,12 @@ class WholeShow(HierarchicalMachine):
                     pass
 
 
-    def do_wake_up(self):
+    def do_wake_up(self, received=None):
         assert (self.state == 'sleeping')
         self.btree_pub.publish(String("btree_on"))
         self.after_performance = self.to_interacting
         # Start performance before triggerring state change so soma state will be sinced with performance
-        self.performance_runner('shared/wakeup')
+        self.trigger('shared/wakeup', received)
 
     @staticmethod
     def _get_soma(name, magnitude):
@@ -286,7 +411,7 @@ class WholeShow(HierarchicalMachine):
 
     def get_keywords(self, performances=None, keywords=None, path='.'):
         if performances is None:
-            performances = rospy.get_param(os.path.join('/', rospy.get_param('/robot_name'), 'webui/performances'))
+            performances = rospy.get_param(os.path.join('/', self.robot_name, 'webui/performances'))
             keywords = {}
 
         if 'properties' in performances and 'keywords' in performances['properties']:
@@ -340,14 +465,26 @@ class WholeShow(HierarchicalMachine):
     def btree_cb(self, msg):
         """
         Keeps track if behavior tree active.
-        Sets ROS param accordingly
+        Publishes the state accordingly
         :param msg: String
         :return:
         """
         if msg.data == "btree_on":
-            rospy.set_param("/behavior_enabled", True)
+            self.set_behavior_enabled(True)
         if msg.data == "btree_off":
-            rospy.set_param("/behavior_enabled", False)
+            self.set_behavior_enabled(False)
+
+    def set_behavior_enabled(self, enabled):
+        self.behavior_enabled = enabled
+        self.behavior_pub.publish(Bool(enabled))
+        # Parameter kept for clients not subscribed to the topic
+        rospy.set_param(self.robot_ns + "/behavior_enabled", enabled)
+
+    def keywords_cb(self, msg):
+        try:
+            self.keywords_listening = json.loads(msg.data)
+        except ValueError as e:
+            logger.error(e)
 
 
     def set_keep_alive(self, keep_alive=True):
@@ -359,7 +496,7 @@ class WholeShow(HierarchicalMachine):
     def on_enter_analysis(self):
         self.enable_blinking(False)
         self.set_keep_alive(False)
-        self.behavior_paused = rospy.get_param("/behavior_enabled", True)
+        self.behavior_paused = self.behavior_enabled
         if self.behavior_paused:
             self.btree_pub.publish(String("btree_off"))
         if self.is_chatbot_enabled():
@@ -383,7 +520,7 @@ class WholeShow(HierarchicalMachine):
     @staticmethod
     def set_chatbot_enabled(enabled=True):
         try:
-            cl = dynamic_reconfigure.client.Client('chatbot', timeout=0.1)
+            cl = dynamic_reconfigure_client.Client('chatbot', timeout=0.1)
             cl.update_configuration({"enable": enabled})
             cl.close()
         except:
@@ -392,7 +529,7 @@ class WholeShow(HierarchicalMachine):
     @staticmethod
     def is_chatbot_enabled():
         try:
-            cl = dynamic_reconfigure.client.Client('chatbot', timeout=0.1)
+            cl = dynamic_reconfigure_client.Client('chatbot', timeout=0.1)
             config = cl.get_configuration()
             return config['enable']
         except:
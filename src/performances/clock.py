@@ -0,0 +1,228 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Time sources for the runner and nodes
+import heapq
+import itertools
+import logging
+import time
+from collections import namedtuple
+from threading import RLock, Timer
+
+logger = logging.getLogger('hr.performances.clock')
+
+
+def monotonic_source():
+    """ Seconds from CLOCK_MONOTONIC, time.time() if the platform has no monotonic clock """
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        library = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = library.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        CLOCK_MONOTONIC = 1
+
+        def monotonic():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)):
+                raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+            return t.tv_sec + t.tv_nsec * 1e-9
+
+        monotonic()
+        return monotonic
+    except Exception as ex:
+        logger.warn('No monotonic clock, playback follows wall clock changes: {}'.format(ex))
+        return time.time
+
+
+monotonic = monotonic_source()
+
+
+class Clock(object):
+    """
+    Wall clock. Runner and nodes read time, sleep and schedule timers through
+    a clock object so playback can also be driven by VirtualClock.
+
+    Time is the wall time the clock was created at plus the monotonic time since,
+    so playback is not affected when the system clock is set. offset() tells how
+    far the wall clock moved away since.
+    """
+    # Worker thread asks the clock to jump to the next node event if True.
+    event_driven = False
+
+    def __init__(self):
+        self.origin = time.time() - monotonic()
+
+    def time(self):
+        return self.origin + monotonic()
+
+    def offset(self):
+        """ Seconds the wall clock is ahead of this clock """
+        return time.time() - self.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def timer(self, interval, function):
+        """ threading.Timer compatible object, not started """
+        return Timer(interval, function)
+
+    def wait_until(self, timestamp):
+        """
+        Called by the worker between ticks with the timestamp of the next node
+        event, or None if it has nothing to do until something external happens.
+        Real time playback keeps polling, so there is nothing to wait for.
+        """
+        pass
+
+
+class VirtualTimer(object):
+    def __init__(self, clock, interval, function):
+        self.clock = clock
+        self.interval = interval
+        self.function = function
+        self.entry = None
+
+    def start(self):
+        self.entry = self.clock.call_at(self.clock.time() + self.interval, self.function)
+
+    def cancel(self):
+        if self.entry:
+            self.clock.cancel(self.entry)
+            self.entry = None
+
+
+class VirtualClock(Clock):
+    """
+    Simulated time which only moves when the worker waits for its next node
+    event or a node sleeps. Whole performances play back in a fraction of real
+    time and deterministically. Scripted events (pause, resume, speech...) are
+    scheduled with call_at() and run on the worker thread at their virtual time.
+    """
+    event_driven = True
+
+    def __init__(self, start=0.0, limit=None, on_stall=None):
+        """
+        :param start: initial timestamp
+        :param limit: virtual timestamp after which on_stall is called
+        :param on_stall: called when the worker waits for an external event and
+                         nothing is scheduled anymore
+        """
+        self.now = float(start)
+        self.limit = limit
+        self.on_stall = on_stall
+        self.scheduled = []
+        self.sequence = itertools.count()
+        self.lock = RLock()
+
+    def time(self):
+        return self.now
+
+    def offset(self):
+        return 0.0
+
+    def sleep(self, seconds):
+        self.advance(self.now + seconds, interrupt=False)
+
+    def timer(self, interval, function):
+        return VirtualTimer(self, interval, function)
+
+    def call_at(self, timestamp, function):
+        entry = [timestamp, next(self.sequence), function]
+        with self.lock:
+            heapq.heappush(self.scheduled, entry)
+        return entry
+
+    def cancel(self, entry):
+        # cancelled entries stay in the heap but do nothing
+        entry[2] = None
+
+    def next_scheduled(self):
+        with self.lock:
+            while self.scheduled and self.scheduled[0][2] is None:
+                heapq.heappop(self.scheduled)
+            return self.scheduled[0][0] if self.scheduled else None
+
+    def wait_until(self, timestamp):
+        scheduled = self.next_scheduled()
+        if timestamp is None:
+            timestamp = scheduled
+        if timestamp is None:
+            self.stall()
+        elif self.limit is not None and timestamp > self.limit:
+            # callbacks due before the limit still run
+            if scheduled is not None and scheduled <= self.limit:
+                self.advance(scheduled)
+            else:
+                self.stall()
+        else:
+            self.advance(timestamp)
+
+    def advance(self, timestamp, interrupt=True):
+        """
+        Moves time forward to timestamp, running scheduled callbacks on the way.
+        With interrupt the clock stops right after the first due callbacks so the
+        worker can react to them before time moves on.
+        """
+        while True:
+            with self.lock:
+                scheduled = self.next_scheduled()
+                if scheduled is None or scheduled > timestamp:
+                    break
+                self.now = max(self.now, scheduled)
+                _, _, function = heapq.heappop(self.scheduled)
+            if function:
+                function()
+            if interrupt:
+                with self.lock:
+                    if self.next_scheduled() != scheduled:
+                        return
+        self.now = max(self.now, timestamp)
+
+    def stall(self):
+        if self.on_stall:
+            self.on_stall()
+        else:
+            logger.warning('Virtual clock stalled at {}'.format(self.now))
+
+
+class PlaybackState(namedtuple('PlaybackState', 'running paused start_time start_timestamp pause_time performance')):
+    """
+    Playback clock of a runner or layer and the performance it plays. Never changed, every
+    state change replaces the whole object, so readers see consistent fields without a lock.
+    """
+    __slots__ = ()
+
+    def run_time(self, now):
+        """ Run time at clock timestamp now """
+        if not self.running:
+            return 0
+        if self.paused:
+            return self.start_time + self.pause_time - self.start_timestamp
+        return self.start_time + now - self.start_timestamp
+
+
+STOPPED = PlaybackState(False, False, 0, 0, 0, None)
+
+
+class PlaybackClock(object):
+    """
+    Playback state of the runner and layers. Writers hold self.lock and swap self.playback,
+    readers such as service callbacks take self.playback once and don't wait for the worker.
+    The clock fields are also plain attributes for the worker and nodes, which read them every tick.
+    """
+    playback = STOPPED
+    running, paused, start_time, start_timestamp, pause_time = STOPPED[:5]
+
+    def set_playback(self, **changes):
+        """ Called holding self.lock """
+        self.playback = self.playback._replace(**changes)
+        self.running, self.paused, self.start_time, self.start_timestamp, self.pause_time = self.playback[:5]
+
+    def get_run_time(self):
+        """ Safe without self.lock """
+        return self.playback.run_time(self.clock.time())
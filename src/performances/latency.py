@@ -0,0 +1,132 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Output latency per channel, so nodes of different channels take effect together
+from collections import deque
+from threading import Lock
+
+# Alignment errors kept per channel for the report
+WINDOW = 200
+# Dispatches not acknowledged within this many seconds are forgotten
+ACK_TIMEOUT = 10.0
+
+
+def summary(values):
+    """ Seconds, e.g. alignment errors positive if late, summarized in ms """
+    if not values:
+        return {'n': 0}
+    ordered = sorted(values)
+    return {
+        'n': len(ordered),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 3),
+        'mean_abs': round(sum(abs(v) for v in ordered) / len(ordered) * 1000, 3),
+        'p50': round(ordered[len(ordered) // 2] * 1000, 3),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        'max_abs': round(max(abs(ordered[0]), abs(ordered[-1])) * 1000, 3),
+    }
+
+
+class ChannelLatency(object):
+    def __init__(self, configured=0.0):
+        self.configured = configured
+        self.estimate = configured
+        self.acknowledged = 0
+        # (clock time dispatched, clock time it should take effect, output key) waiting for acknowledgement
+        self.pending = deque(maxlen=32)
+        # Predicted errors when nodes were dispatched, run time accuracy of the worker
+        self.dispatch_errors = deque(maxlen=WINDOW)
+        # Acknowledged minus the time it should have taken effect
+        self.errors = deque(maxlen=WINDOW)
+
+
+class Latencies(object):
+    """
+    Latency of output channels, e.g. TTS synthesis or Blender starting an animation. Nodes of a channel are
+    dispatched that much before their start time so outputs aligned in the timeline are aligned on stage.
+    Estimates start with the configured latencies, channels with acknowledgements follow the measured ones.
+    """
+
+    def __init__(self, clock, configured=None, acknowledged=(), alpha=0.2, limit=2.0):
+        """
+        :param clock: runner clock
+        :param configured: channel -> seconds
+        :param acknowledged: channels whose outputs are acknowledged by acknowledge()
+        :param alpha: weight of a new measurement in the estimate
+        :param limit: largest estimate, in seconds
+        """
+        self.clock = clock
+        self.acknowledged = set(acknowledged)
+        self.alpha = alpha
+        self.limit = limit
+        self.enabled = True
+        self.lock = Lock()
+        self.channels = {}
+        for channel, seconds in (configured or {}).items():
+            self.channels[channel] = ChannelLatency(min(self.limit, max(0.0, float(seconds))))
+
+    def lead(self, channel):
+        """ Seconds nodes of the channel start before their start time """
+        if not self.enabled:
+            return 0.0
+        latency = self.channels.get(channel)
+        return latency.estimate if latency else 0.0
+
+    def channel(self, channel):
+        # Called holding the lock
+        latency = self.channels.get(channel)
+        if latency is None:
+            latency = self.channels[channel] = ChannelLatency()
+        return latency
+
+    def dispatched(self, channel, lead, remaining, key=None):
+        """
+        Called when a node of the channel started
+        :param lead: seconds the node started ahead of its start time
+        :param remaining: run time left to its start time, negative if started late
+        :param key: identifies the output in acknowledgements, e.g. the text spoken
+        """
+        now = self.clock.time()
+        with self.lock:
+            latency = self.channel(channel)
+            latency.dispatch_errors.append(lead - remaining)
+            if channel in self.acknowledged:
+                latency.pending.append((now, now + remaining, key))
+
+    def acknowledge(self, channel, key=None):
+        """
+        Output of the channel took effect, measures the latency of its dispatch. With a key only the dispatch
+        of that output is acknowledged, outputs the runner didn't dispatch are ignored and older dispatches
+        are forgotten. Without a key the oldest dispatch not acknowledged is.
+        :return: True if a dispatch was acknowledged
+        """
+        now = self.clock.time()
+        with self.lock:
+            latency = self.channels.get(channel)
+            if not latency:
+                return False
+            while latency.pending and now - latency.pending[0][0] > ACK_TIMEOUT:
+                latency.pending.popleft()
+            keys = [pending[2] for pending in latency.pending]
+            if not keys or (key is not None and key not in keys):
+                return False
+            for _ in range(keys.index(key) if key is not None else 0):
+                latency.pending.popleft()
+            dispatched, expected, _ = latency.pending.popleft()
+            measured = now - dispatched
+            if not latency.acknowledged and not latency.configured:
+                # Nothing to start from
+                latency.estimate = measured
+            latency.estimate = min(self.limit, max(0.0, latency.estimate + self.alpha * (measured - latency.estimate)))
+            latency.acknowledged += 1
+            latency.errors.append(now - expected)
+            return True
+
+    def report(self):
+        """ Estimates and achieved alignment per channel """
+        with self.lock:
+            channels = dict((name, {
+                'latency_ms': round(latency.estimate * 1000, 3),
+                'configured_ms': round(latency.configured * 1000, 3),
+                'acknowledged': latency.acknowledged,
+                'dispatch_error_ms': summary(latency.dispatch_errors),
+                'error_ms': summary(latency.errors),
+            }) for name, latency in self.channels.items())
+        return {'enabled': self.enabled, 'clock_offset': round(self.clock.offset(), 6), 'channels': channels}
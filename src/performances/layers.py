@@ -0,0 +1,261 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Performances playing alongside the foreground performance
+import logging
+from threading import Lock
+
+from performances.clock import PlaybackClock
+from performances.nodes import Node
+
+logger = logging.getLogger('hr.performances.layers')
+
+
+class LayerTopics(object):
+    """ Runner topics as seen by nodes of a layer, publishing with the layer priority """
+
+    def __init__(self, layer, outputs):
+        self.layer = layer
+        self.outputs = outputs
+        self.channels = {}
+
+    def __getitem__(self, name):
+        if name not in self.channels:
+            self.channels[name] = LayerChannel(self.layer, self.outputs[name])
+        return self.channels[name]
+
+    def __contains__(self, name):
+        return name in self.outputs
+
+
+class LayerChannel(object):
+    def __init__(self, layer, channel):
+        self.layer = layer
+        self.channel = channel
+
+    def publish(self, *args, **kwargs):
+        self.channel.publish_as(self.layer.name, self.layer.priority_for(self.channel.name), *args, **kwargs)
+
+
+class Layer(PlaybackClock):
+    """
+    Named performance playing at the same time as the foreground one, with its own
+    pause, stop and seek. The runner worker ticks layers on the shared clock.
+
+    Nodes see the layer as their runner: playback state and topics are the layer's,
+    everything else is the runner's. Outputs are arbitrated per channel, see Outputs.
+    """
+
+    def __init__(self, runner, name, priority=0, priorities=None, loop=False):
+        """
+        :param runner: Runner
+        :param name: layer name
+        :param priority: output priority, the foreground performance has Outputs.FOREGROUND_PRIORITY
+        :param priorities: channel name -> priority, overrides priority for these channels
+        :param loop: start over when finished
+        """
+        self.runner = runner
+        self.name = name
+        self.priority = priority
+        self.priorities = priorities or {}
+        self.loop = loop
+        self.topics = LayerTopics(self, runner.topics)
+        self.trace = runner.trace.for_layer(name)
+        self.lock = Lock()
+        self.prepared = {}
+        self.timelines = []
+        # Set by run(), nodes are created by the worker on the next tick
+        self.restart = False
+        self.index = 0
+        self.offset = 0
+        self.nodes = []
+
+    def __getattr__(self, name):
+        # Services, clock, variables and the rest are shared with the runner
+        return getattr(self.runner, name)
+
+    @property
+    def performance(self):
+        return self.playback.performance
+
+    def priority_for(self, channel):
+        return self.priorities.get(channel, self.priority)
+
+    def load(self, performance):
+        self.runner.validate_performance(performance)
+        prepared = self.runner.prepare_performance(performance)
+        with self.lock:
+            self.set_playback(performance=performance)
+            self.prepared = prepared
+            self.timelines = [t for t in performance.get('timelines', [performance]) if t.get('enabled', True)]
+
+    def get_spec(self, data):
+        entry = self.prepared.get(id(data))
+        return entry[1] if entry and entry[0] is data else None
+
+    def run(self, start_time=0.0):
+        with self.lock:
+            if not self.performance:
+                return False
+            self.set_playback(running=True, paused=False, start_time=float(start_time or 0),
+                              start_timestamp=self.clock.time())
+            self.restart = True
+        logger.info('Layer {} running {} at {}'.format(self.name, self.performance.get('id', ''), start_time))
+        self.runner.wake_worker()
+        return True
+
+    def seek(self, run_time):
+        """ Continues from run_time, staying paused if paused """
+        state = self.playback
+        if not state.running:
+            return False
+        paused = state.paused
+        self.run(run_time)
+        if paused:
+            self.pause()
+        return True
+
+    def pause(self):
+        with self.lock:
+            if self.running and not self.paused:
+                self.set_playback(paused=True, pause_time=self.clock.time())
+                return True
+        return False
+
+    def resume(self):
+        with self.lock:
+            if self.running and self.paused:
+                run_time = self.get_run_time()
+                self.set_playback(paused=False, start_timestamp=self.clock.time() - run_time, start_time=0)
+                success = True
+            else:
+                success = False
+        if success:
+            self.runner.wake_worker()
+        return success
+
+    def stop(self):
+        with self.lock:
+            stop_time = self.get_run_time()
+            self.set_playback(running=False, paused=False)
+        self.runner.topics.release(self.name)
+        return stop_time
+
+    def tick(self):
+        """ Runs nodes of the layer, called by the worker """
+        with self.lock:
+            if not self.running:
+                return
+            run_time = self.get_run_time()
+            paused = self.paused
+            if self.restart:
+                self.restart = False
+                self.start_timeline(0, 0, run_time)
+        if paused:
+            return
+        while self.running:
+            running = False
+            for node in self.nodes:
+                running = node.run(run_time - self.offset) or running
+            if running:
+                return
+            with self.lock:
+                offset = self.offset + (self.runner.get_timeline_duration(self.timelines[self.index])
+                                        if self.timelines else 0)
+                if self.index + 1 < len(self.timelines):
+                    self.start_timeline(self.index + 1, offset, run_time)
+                elif self.loop and offset > 0:
+                    self.set_playback(start_time=0, start_timestamp=self.clock.time())
+                    run_time = 0
+                    self.start_timeline(0, 0, run_time)
+                else:
+                    self.set_playback(running=False)
+        logger.info('Layer {} finished'.format(self.name))
+        self.runner.topics.release(self.name)
+
+    def start_timeline(self, index, offset, run_time):
+        # Called with self.lock held. Skips timelines which are already over at run_time.
+        while index + 1 < len(self.timelines) and \
+                run_time >= offset + self.runner.get_timeline_duration(self.timelines[index]):
+            offset += self.runner.get_timeline_duration(self.timelines[index])
+            index += 1
+        self.index = index
+        self.offset = offset
+        timeline = self.timelines[index] if self.timelines else {'nodes': []}
+        nodes = [Node.createNode(node, self, run_time - offset, timeline.get('id', '')) for node in timeline['nodes']]
+        self.nodes = [node for node in nodes if node]
+
+    def next_timestamp(self):
+        """ Clock timestamp of the next state change of layer nodes, for event driven clocks """
+        with self.lock:
+            if not self.running or self.paused:
+                return None
+            if self.restart:
+                return self.clock.time()
+            run_time = self.get_run_time()
+            times = [node.next_time(run_time - self.offset) for node in self.nodes]
+            times = [t for t in times if t is not None]
+            if not times:
+                # Timeline is over, next one starts on the next tick
+                return self.clock.time()
+            return self.start_timestamp + min(times) + self.offset - self.start_time + self.runner.EVENT_EPSILON
+
+    def state(self):
+        state = self.playback
+        return {
+            'name': self.name,
+            'performance': state.performance.get('id', '') if state.performance else None,
+            'running': state.running,
+            'paused': state.paused,
+            'current_time': state.run_time(self.clock.time()),
+            'priority': self.priority,
+            'priorities': self.priorities,
+            'loop': self.loop,
+        }
+
+
+class Layers(object):
+    """ Named layers of the runner """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.layers = {}
+
+    def get(self, name):
+        with self.lock:
+            return self.layers.get(name)
+
+    def add(self, layer):
+        # Claims are held by layer name, the layer replaced releases them before the new one can claim
+        with self.lock:
+            previous = self.layers.pop(layer.name, None)
+        if previous:
+            previous.stop()
+        with self.lock:
+            self.layers[layer.name] = layer
+
+    def remove(self, name):
+        with self.lock:
+            layer = self.layers.pop(name, None)
+        if layer:
+            layer.stop()
+        return layer
+
+    def all(self):
+        with self.lock:
+            return list(self.layers.values())
+
+    def running(self):
+        """ True if any layer plays, paused layers need no ticks """
+        return any(layer.running and not layer.paused for layer in self.all())
+
+    def tick(self):
+        for layer in self.all():
+            try:
+                layer.tick()
+            except Exception as ex:
+                logger.error('Layer {} failed: {}'.format(layer.name, ex))
+                layer.stop()
+
+    def next_timestamp(self):
+        times = [layer.next_timestamp() for layer in self.all()]
+        times = [t for t in times if t is not None]
+        return min(times) if times else None
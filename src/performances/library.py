@@ -0,0 +1,154 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Performance files shared by runners of one process
+import copy
+import fnmatch
+import logging
+import multiprocessing
+import os
+import time
+from threading import Lock
+
+import yaml
+
+logger = logging.getLogger('hr.performances.library')
+
+# libyaml parser if PyYAML was built with it, same results several times faster
+Loader = getattr(yaml, 'CLoader', yaml.Loader)
+
+
+def parse(path):
+    """ Parses YAML file in a warm-up worker process """
+    try:
+        signature = Library.signature(path)
+        with open(path, 'r') as f:
+            return path, signature, yaml.load(f.read(), Loader=Loader), None
+    except Exception as ex:
+        return path, None, None, str(ex)
+
+
+class Library(object):
+    """
+    Parsed timelines and directory listings of PERFORMANCES_DIR, shared by all runners of
+    the process. Files are parsed again only if they changed on disk, runners get copies
+    they are free to modify.
+    """
+
+    def __init__(self, performances_dir):
+        self.performances_dir = performances_dir
+        self.lock = Lock()
+        # path -> ((mtime, size), parsed timeline)
+        self.timelines = {}
+        # path -> (mtime, sub-directories, yaml files)
+        self.dirs = {}
+        # Parsing processes, forked by start_pool()
+        self.pool = None
+        self.processes = 0
+
+    def start_pool(self, processes=None):
+        """
+        Forks the parsing processes. Call it before rospy.init_node(), a process forked while rospy
+        threads run may inherit their locks held. Without a pool files are parsed in this process.
+        :param processes: number of parsing processes, CPU count by default
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(self.processes)
+
+    @staticmethod
+    def signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def get_timeline(self, path):
+        """
+        :param path: YAML file
+        :return: copy of the parsed file, None if there is no such file
+        """
+        signature = self.signature(path)
+        if signature is None:
+            return None
+        with self.lock:
+            entry = self.timelines.get(path)
+        if not entry or entry[0] != signature:
+            with open(path, 'r') as f:
+                entry = (signature, yaml.load(f.read(), Loader=Loader))
+            with self.lock:
+                self.timelines[path] = entry
+        return copy.deepcopy(entry[1])
+
+    def listdir(self, path):
+        """
+        :param path: directory
+        :return: lists of sub-directories and YAML files, None if there is no such directory
+        """
+        if not os.path.isdir(path):
+            return None
+        mtime = os.path.getmtime(path)
+        with self.lock:
+            entry = self.dirs.get(path)
+        if not entry or entry[0] != mtime:
+            root, dirs, files = next(os.walk(path))
+            entry = (mtime, dirs, fnmatch.filter(files, '*.yaml'))
+            with self.lock:
+                self.dirs[path] = entry
+        return list(entry[1]), list(entry[2])
+
+    def warm_up(self, roots, processes=None):
+        """
+        Lists all directories under roots and parses the YAML files which are not cached yet
+        in the parsing processes. Takes a while, call it from a background thread.
+        :param roots: directories to walk
+        :param processes: 1 to parse in this process
+        :return: dictionary with the parsed files and errors by path and the time taken
+        """
+        began = time.time()
+        paths = []
+        for top in roots:
+            for root, dirs, files in os.walk(top):
+                files = fnmatch.filter(files, '*.yaml')
+                with self.lock:
+                    self.dirs[root] = (os.path.getmtime(root), dirs, files)
+                paths += [os.path.join(root, name) for name in files]
+        # Parsing processes keep the node responsive while warming up, also with a single CPU
+        result = self.parse_all(paths, processes, pool=True)
+        result['seconds'] = time.time() - began
+        return result
+
+    def parse_all(self, paths, processes=None, pool=None):
+        """
+        Parses the YAML files which are not cached yet
+        :param paths: YAML files
+        :param processes: 1 to parse in this process
+        :param pool: parse in the parsing processes if started, by default if there are several of them and files
+        :return: dictionary with the parsed files and errors by path
+        """
+        stale = []
+        for path in set(paths):
+            with self.lock:
+                entry = self.timelines.get(path)
+            if not entry or entry[0] != self.signature(path):
+                stale.append(path)
+        workers = self.pool if processes != 1 else None
+        if pool is None:
+            pool = workers is not None and self.processes > 1 and len(stale) > 1
+        parsed = []
+        errors = {}
+        if pool and workers and stale:
+            results = list(workers.imap_unordered(parse, stale, chunksize=8))
+        else:
+            results = [parse(path) for path in stale]
+        for path, signature, timeline, error in results:
+            if error:
+                errors[path] = error
+                continue
+            with self.lock:
+                self.timelines[path] = (signature, timeline)
+            parsed.append(path)
+        return {'parsed': parsed, 'errors': errors}
+
+    def clear(self):
+        with self.lock:
+            self.timelines = {}
+            self.dirs = {}
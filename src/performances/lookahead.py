@@ -0,0 +1,160 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Announces upcoming nodes so downstream consumers can prepare them before they start
+import bisect
+import json
+import logging
+from collections import deque
+from threading import Condition, Lock, Thread
+
+from std_msgs.msg import String
+
+logger = logging.getLogger('hr.performances.lookahead')
+
+
+class Lookahead(object):
+    """
+    Publishes JSON messages on the lookahead topic:
+
+    {"event": "upcoming", "performance": id, "nodes": [{"id", "name", "start_time", "eta", "stamp", ...}]}
+        nodes starting within the horizon, announced once each. eta is seconds from now,
+        stamp is the runner clock time it is expected to start at.
+    {"event": "reset", "performance": id, "reason": "paused" | "stopped" | "reloaded"}
+        previous announcements are no longer valid. After resume or seek the nodes still
+        ahead are announced again.
+
+    The worker picks the nodes to announce, a background thread gets their previews, which may
+    read variables from the parameter server, and publishes in order.
+    """
+
+    def __init__(self, publisher, clock, horizon=0.0):
+        self.publisher = publisher
+        self.clock = clock
+        self.horizon = horizon
+        self.lock = Lock()
+        self.performance = ''
+        # (start_time, index, node) of nodes which have something to announce, by start time
+        self.candidates = []
+        self.start_times = []
+        self.position = None
+        self.announced = 0
+        # Messages to publish, upcoming ones as (performance, [(announcement, node)])
+        self.queue = deque()
+        self.condition = Condition()
+        self.publishing = False
+        self.announcer = Thread(target=self.announce)
+        self.announcer.setDaemon(True)
+        self.announcer.start()
+
+    def set_nodes(self, nodes, performance=''):
+        with self.lock:
+            self.performance = performance
+            self.candidates = sorted((n.start_time, i, n) for i, n in enumerate(nodes) if n and n.lookahead)
+            self.start_times = [c[0] for c in self.candidates]
+            self.position = None
+
+    def add_nodes(self, nodes, index=0):
+        """
+        Adds nodes to the running timeline without announcing the others again
+        :param nodes: new nodes
+        :param index: index of the first new node in the timeline
+        """
+        with self.lock:
+            for i, node in enumerate(nodes, index):
+                if not node or not node.lookahead:
+                    continue
+                position = bisect.bisect_right(self.start_times, node.start_time)
+                self.candidates.insert(position, (node.start_time, i, node))
+                self.start_times.insert(position, node.start_time)
+                if self.position is not None and position < self.position:
+                    # Behind nodes already announced, starts without announcement
+                    self.position += 1
+
+    def reset(self, reason):
+        with self.lock:
+            self.position = None
+            if self.announced:
+                self.announced = 0
+                self.enqueue({'event': 'reset', 'performance': self.performance, 'reason': reason})
+
+    def update(self, run_time):
+        """
+        Announces nodes starting before run_time + horizon. Called by the worker every tick.
+        :param run_time: run time of the running timeline
+        """
+        if self.horizon <= 0 or not self.candidates:
+            return
+        with self.lock:
+            if self.position is None:
+                # Nodes before run time already started
+                self.position = bisect.bisect_right(self.start_times, run_time)
+            end = run_time + self.horizon
+            if self.position >= len(self.candidates) or self.candidates[self.position][0] > end:
+                return
+            upcoming = []
+            now = self.clock.time()
+            while self.position < len(self.candidates) and self.candidates[self.position][0] <= end:
+                start_time, index, node = self.candidates[self.position]
+                self.position += 1
+                if node.started or node.finished:
+                    continue
+                eta = max(0.0, start_time - run_time)
+                announcement = {'id': '{}#{}'.format(node.id or self.performance, index), 'name': node.data['name'],
+                                'start_time': start_time, 'eta': eta, 'stamp': now + eta}
+                upcoming.append((announcement, node))
+            if upcoming:
+                self.announced += len(upcoming)
+                self.enqueue((self.performance, upcoming))
+
+    def next_time(self, run_time):
+        """ Run time of the next announcement, for event driven clocks """
+        if self.horizon <= 0 or not self.candidates:
+            return None
+        with self.lock:
+            position = self.position
+            if position is None:
+                position = bisect.bisect_right(self.start_times, run_time)
+            if position >= len(self.candidates):
+                return None
+            return self.candidates[position][0] - self.horizon
+
+    def enqueue(self, message):
+        with self.condition:
+            self.queue.append(message)
+            self.condition.notify()
+
+    def idle(self):
+        """ True if everything announced was published """
+        with self.condition:
+            return not self.queue and not self.publishing
+
+    def announce(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                message = self.queue.popleft()
+                self.publishing = True
+            try:
+                if isinstance(message, tuple):
+                    message = self.upcoming(*message)
+                if message:
+                    self.publish(message)
+            except Exception as ex:
+                logger.error('Can not publish lookahead: {}'.format(ex))
+            finally:
+                with self.condition:
+                    self.publishing = False
+
+    def upcoming(self, performance, announcements):
+        nodes = []
+        for announcement, node in announcements:
+            try:
+                announcement.update(node.preview())
+            except Exception as ex:
+                logger.debug('No preview for {}: {}'.format(node.data, ex))
+                continue
+            nodes.append(announcement)
+        return {'event': 'upcoming', 'performance': performance, 'nodes': nodes} if nodes else None
+
+    def publish(self, data):
+        self.publisher.publish(String(json.dumps(data)))
@@ -2,55 +2,100 @@
 # Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved 
 
 # Nodes factory
+import copy
 import os
 import pprint
-import xml.etree.ElementTree as etree
 import StringIO
-import time
 import logging
 import random
 import urllib
 import re
 
-from hr_msgs.msg import ChatMessage
-from hr_msgs.msg import Event
-from hr_msgs.msg import MakeFaceExpr, PlayAnimation
-from hr_msgs.msg import SetGesture, EmotionState, Target, SomaState
-from hr_msgs.msg import TTS
-from performances.srv import RunByNameRequest
+from performances.regions import AxisSampler, RegionSampler
+from performances.specs import spec_for
+from performances.startup import LazyModule
+from performances.trace import NODE_START, NODE_STOP, NODE_ERROR
 from std_msgs.msg import String, Int32, Float32
-from threading import Timer
-from topic_tools.srv import MuxSelect
-import dynamic_reconfigure.client
-import requests
 import rospy
 
+# Imported once a node needs them, so that importing nodes stays cheap
+etree = LazyModule('xml.etree.ElementTree')
+hr_msgs = LazyModule('hr_msgs.msg')
+reconfigure_client = LazyModule('dynamic_reconfigure.client')
+requests = LazyModule('requests')
+
 logger = logging.getLogger('hr.performances.nodes')
 
 
 class Node(object):
+    # Run state only, the definition is in the shared spec
+    __slots__ = ('spec', 'runner', 'id', 'start_time', 'duration', 'started', 'started_at', 'finished',
+                 '__weakref__')
+    # Node classes by name
+    _classes = {}
+    # Announce the node on the lookahead topic before it starts
+    lookahead = False
+    # Output channel, nodes start ahead of time by its latency
+    channel = None
+
     # Create new Node from JSON
     @staticmethod
     def subClasses(cls):
         return cls.__subclasses__() + [g for s in cls.__subclasses__()
                                        for g in cls.subClasses(s)]
 
+    @staticmethod
+    def getClass(name):
+        if name not in Node._classes:
+            Node._classes = dict((c.__name__, c) for c in Node.subClasses(Node))
+        return Node._classes.get(name)
+
     @classmethod
     def createNode(cls, data, runner, start_time=0, id=''):
-        for s_cls in cls.subClasses(cls):
-            if data['name'] == s_cls.__name__:
-                node = s_cls(data, runner)
-                node.id = id
-                if start_time > node.start_time:
-                    # Start time should be before or on node starting
-                    node.finished = True
-
-                    if start_time < node.end_time():
-                        node.started = True
-
-                return node
+        s_cls = cls.getClass(data['name'])
+        if s_cls:
+            node = s_cls(data, runner)
+            node.id = id
+            if start_time > node.start_time:
+                # Start time should be before or on node starting
+                node.finished = True
+
+                if start_time < node.end_time():
+                    node.started = True
+
+            return node
         logger.error("Wrong node description: {0}".format(str(data)))
 
+    # Shared spec of the node described by data, its messages rendered ahead of playback
+    @classmethod
+    def prepareNode(cls, data):
+        s_cls = cls.getClass(data['name'])
+        if not s_cls:
+            return None
+        spec = spec_for(s_cls, data)
+        spec.rendered
+        return spec
+
+    # Node data with the defaults filled in, data itself is not changed. Called once per distinct node.
+    @classmethod
+    def normalize(cls, data):
+        return data
+
+    # Returns everything start/stop publish which does not change at runtime. Called once per distinct node.
+    @classmethod
+    def prepare(cls, data):
+        return None
+
+    # Normalized node data, read-only
+    @property
+    def data(self):
+        return self.spec.data
+
+    # Messages rendered by prepare(). Rendered on first use if the runner did not prepare the node.
+    @property
+    def rendered(self):
+        return self.spec.rendered
+
     def replace_variables_text(self, text):
         variables = re.findall("{(\w*?)}", text)
         for var in variables:
@@ -59,9 +104,10 @@ class Node(object):
         return text
 
     def __init__(self, data, runner):
-        self.data = data
-        self.duration = max(0.1, float(data['duration']))
-        self.start_time = data['start_time']
+        spec = runner.get_spec(data)
+        self.spec = spec if spec and spec.cls is self.__class__ else spec_for(self.__class__, data)
+        self.duration = self.spec.duration
+        self.start_time = self.spec.start_time
         self.started = False
         self.started_at = 0
         self.finished = False
@@ -85,23 +131,49 @@ class Node(object):
         if self.started:
             # Time to finish:
             if run_time >= self.end_time():
-                self.stop(run_time)
+                self.hook(self.stop, run_time)
                 self.finished = True
+                self.runner.trace.node(NODE_STOP, self, run_time, self.end_time())
                 return False
             elif self.runner.paused:
                 self.paused(run_time)
             else:
-                self.cont(run_time)
+                self.hook(self.cont, run_time)
         else:
-            if run_time > self.start_time:
+            lead = self.runner.latency.lead(self.channel) if self.channel else 0.0
+            if run_time + lead > self.start_time:
+                # Recorded first, outputs published by start follow in the trace
+                self.runner.trace.node(NODE_START, self, run_time, self.start_time, lead)
                 try:
-                    self.start(run_time)
+                    self.hook(self.start, run_time)
                 except Exception as ex:
                     logger.error(ex)
+                    self.runner.trace.node(NODE_ERROR, self, run_time, self.start_time, lead, failed=True)
                 self.started = True
-                self.started_at = time.time()
+                self.started_at = self.runner.clock.time()
+                if self.channel:
+                    self.runner.latency.dispatched(self.channel, lead, self.start_time - run_time, self.output_key())
         return True
 
+    # Calls start, cont or stop, timed for the node type while the worker is profiled
+    def hook(self, method, run_time):
+        profiler = self.runner.profiler
+        if profiler.profile is None:
+            return method(run_time)
+        return profiler.call(self, method, run_time)
+
+    # Run time the node is dispatched at, its start time less the latency of its output channel
+    def effective_start(self):
+        return self.start_time - (self.runner.latency.lead(self.channel) if self.channel else 0.0)
+
+    # Node time of the next state change for event driven clocks, None if the node has nothing left to do.
+    def next_time(self, run_time):
+        if self.finished:
+            return self.end_time() if self.started and run_time < self.end_time() else None
+        if not self.started:
+            return self.effective_start()
+        return self.end_time()
+
     def __str__(self):
         return pprint.pformat(self.data)
 
@@ -121,6 +193,14 @@ class Node(object):
     def paused(self, run_time):
         pass
 
+    # Identifies the output published by start in acknowledgements of its channel
+    def output_key(self):
+        return None
+
+    # Data downstream consumers need to prepare the node before it starts. Used if lookahead is set.
+    def preview(self):
+        return {}
+
     # Method to get magnitude from either one number or range
     @staticmethod
     def _magnitude(magnitude):
@@ -133,83 +213,143 @@ class Node(object):
             except:
                 return 0.0
 
+    # Same as _magnitude, but returns (magnitude, range) so ranges can be randomized at runtime
+    @staticmethod
+    def _prepare_magnitude(magnitude):
+        try:
+            return float(magnitude), None
+        except TypeError:
+            try:
+                magnitude_range = (float(magnitude[0]), float(magnitude[1]))
+                return magnitude_range[0], magnitude_range
+            except:
+                return 0.0, None
+
+    # Copy of the prepared message with random magnitude if magnitude is given as range.
+    # Prepared messages are shared by every node of the spec and kept by outputs, so they are never changed.
+    @staticmethod
+    def _randomize_magnitude(msg, attr, magnitude_range):
+        if magnitude_range:
+            msg = copy.copy(msg)
+            setattr(msg, attr, random.uniform(*magnitude_range))
+        return msg
+
 
 class speech(Node):
-    def __init__(self, data, runner):
-        Node.__init__(self, data, runner)
-        if 'pitch' not in data:
-            self.data['pitch'] = 1.0
-        if 'speed' not in data:
-            self.data['speed'] = 1.0
-        if 'volume' not in data:
-            self.data['volume'] = 1.0
-        # Backward compatibility
-        if self.data['lang'] in ['en', 'zh']:
-            self.data['lang'] = {'en': 'en-US', 'zh': 'cmn-Hans-CN'}[self.data['lang']]
+    __slots__ = ('text',)
+    lookahead = True
+    channel = 'tts'
 
-    def start(self, run_time):
-        self.say(self.data['text'], self.data['lang'])
+    @classmethod
+    def normalize(cls, data):
+        data = dict(data)
+        data.setdefault('pitch', 1.0)
+        data.setdefault('speed', 1.0)
+        data.setdefault('volume', 1.0)
+        # Backward compatibility
+        if data['lang'] in ['en', 'zh']:
+            data['lang'] = {'en': 'en-US', 'zh': 'cmn-Hans-CN'}[data['lang']]
+        return data
 
-    def say(self, text, lang):
+    @classmethod
+    def prepare(cls, data):
+        lang = data['lang']
+        lang = {'en': 'en-US', 'zh': 'cmn-Hans-CN'}.get(lang, lang)
+        text = data['text']
         # SSML tags for non-Cantonese
         if 'HK' not in lang:
-            text = self._add_ssml(text)
+            text = cls._ssml(text, data.get('speed', 1.0), data.get('pitch', 1.0), data.get('volume', 1.0))
+        # Variables are only known at runtime
+        return {'text': text, 'lang': lang, 'variables': bool(re.search("{(\w*?)}", text))}
 
-        text = self.replace_variables_text(text)
-        self.runner.topics['tts'].publish(TTS(text, lang))
+    def start(self, run_time):
+        self.text = self.get_text()
+        self.runner.topics['tts'].publish(hr_msgs.TTS(self.text, self.rendered['lang']))
+
+    def output_key(self):
+        return getattr(self, 'text', None)
+
+    def get_text(self):
+        text = self.rendered['text']
+        if self.rendered['variables']:
+            text = self.replace_variables_text(text)
+        return text
+
+    def preview(self):
+        return {'text': self.get_text(), 'lang': self.rendered['lang']}
 
     # adds SSML tags for whole text returns updated text.
-    def _add_ssml(self, txt):
+    @staticmethod
+    def _ssml(txt, speed, pitch, volume):
         # Ignore SSML if simplified syntax is used.
         if re.search(r"[\*\@]\w+", txt):
             return txt
 
         el = etree.Element('prosody')
         el.text = txt
-        if self.data['speed'] != 1:
-            el.set('rate', '{:.2f}'.format(self.data['speed']))
-            logger.info("Add rate prosody")
-        if self.data['pitch'] != 1:
-            el.set('pitch', '{:+.2f}%'.format((self.data['pitch']-1)*100))
-            logger.info("Add pitch prosody")
-        if self.data['volume'] != 1:
-            el.set('volume', '{:+.2f}dB'.format((self.data['volume']-1)*100))
-            logger.info("Add volume prosody")
+        if speed != 1:
+            el.set('rate', '{:.2f}'.format(speed))
+        if pitch != 1:
+            el.set('pitch', '{:+.2f}%'.format((pitch-1)*100))
+        if volume != 1:
+            el.set('volume', '{:+.2f}dB'.format((volume-1)*100))
         tree = etree.ElementTree(el)
         buf = StringIO.StringIO()
         tree.write(buf)
         if el.attrib:
             txt = buf.getvalue()
-            logger.warn("Add prosody tag")
-            logger.warn("%s" % txt)
+            logger.debug("Add prosody tag %s", txt)
         return txt
 
 class gesture(Node):
-    def start(self, run_time):
-        self.runner.topics['gesture'].publish(
-            SetGesture(self.data['gesture'], 1, float(self.data['speed']), self._magnitude(self.data['magnitude'])))
+    __slots__ = ()
+    lookahead = True
+    channel = 'gesture'
+
+    @classmethod
+    def prepare(cls, data):
+        magnitude, magnitude_range = cls._prepare_magnitude(data['magnitude'])
+        return {'msg': hr_msgs.SetGesture(data[cls.__name__], 1, float(data['speed']), magnitude),
+                'magnitude_range': magnitude_range}
 
-class arm_animation(Node):
     def start(self, run_time):
-        self.runner.topics['arm_animation'].publish(
-            SetGesture(self.data['arm_animation'], 1, float(self.data['speed']), self._magnitude(self.data['magnitude'])))
+        self.runner.topics[self.__class__.__name__].publish(
+            self._randomize_magnitude(self.rendered['msg'], 'magnitude', self.rendered['magnitude_range']))
+
+    def preview(self):
+        return {'animation': self.rendered['msg'].name, 'speed': self.rendered['msg'].speed}
+
+class arm_animation(gesture):
+    __slots__ = ()
+    lookahead = False
+    channel = 'arm_animation'
 
 class emotion(Node):
+    __slots__ = ()
+    channel = 'emotion'
+
+    @classmethod
+    def prepare(cls, data):
+        magnitude, magnitude_range = cls._prepare_magnitude(data['magnitude'])
+        return {'msg': hr_msgs.EmotionState(data['emotion'], magnitude, rospy.Duration.from_sec(data['duration'])),
+                'magnitude_range': magnitude_range}
+
     def start(self, run_time):
         self.runner.topics['emotion'].publish(
-            EmotionState(self.data['emotion'], self._magnitude(self.data['magnitude']),
-                         rospy.Duration.from_sec(self.data['duration'])))
+            self._randomize_magnitude(self.rendered['msg'], 'magnitude', self.rendered['magnitude_range']))
 
 
 # Behavior tree
 class interaction(Node):
+    __slots__ = ()
+
     def start(self, run_time):
         self.runner.topics['bt_control'].publish(Int32(self.data['mode']))
         if self.data['chat'] == 'listening':
             self.runner.topics['speech_events'].publish(String('listen_start'))
         if self.data['chat'] == 'talking':
             self.runner.topics['speech_events'].publish(String('start'))
-        time.sleep(0.02)
+        self.runner.clock.sleep(0.02)
         self.runner.topics['interaction'].publish(String('btree_on'))
 
     def stop(self, run_time):
@@ -220,39 +360,63 @@ class interaction(Node):
             self.runner.topics['speech_events'].publish(String('listen_stop'))
         if self.data['chat'] == 'talking':
             self.runner.topics['speech_events'].publish(String('stop'))
-        time.sleep(0.02)
+        self.runner.clock.sleep(0.02)
         self.runner.topics['interaction'].publish(String('btree_off'))
 
 
 # Rotates head by given angle
 class head_rotation(Node):
+    __slots__ = ()
+    channel = 'head_rotation'
+
+    @classmethod
+    def prepare(cls, data):
+        return {'msg': Float32(data['angle'])}
+
     def start(self, run_time):
-        self.runner.topics['head_rotation'].publish(Float32(self.data['angle']))
+        self.runner.topics['head_rotation'].publish(self.rendered['msg'])
 
 
 class soma(Node):
+    __slots__ = ()
+    channel = 'soma_state'
+
+    @classmethod
+    def prepare(cls, data):
+        start = hr_msgs.SomaState()
+        start.magnitude = 1
+        start.ease_in.secs = 0
+        start.ease_in.nsecs = 1000000 * 300
+        start.name = data['soma']
+        stop = hr_msgs.SomaState()
+        stop.magnitude = 0
+        stop.ease_in.secs = 0
+        stop.ease_in.nsecs = 0
+        stop.name = data['soma']
+        return {'start': start, 'stop': stop}
+
     def start(self, run_time):
-        s = SomaState()
-        s.magnitude = 1
-        s.ease_in.secs = 0
-        s.ease_in.nsecs = 1000000 * 300
-        s.name = self.data['soma']
-        self.runner.topics['soma_state'].publish(s)
+        self.runner.topics['soma_state'].publish(self.rendered['start'])
 
     def stop(self, run_time):
-        s = SomaState()
-        s.magnitude = 0
-        s.ease_in.secs = 0
-        s.ease_in.nsecs = 0
-        s.name = self.data['soma']
-        self.runner.topics['soma_state'].publish(s)
+        self.runner.topics['soma_state'].publish(self.rendered['stop'])
 
 
 class expression(Node):
+    __slots__ = ('shown',)
+    channel = 'expression'
+
     def __init__(self, data, runner):
         Node.__init__(self, data, runner)
         self.shown = False
 
+    @classmethod
+    def prepare(cls, data):
+        magnitude, magnitude_range = cls._prepare_magnitude(data['magnitude'])
+        return {'msg': hr_msgs.MakeFaceExpr(data['expression'], magnitude),
+                'neutral': hr_msgs.MakeFaceExpr('Neutral', magnitude),
+                'magnitude_range': magnitude_range}
+
     def start(self, run_time):
         try:
             self.runner.services['head_pau_mux']("/" + self.runner.robot_name + "/no_pau")
@@ -263,31 +427,49 @@ class expression(Node):
 
     def cont(self, run_time):
         # Publish expression message after some delay once node is started
-        if (not self.shown) and (run_time > self.start_time + 0.05):
+        if (not self.shown) and (run_time > self.effective_start() + 0.05):
             self.shown = True
             self.runner.topics['expression'].publish(
-                MakeFaceExpr(self.data['expression'], self._magnitude(self.data['magnitude'])))
+                self._randomize_magnitude(self.rendered['msg'], 'intensity', self.rendered['magnitude_range']))
             logger.info("Publish expression {}".format(self.data))
 
+    def next_time(self, run_time):
+        if self.started and not self.finished and not self.shown:
+            return self.effective_start() + 0.05
+        return Node.next_time(self, run_time)
+
     def stop(self, run_time):
         try:
             self.runner.topics['expression'].publish(
-                MakeFaceExpr('Neutral', self._magnitude(self.data['magnitude'])))
-            time.sleep(min(1, self.duration))
+                self._randomize_magnitude(self.rendered['neutral'], 'intensity', self.rendered['magnitude_range']))
+            self.runner.clock.sleep(min(1, self.duration))
             logger.info("Neutral expression")
-            self.runner.services['head_pau_mux']("/blender_api/get_pau")
-            logger.info("Call head_pau_mux topic {}".format("/blender_api/get_pau"))
+            self.runner.services['head_pau_mux'](self.runner.robot_ns + "/blender_api/get_pau")
+            logger.info("Call head_pau_mux topic {}".format(self.runner.robot_ns + "/blender_api/get_pau"))
         except Exception as ex:
             logger.error(ex)
 
 
 class kfanimation(Node):
+    __slots__ = ('shown',)
+    lookahead = True
+    channel = 'kfanimation'
+
     def __init__(self, data, runner):
         Node.__init__(self, data, runner)
         self.shown = False
-        self.blender_disable = 'off'
-        if 'blender_mode' in self.data.keys():
-            self.blender_disable = self.data['blender_mode']
+
+    @property
+    def blender_disable(self):
+        return self.data.get('blender_mode', 'off')
+
+    @classmethod
+    def prepare(cls, data):
+        return {'msg': hr_msgs.PlayAnimation(data['animation'], int(data['fps']))}
+
+    def preview(self):
+        return {'animation': self.rendered['msg'].animation, 'fps': self.rendered['msg'].fps,
+                'blender_mode': self.blender_disable}
 
     def start(self, run_time):
         self.shown = False
@@ -303,33 +485,41 @@ class kfanimation(Node):
 
     def cont(self, run_time):
         # Publish expression message after some delay once node is started
-        if (not self.shown) and (run_time > self.start_time + 0.05):
+        if (not self.shown) and (run_time > self.effective_start() + 0.05):
             self.shown = True
-            self.runner.topics['kfanimation'].publish(
-                PlayAnimation(self.data['animation'], int(self.data['fps'])))
+            self.runner.topics['kfanimation'].publish(self.rendered['msg'])
+
+    def next_time(self, run_time):
+        if self.started and not self.finished and not self.shown:
+            return self.effective_start() + 0.05
+        return Node.next_time(self, run_time)
 
     def stop(self, run_time):
         try:
             if self.blender_disable in ['face', 'all']:
-                self.runner.services['head_pau_mux']("/blender_api/get_pau")
+                self.runner.services['head_pau_mux'](self.runner.robot_ns + "/blender_api/get_pau")
             if self.blender_disable == 'all':
-                self.runner.services['neck_pau_mux']("/blender_api/get_pau")
+                self.runner.services['neck_pau_mux'](self.runner.robot_ns + "/blender_api/get_pau")
         except Exception as ex:
             logger.error(ex)
 
 
 class pause(Node):
+    __slots__ = ('event_callback_ref', 'keywords_ref', 'timer')
+
     def __init__(self, data, runner):
         Node.__init__(self, data, runner)
         self.event_callback_ref = False
+        self.keywords_ref = None
         self.timer = False
 
-        if 'topic' not in self.data.keys():
-            self.data['topic'] = False
-        if 'on_event' not in self.data.keys():
-            self.data['on_event'] = False
-        if 'event_param' not in self.data.keys():
-            self.data['event_param'] = False
+    @classmethod
+    def normalize(cls, data):
+        data = dict(data)
+        data.setdefault('topic', False)
+        data.setdefault('on_event', False)
+        data.setdefault('event_param', False)
+        return data
 
     def start_performance(self):
         if self.timer:
@@ -384,19 +574,18 @@ class pause(Node):
                 # Paused SPEECH event should not be forwarded to chatbot if its enabled.
                 # The filtering is in wholeshow node
                 if self.data['event_param']:
-                    # Currently only single PAUSE node can listen for keywords, so global param is fine.
-                    rospy.set_param('/performances/keywords_listening', self.data['event_param'])
+                    self.keywords_ref = self.runner.listen_keywords(self.data['event_param'])
             else:
                 if self.data['event_param']:
                     if rospy.get_param(self.data['event_param'], False):
                         # Resume current performance or play performance specified
-                        self.timer = Timer(0.0, lambda: self.event_callback(self.data['event_param']))
+                        self.timer = self.runner.clock.timer(0.0, lambda: self.event_callback(self.data['event_param']))
                         self.timer.start()
                         return
         try:
             timeout = float(self.data['timeout'])
             if timeout > 0.1:
-                self.timer = Timer(timeout, self.resume)
+                self.timer = self.runner.clock.timer(timeout, self.resume)
                 self.timer.start()
         except (ValueError, KeyError) as e:
             logger.error(e)
@@ -405,6 +594,9 @@ class pause(Node):
         if self.event_callback_ref:
             self.runner.unregister(str(self.data['topic'] or '').strip(), self.event_callback_ref)
             self.event_callback_ref = None
+        if self.keywords_ref is not None:
+            self.runner.stop_listening(self.keywords_ref)
+            self.keywords_ref = None
 
     def stop(self, run_time):
         self.delete_callback_ref()
@@ -416,6 +608,8 @@ class pause(Node):
 
 
 class chat_pause(Node):
+    __slots__ = ('subscriber',)
+
     def __init__(self, data, runner):
         Node.__init__(self, data, runner)
         self.subscriber = False
@@ -423,7 +617,7 @@ class chat_pause(Node):
     def start(self, run_time):
         if 'message' in self.data and self.data['message']:
             self.runner.pause()
-            self.runner.topics['chatbot'].publish(ChatMessage(utterance=self.data['message'],
+            self.runner.topics['chatbot'].publish(hr_msgs.ChatMessage(utterance=self.data['message'],
                                                               lang='en-US', confidence=100, source='performances'))
 
             def speech_event_callback(event):
@@ -433,8 +627,9 @@ class chat_pause(Node):
             self.subscriber = rospy.Subscriber('/' + self.runner.robot_name + '/speech_events', String,
                                                speech_event_callback)
 
-            while not self.finished and self.runner.start_timestamp + self.start_time + self.duration > time.time():
-                time.sleep(0.05)
+            while not self.finished and self.runner.start_timestamp + self.start_time + self.duration > \
+                    self.runner.clock.time():
+                self.runner.clock.sleep(0.05)
         self.resume()
 
     def resume(self):
@@ -448,6 +643,10 @@ class chat_pause(Node):
 
 
 class chat(Node):
+    __slots__ = ('subscriber', 'turns', 'last_turn_at', 'chatbot_session_id', 'enable_chatbot', 'talking',
+                 'dialog_turns', 'timeout', 'timeout_mode')
+    lookahead = True
+
     def __init__(self, data, runner):
         Node.__init__(self, data, runner)
         self.subscriber = False
@@ -474,7 +673,7 @@ class chat(Node):
 
     def start(self, run_time):
         self.runner.pause()
-        self.last_turn_at = time.time()
+        self.last_turn_at = self.runner.clock.time()
 
         if self.enable_chatbot:
             self.start_chatbot_session()
@@ -484,16 +683,19 @@ class chat(Node):
                 self.get_chatbot_response(event.data) if self.enable_chatbot else self.match_response(event.data))
 
         self.subscriber = rospy.Subscriber('/' + self.runner.robot_name + '/nodes/listen/input', String, input_callback)
-        self.runner.topics['events'].publish(Event('chat', 0))
+        self.runner.topics['events'].publish(hr_msgs.Event('chat', 0))
         self.runner.register('speech_events', self.speech_event_callback)
 
     def stop(self, run_time):
         self.runner.unregister('speech_events', self.speech_event_callback)
 
+    def preview(self):
+        return {'enable_chatbot': self.enable_chatbot, 'bot_name': self.data.get('bot_name', '')}
+
     def paused(self, run_time):
         if self.timeout and not self.talking:
-            if (self.timeout_mode == 'each' and time.time() - self.last_turn_at >= self.timeout) or (
-                            self.timeout_mode == 'whole' and time.time() - self.started_at >= self.timeout):
+            if (self.timeout_mode == 'each' and self.runner.clock.time() - self.last_turn_at >= self.timeout) or (
+                            self.timeout_mode == 'whole' and self.runner.clock.time() - self.started_at >= self.timeout):
                 if 'no_speech' in self.data and self.data['no_speech']:
                     self.respond(self.data['no_speech'])
                 else:
@@ -528,7 +730,7 @@ class chat(Node):
 
     def match_response(self, speech):
         response = ''
-        if 'responses' in self.data and isinstance(self.data['responses'], list):
+        if 'responses' in self.data and isinstance(self.data['responses'], (list, tuple)):
             input = speech.lower()
             matches = []
             for r in self.data['responses']:
@@ -545,27 +747,27 @@ class chat(Node):
 
     def add_turn(self):
         self.turns += 1
-        self.last_turn_at = time.time()
+        self.last_turn_at = self.runner.clock.time()
 
         if self.turns < self.dialog_turns and not (
-                        self.timeout_mode == 'whole' and time.time() - self.started_at >= self.timeout):
-            self.runner.topics['events'].publish(Event('chat', 0))
+                        self.timeout_mode == 'whole' and self.runner.clock.time() - self.started_at >= self.timeout):
+            self.runner.topics['events'].publish(hr_msgs.Event('chat', 0))
         else:
             self.resume()
 
     def resume(self):
         self.duration = 0
         self.runner.resume()
-        self.runner.topics['events'].publish(Event('chat_end', 0))
+        self.runner.topics['events'].publish(hr_msgs.Event('chat_end', 0))
 
         if self.subscriber:
             self.subscriber.unregister()
             self.subscriber = False
 
     def respond(self, response):
-        self.runner.topics['events'].publish(Event('chat_end', 0))
+        self.runner.topics['events'].publish(hr_msgs.Event('chat_end', 0))
         self.talking = True
-        self.runner.topics['tts'].publish(TTS(response, 'en-US'))
+        self.runner.topics['tts'].publish(hr_msgs.TTS(response, 'en-US'))
 
     def speech_event_callback(self, msg):
         event = msg.data
@@ -575,10 +777,13 @@ class chat(Node):
 
 
 class attention(Node):
+    __slots__ = ('times_shown',)
+    # Target topics
+    topic = ('look_at', 'gaze_at')
+
     # Find current region at runtime
     def __init__(self, data, runner):
         Node.__init__(self, data, runner)
-        self.topic = ['look_at', 'gaze_at']
         self.times_shown = 0
 
     @staticmethod
@@ -588,69 +793,25 @@ class attention(Node):
         :param axis: string 'x' or 'y'
         :return: position and matched regions
         """
-
-        position = 0
-        matched = []
-
-        if regions:
-            regions = sorted(regions, key=lambda r: r[axis])
-            prev_end = regions[0][axis]
-            length = 0
-            lengths = []
-
-            for r in regions:
-                begin = r[axis]
-                end = begin + (r['width'] if axis == 'x' else r['height'])
-
-                if prev_end > begin:
-                    diff = prev_end - begin
-                    lengths.append([length - diff, length - diff + end - begin])
-                    begin = prev_end
-                else:
-                    lengths.append([length, length + end - begin])
-                length += max(0, end - begin)
-                prev_end = max(begin, end)
-
-            rval = random.random() * length
-
-            for i, length in enumerate(lengths):
-                if length[0] <= rval <= length[1]:
-                    matched.append(regions[i])
-                    if not position:
-                        position = regions[i][axis] + (regions[i]['width'] if axis == 'x' else regions[i]['height']) * (
-                            (rval - length[0]) / (length[1] - length[0]))
-        return position, matched
+        if not regions:
+            return 0, []
+        sampler = AxisSampler(regions, axis)
+        position, matched = sampler.sample(random.random())
+        return position, [sampler.regions[i] for i in matched]
 
     @staticmethod
     # Gets x,y,z from given regions based on region type
     def get_point_from_regions(all_regions, region_type):
-        regions = [{'x': r['x'], 'y': r['y'] - r['height'], 'width': r['width'], 'height': r['height']} for r in
-                   all_regions
-                   if r['type'] == region_type]
-        if regions:
-            y, matched = attention.get_random_axis_position(regions, 'x')
-            z, matched = attention.get_random_axis_position(matched, 'y')
-            # invert Y to match image in bg
-            return {
-                'x': 1,
-                'y': -y,
-                'z': z,
-            }
-        else:
-            # Look forward
-            return {'x': 1, 'y': 0, 'z': 0}
+        return RegionSampler(all_regions, region_type).sample()
 
     # returns random coordinate from the region
     def get_point(self, region):
-        regions = rospy.get_param(
-            '/' + os.path.join(self.runner.robot_name, "webui/performances", os.path.dirname(self.id),
-                               "properties/regions"), [])
-        return self.get_point_from_regions(regions, region)
+        return self.runner.get_region_sampler(os.path.dirname(self.id), region).sample()
 
     def set_point(self, point):
         speed = 1 if 'speed' not in self.data else self.data['speed']
         for topic in self.topic:
-            self.runner.topics[topic].publish(Target(point['x'], point['y'], point['z'], speed))
+            self.runner.topics[topic].publish(hr_msgs.Target(point['x'], point['y'], point['z'], speed))
 
     def cont(self, run_time):
         if 'attention_region' in self.data and self.data['attention_region'] != 'custom':
@@ -662,25 +823,32 @@ class attention(Node):
             self.set_point(self.data)
             self.times_shown += 1
 
+    def next_time(self, run_time):
+        t = Node.next_time(self, run_time)
+        if self.started and not self.finished:
+            if not self.times_shown:
+                # First point is set on the tick after start
+                return run_time
+            if 'interval' in self.data and self.data.get('attention_region', 'custom') != 'custom':
+                t = min(t, self.times_shown * self.data['interval'])
+        return t
+
 
 class look_at(attention):
-    # Find current region at runtime
-    def __init__(self, data, runner):
-        attention.__init__(self, data, runner)
-        self.topic = ['look_at', 'gaze_at']
+    __slots__ = ()
 
 
 class gaze_at(attention):
-    # Find current region at runtime
-    def __init__(self, data, runner):
-        attention.__init__(self, data, runner)
-        self.topic = ['gaze_at']
+    __slots__ = ()
+    topic = ('gaze_at',)
 
 
 class settings(Node):
+    __slots__ = ()
+
     def setParameters(self, rosnode, params):
         try:
-            cl = dynamic_reconfigure.client.Client(rosnode, timeout=0.1)
+            cl = reconfigure_client.Client(rosnode, timeout=0.1)
             params = self.set_variables(params)
             cl.update_configuration(params)
             cl.close()
@@ -688,12 +856,13 @@ class settings(Node):
             pass
 
     def set_variables(self, params):
+        values = {}
         for k, v in params.items():
             if isinstance(v, basestring):
-                params[k] = self.replace_variables_text(v)
+                values[k] = self.replace_variables_text(v)
             else:
-                params[k] = v
-        return params
+                values[k] = v
+        return values
 
     def start(self, run_time):
         if (self.data['rosnode']):
@@ -0,0 +1,197 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Output layer between nodes and ROS publishers
+import logging
+import threading
+
+from performances.trace import NullTrace, PUBLISH, SUPPRESSED, BLOCKED
+
+logger = logging.getLogger('hr.performances.outputs')
+
+
+# Layer name of the foreground performance
+FOREGROUND = None
+
+
+class Channel(object):
+    """
+    Publisher wrapper which remembers what it published last.
+
+    Messages equal to the last published one for the same key are dropped, they would
+    not change anything downstream. With coalesce, messages published by the worker
+    during a tick are held and only the last one is published when the tick ends, as
+    queue_size=1 publishers would drop the others anyway.
+
+    With arbitrate, layers publishing on the channel claim it until they stop, and
+    messages of layers with lower priority than another claim are blocked. When the
+    top claim is released, the state others last wanted is published again.
+    """
+
+    def __init__(self, outputs, name, publisher, key=None, dedupe=False, coalesce=False, arbitrate=False):
+        """
+        :param publisher: rospy.Publisher
+        :param key: function returning state key of a message, repeats are compared per key
+        :param dedupe: drop repeats
+        :param coalesce: only publish the last message of a tick
+        :param arbitrate: only publish messages of the layers with the top priority
+        """
+        self.outputs = outputs
+        self.name = name
+        self.publisher = publisher
+        self.key = key or (lambda msg: None)
+        self.dedupe = dedupe
+        self.coalesce = coalesce
+        self.arbitrate = arbitrate
+        self.last = {}
+        self.pending = None
+        self.pending_layer = FOREGROUND
+        # layer -> priority
+        self.claims = {}
+        # layer -> {key: message}, last state each layer wanted
+        self.wanted = {}
+        self.published = 0
+        self.suppressed = 0
+        self.coalesced = 0
+        self.blocked = 0
+
+    def publish(self, *args, **kwargs):
+        self.publish_as(FOREGROUND, self.outputs.FOREGROUND_PRIORITY, *args, **kwargs)
+
+    def publish_as(self, layer, priority, *args, **kwargs):
+        single = len(args) == 1 and not kwargs
+        if not (self.dedupe or self.coalesce or self.arbitrate) or not single:
+            # Pass through, including publish() with message fields as arguments
+            self.published += 1
+            self.outputs.trace.output(PUBLISH, self.name, args[0] if single else (args, kwargs), layer)
+            return self.publisher.publish(*args, **kwargs)
+        msg = args[0]
+        with self.outputs.lock:
+            if self.arbitrate and not self.claim(layer, priority, msg):
+                self.blocked += 1
+                self.outputs.trace.output(BLOCKED, self.name, msg, layer)
+                return
+            if self.coalesce and self.outputs.in_tick():
+                if self.pending is not None:
+                    self.coalesced += 1
+                else:
+                    self.outputs.pending.append(self)
+                self.pending = msg
+                self.pending_layer = layer
+                return
+            self.write(msg, layer)
+
+    def claim(self, layer, priority, msg):
+        # Called with outputs.lock held, returns True if the layer may publish
+        self.claims[layer] = priority
+        if self.dedupe:
+            self.wanted.setdefault(layer, {})[self.key(msg)] = msg
+        return all(p <= priority for l, p in self.claims.items() if l != layer)
+
+    def release(self, layer):
+        # Called with outputs.lock held
+        if layer not in self.claims:
+            return
+        top = max(self.claims.values())
+        priority = self.claims.pop(layer)
+        self.wanted.pop(layer, None)
+        if priority < top or not self.claims or not self.dedupe:
+            return
+        top = max(self.claims.values())
+        for other, p in self.claims.items():
+            if p == top:
+                for msg in self.wanted.get(other, {}).values():
+                    self.write(msg, other)
+
+    def write(self, msg, layer=FOREGROUND):
+        # Called with outputs.lock held
+        if self.dedupe:
+            key = self.key(msg)
+            if key in self.last and self.last[key] == msg:
+                self.suppressed += 1
+                self.outputs.trace.output(SUPPRESSED, self.name, msg, layer)
+                return
+            self.last[key] = msg
+        self.published += 1
+        self.outputs.trace.output(PUBLISH, self.name, msg, layer)
+        self.publisher.publish(msg)
+
+    def flush(self):
+        if self.pending is not None:
+            msg, self.pending = self.pending, None
+            self.write(msg, self.pending_layer)
+
+    def stats(self):
+        return {'published': self.published, 'suppressed': self.suppressed, 'coalesced': self.coalesced,
+                'blocked': self.blocked}
+
+
+class Outputs(dict):
+    """
+    Runner topics by name, nodes publish through runner.topics[name].publish() as with plain publishers.
+    """
+    # Node output channels: name -> channel options. Channels holding state downstream drop repeats.
+    CHANNELS = {
+        'look_at': {'dedupe': True, 'coalesce': True, 'arbitrate': True},
+        'gaze_at': {'dedupe': True, 'coalesce': True, 'arbitrate': True},
+        'head_rotation': {'dedupe': True, 'coalesce': True, 'arbitrate': True},
+        'soma_state': {'dedupe': True, 'key': lambda msg: msg.name, 'arbitrate': True},
+        'emotion': {'arbitrate': True},
+        'gesture': {'arbitrate': True},
+        'arm_animation': {'arbitrate': True},
+        'expression': {'arbitrate': True},
+        'kfanimation': {'arbitrate': True},
+        'tts': {'arbitrate': True},
+    }
+    # Priority of the foreground performance, layers with higher priority override it
+    FOREGROUND_PRIORITY = 10
+
+    def __init__(self, publishers, trace=None):
+        """
+        :param publishers: name -> rospy.Publisher
+        :param trace: Trace recording what the channels publish, suppress and block
+        """
+        dict.__init__(self)
+        self.lock = threading.Lock()
+        self.trace = trace or NullTrace()
+        self.tick_thread = None
+        # Channels holding a message until the tick ends
+        self.pending = []
+        for name, publisher in publishers.items():
+            self[name] = Channel(self, name, publisher, **self.CHANNELS.get(name, {}))
+
+    def in_tick(self):
+        return self.tick_thread is threading.current_thread()
+
+    def begin_tick(self):
+        self.tick_thread = threading.current_thread()
+
+    def end_tick(self):
+        """ Publishes messages held during the tick """
+        self.tick_thread = None
+        if not self.pending:
+            return
+        with self.lock:
+            pending, self.pending = self.pending, []
+            for channel in pending:
+                channel.flush()
+
+    def release(self, layer=FOREGROUND):
+        """ Drops claims of the stopped layer """
+        with self.lock:
+            for channel in self.values():
+                channel.release(layer)
+
+    def reset(self):
+        """ Forgets published state, next messages are published even if they repeat """
+        with self.lock:
+            for channel in self.values():
+                channel.last = {}
+
+    def stats(self):
+        with self.lock:
+            channels = dict((name, channel.stats()) for name, channel in self.items())
+            total = {'published': 0, 'suppressed': 0, 'coalesced': 0, 'blocked': 0}
+            for s in channels.values():
+                for k in total:
+                    total[k] += s[k]
+            total['saved'] = total['suppressed'] + total['coalesced']
+            return {'total': total, 'channels': channels}
@@ -0,0 +1,121 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# On-demand profile of the runner worker thread
+import cProfile
+import json
+import logging
+import os
+import pstats
+import time
+from threading import Event, Lock
+
+logger = logging.getLogger('hr.performances.profiler')
+
+# Functions listed in the summary by cumulative time
+TOP = 20
+
+
+class Profiler(object):
+    """
+    Deterministic profile of the worker thread. cProfile hooks only the thread enabling it, so the worker
+    switches the profile on and off between ticks when asked. While off the worker only checks a flag.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: where profiles are written
+        """
+        self.directory = directory
+        # Node type -> method -> [calls, seconds] of the profile running, see call()
+        self.nodes = {}
+        self.lock = Lock()
+        self.requested = False
+        # True until the worker followed the last request
+        self.changed = False
+        self.profile = None
+        self.started = 0
+        # Profile the worker stopped and the seconds it ran
+        self.finished = None
+        self.stopped = Event()
+
+    def start(self):
+        with self.lock:
+            if self.requested:
+                return False
+            self.requested = self.changed = True
+            self.stopped.clear()
+        return True
+
+    def stop(self):
+        with self.lock:
+            if not self.requested:
+                return False
+            self.requested = False
+            self.changed = True
+        return True
+
+    def switch(self):
+        """ Follows the last request, called by the worker between ticks """
+        with self.lock:
+            self.changed = False
+            requested = self.requested
+        if requested and self.profile is None:
+            self.nodes = {}
+            self.profile = cProfile.Profile()
+            self.started = time.time()
+            self.profile.enable()
+        elif not requested:
+            if self.profile is not None:
+                self.profile.disable()
+                self.finished = (self.profile, time.time() - self.started, self.nodes)
+                self.profile = None
+            self.stopped.set()
+
+    def call(self, node, method, run_time):
+        """
+        Calls start, cont or stop of the node timed for its type, inherited methods count for the
+        type of the node running them. Called by the worker while profiling.
+        """
+        began = time.time()
+        try:
+            return method(run_time)
+        finally:
+            times = self.nodes.setdefault(node.__class__.__name__, {}).setdefault(method.__name__, [0, 0.0])
+            times[0] += 1
+            times[1] += time.time() - began
+
+    def write(self, timeout=5.0):
+        """
+        Waits for the worker to stop profiling and writes the profile with a JSON summary next to it
+        :return: summary, None if nothing was profiled
+        """
+        if not self.stopped.wait(timeout):
+            logger.warn('Worker did not stop profiling within {} s'.format(timeout))
+            return None
+        finished, self.finished = self.finished, None
+        if not finished:
+            return None
+        profile, seconds, nodes = finished
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        now = time.time()
+        path = os.path.join(self.directory, 'performances-{}-{:03d}.prof'.format(
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(now)), int(now * 1000) % 1000))
+        profile.dump_stats(path)
+        summary = self.summary(profile, seconds, nodes)
+        summary['file'] = path
+        with open(os.path.splitext(path)[0] + '.json', 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+        logger.info('Worker profile of {:.1f} s written to {}'.format(seconds, path))
+        return summary
+
+    def summary(self, profile, seconds, nodes):
+        stats = pstats.Stats(profile).stats
+        top = sorted(stats.items(), key=lambda item: -item[1][3])[:TOP]
+        return {
+            'seconds': round(seconds, 3),
+            'nodes': dict((node_type, dict((name, {'calls': calls, 'ms': round(total * 1000, 3)})
+                                           for name, (calls, total) in methods.items()))
+                          for node_type, methods in nodes.items()),
+            'top': [{'function': '{}:{}({})'.format(os.path.basename(key[0]), key[1], key[2]), 'calls': value[1],
+                     'ms': round(value[3] * 1000, 3), 'own_ms': round(value[2] * 1000, 3)} for key, value in top],
+        }
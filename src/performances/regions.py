@@ -0,0 +1,108 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Random points from attention regions, precomputed per region set
+import bisect
+import random
+
+
+class AxisSampler(object):
+    """
+    Picks a random position along one axis of overlapping regions.
+
+    Regions are laid out along the axis, overlaps counted once, and each region
+    gets an interval of the cumulative length. A uniform value in [0, length]
+    selects every region whose interval contains it. The interval table and the
+    regions matched between any two interval ends are computed once, sampling
+    is a bisection.
+    """
+
+    def __init__(self, regions, axis):
+        """
+        :param regions: list of dictionaries with x, y, width and height
+        :param axis: string 'x' or 'y'
+        """
+        self.axis = axis
+        self.size = 'width' if axis == 'x' else 'height'
+        self.regions = sorted(regions, key=lambda r: r[axis])
+        self.intervals = []
+        self.length = 0
+        if not self.regions:
+            return
+        prev_end = self.regions[0][axis]
+        length = 0
+        for r in self.regions:
+            begin = r[axis]
+            end = begin + r[self.size]
+            if prev_end > begin:
+                diff = prev_end - begin
+                self.intervals.append((length - diff, length - diff + end - begin))
+                begin = prev_end
+            else:
+                self.intervals.append((length, length + end - begin))
+            length += max(0, end - begin)
+            prev_end = max(begin, end)
+        self.length = length
+        # Interval ends split [0, length] into segments matching the same regions. Ends match
+        # the regions of both neighbouring segments, so they are kept separately.
+        self.bounds = sorted(set(b for interval in self.intervals for b in interval))
+        self.at_bound = [self.matching(lambda lo, hi: lo <= b <= hi) for b in self.bounds]
+        self.between = [self.matching(lambda lo, hi: lo <= a and b <= hi) for a, b in
+                        zip([float('-inf')] + self.bounds, self.bounds + [float('inf')])]
+
+    def matching(self, contains):
+        return tuple(i for i, interval in enumerate(self.intervals) if contains(*interval))
+
+    def sample(self, rval):
+        """
+        :param rval: uniform random value in [0, 1)
+        :return: position and indexes of matched regions in self.regions
+        """
+        position = 0
+        if not self.regions:
+            return position, ()
+        rval *= self.length
+        i = bisect.bisect_left(self.bounds, rval)
+        matched = self.at_bound[i] if i < len(self.bounds) and self.bounds[i] == rval else self.between[i]
+        for m in matched:
+            if not position:
+                r = self.regions[m]
+                lo, hi = self.intervals[m]
+                position = r[self.axis] + r[self.size] * ((rval - lo) / (hi - lo))
+        return position, matched
+
+
+class RegionSampler(object):
+    """ Random points from the attention regions of one type """
+
+    def __init__(self, all_regions, region_type):
+        """
+        :param all_regions: regions as stored in performance properties
+        :param region_type: region type to sample from
+        """
+        regions = [{'x': r['x'], 'y': r['y'] - r['height'], 'width': r['width'], 'height': r['height']}
+                   for r in all_regions if r['type'] == region_type]
+        self.x = AxisSampler(regions, 'x')
+        # Vertical samplers for each set of regions matched horizontally, built when first needed
+        self.y = {}
+
+    def sample(self, rand=random.random):
+        """
+        :param rand: source of uniform random values, called up to twice per point
+        :return: point to look at
+        """
+        if not self.x.regions:
+            # Look forward
+            return {'x': 1, 'y': 0, 'z': 0}
+        y, matched = self.x.sample(rand())
+        if matched not in self.y:
+            self.y[matched] = AxisSampler([self.x.regions[i] for i in matched], 'y')
+        z, _ = self.y[matched].sample(rand()) if matched else (0, ())
+        # invert Y to match image in bg
+        return {
+            'x': 1,
+            'y': -y,
+            'z': z,
+        }
+
+    def sample_many(self, count, rand=random.random):
+        """ Points as count calls of sample() would return them """
+        return [self.sample(rand) for _ in xrange(count)]
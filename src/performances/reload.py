@@ -0,0 +1,80 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Timelines edited on disk patched into the loaded performance
+from threading import Event
+
+# Fields the runner fills in when a node has none, see Runner.validate_timeline
+DEFAULTS = {'start_time': 0, 'duration': 0}
+
+
+def node_key(node):
+    return node.get('id') or (node.get('name'), node.get('start_time'))
+
+
+def without_defaults(node):
+    return dict((k, v) for k, v in node.items() if k not in DEFAULTS or v != DEFAULTS[k])
+
+
+def matches(loaded, edited):
+    """ Defaults the runner filled in don't count as changes, fields added or removed do """
+    return without_defaults(loaded) == without_defaults(edited)
+
+
+def diff_nodes(loaded, edited):
+    """
+    Matches nodes of the edited timeline to the loaded ones by id, or by name and start time
+    :param loaded: nodes of the loaded timeline
+    :param edited: nodes of the edited timeline, validated
+    :return: edited nodes where the unchanged ones are the loaded node dicts, and counts of the
+             added, removed and changed nodes
+    """
+    candidates = {}
+    for node in loaded:
+        candidates.setdefault(node_key(node), []).append(node)
+    nodes = []
+    added = changed = 0
+    for node in edited:
+        same_key = candidates.get(node_key(node))
+        if not same_key:
+            added += 1
+        elif matches(same_key[0], node):
+            node = same_key.pop(0)
+        else:
+            same_key.pop(0)
+            changed += 1
+        nodes.append(node)
+    removed = sum(len(rest) for rest in candidates.values())
+    return nodes, added, removed, changed
+
+
+class Patch(object):
+    """ Changes of one timeline of the loaded performance, applied by the worker if it plays """
+
+    def __init__(self, performance, index, loaded, edited):
+        """
+        :param performance: loaded performance
+        :param index: timeline index, 0 if the performance has no timelines
+        :param loaded: nodes of the loaded timeline
+        :param edited: nodes of the edited timeline
+        """
+        self.performance = performance
+        self.index = index
+        self.loaded = loaded
+        self.nodes, self.added, self.removed, self.changed = diff_nodes(loaded, edited)
+        # Specs of the new nodes
+        self.prepared = {}
+        self.success = False
+        self.diff_seconds = 0
+        self.apply_seconds = 0
+        self.applied = Event()
+
+    def new_nodes(self):
+        loaded = set(id(node) for node in self.loaded)
+        return [node for node in self.nodes if id(node) not in loaded]
+
+    def dropped_nodes(self):
+        kept = set(id(node) for node in self.nodes)
+        return [node for node in self.loaded if id(node) not in kept]
+
+    def stats(self):
+        return {'added': self.added, 'removed': self.removed, 'changed': self.changed,
+                'diff_ms': round(self.diff_seconds * 1000, 3), 'apply_ms': round(self.apply_seconds * 1000, 3)}
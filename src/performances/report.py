@@ -0,0 +1,111 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Performance report records written off the calling thread
+import json
+import logging
+import time
+from collections import deque
+from threading import Condition, Thread
+
+from std_msgs.msg import String
+
+logger = logging.getLogger('hr.performances.report')
+
+
+class FileSink(object):
+    """ Appends records to a file, one JSON object per line """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, lines):
+        with open(self.path, 'a') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+
+class TopicSink(object):
+    """ Publishes each record as std_msgs/String """
+
+    def __init__(self, publisher):
+        self.publisher = publisher
+
+    def write(self, lines):
+        for line in lines:
+            self.publisher.publish(String(line))
+
+
+class Report(object):
+    """
+    Performance report channel. record() queues and returns, a background thread
+    serializes the records and writes them to the sinks. Queue is a ring of size
+    records, the oldest are dropped and counted if the writer falls behind.
+    """
+
+    def __init__(self, sinks, size=1024, clock=None, **fields):
+        """
+        :param sinks: objects with write(lines)
+        :param size: records kept until written
+        :param clock: source of record timestamps, wall clock by default
+        :param fields: added to every record, e.g. robot name
+        """
+        self.sinks = sinks
+        self.clock = clock
+        self.fields = fields
+        self.records = deque(maxlen=size)
+        self.condition = Condition()
+        self.queued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.writer = Thread(target=self.write)
+        self.writer.setDaemon(True)
+        self.writer.start()
+
+    def record(self, action, performance_id, performance_time, **data):
+        record = (self.clock.time() if self.clock else time.time(), action, performance_id, performance_time, data)
+        with self.condition:
+            if len(self.records) == self.records.maxlen:
+                self.dropped += 1
+            self.records.append(record)
+            self.queued += 1
+            self.condition.notify()
+
+    def write(self):
+        while True:
+            with self.condition:
+                while not self.records:
+                    self.condition.wait()
+                records = list(self.records)
+                self.records.clear()
+            lines = [self.serialize(r) for r in records]
+            for sink in self.sinks:
+                try:
+                    sink.write(lines)
+                except Exception as ex:
+                    self.failed += len(lines)
+                    logger.debug('Can not write performance report: {}'.format(ex))
+            with self.condition:
+                self.written += len(lines)
+                self.condition.notify_all()
+
+    def serialize(self, record):
+        stamp, action, performance_id, performance_time, data = record
+        data.update(self.fields)
+        data.update({'stamp': round(stamp, 6), 'action': action, 'performance_id': performance_id,
+                     'performance_time': round(performance_time, 6)})
+        return json.dumps(data, separators=(',', ':'), sort_keys=True)
+
+    def flush(self, timeout=None):
+        """ Waits until queued records are written """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.records or self.written + self.dropped < self.queued:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def stats(self):
+        with self.condition:
+            return {'queued': self.queued, 'written': self.written, 'dropped': self.dropped, 'failed': self.failed,
+                    'pending': len(self.records)}
@@ -0,0 +1,73 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Compact state of interrupted performances
+STARTED = 1
+FINISHED = 2
+
+
+class Snapshot(object):
+    """
+    Where an interrupted performance was. Refers to the validated performance instead of copying it
+    and keeps a byte of state per node of the running timeline and the specs of the nodes left, so the
+    node objects are released and resuming doesn't validate the performance or prepare its nodes again.
+    """
+    __slots__ = ('performance', 'time', 'timeline', 'states', 'specs')
+
+    def __init__(self, performance, time, timeline, nodes, offset=0, prepared=None):
+        """
+        :param performance: loaded performance
+        :param time: run time
+        :param timeline: index of the running timeline
+        :param nodes: nodes of the running timeline
+        :param offset: run time the timeline started at
+        :param prepared: id(node data) -> (node data, spec) of the performance nodes, as the runner keeps them
+        """
+        self.performance = performance
+        self.time = time
+        self.timeline = timeline
+        self.states = bytearray(self.state(node, time - offset) for node in nodes)
+        # Specs of the remaining nodes in order, None if not prepared
+        self.specs = None if prepared is None else tuple(
+            prepared[id(data)][1] if id(data) in prepared else None for data in self.remaining())
+
+    @staticmethod
+    def state(node, run_time):
+        if node.started or node.finished:
+            return (STARTED if node.started else 0) | (FINISHED if node.finished else 0)
+        if node.start_time < run_time:
+            # Due but not started yet, e.g. interrupted by a node ticked before it
+            return FINISHED | (STARTED if run_time < node.end_time() else 0)
+        return 0
+
+    def restore(self, timeline, nodes):
+        """
+        Sets node states of the timeline as they were when interrupted. Nodes started before are not
+        started again, nodes not reached yet start when due.
+        :param timeline: index of the timeline
+        :param nodes: nodes created for the timeline
+        :return: True if the snapshot was taken in that timeline
+        """
+        if timeline != self.timeline:
+            return False
+        for node, state in zip(nodes, self.states):
+            node.started = bool(state & STARTED)
+            node.finished = bool(state)
+        return True
+
+    @property
+    def id(self):
+        return self.performance.get('id', '')
+
+    def prepared(self):
+        """ id(node data) -> (node data, spec) of the remaining nodes, None if specs were not kept """
+        if self.specs is None:
+            return None
+        return dict((id(data), (data, spec)) for data, spec in zip(self.remaining(), self.specs) if spec)
+
+    def remaining(self):
+        """ Data of the nodes left to start after resuming """
+        timelines = self.performance['timelines'] if 'timelines' in self.performance else [self.performance]
+        nodes = []
+        for i, timeline in enumerate(timelines[self.timeline:], self.timeline):
+            states = self.states if i == self.timeline else ()
+            nodes += [node for k, node in enumerate(timeline['nodes']) if k >= len(states) or not states[k]]
+        return nodes
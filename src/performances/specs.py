@@ -0,0 +1,94 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Immutable node definitions shared by runs, performances and runners of the process
+import weakref
+from threading import Lock
+
+# Specs in use by key, equal nodes share one
+_interned = weakref.WeakValueDictionary()
+_lock = Lock()
+
+
+class FrozenDict(dict):
+    """ Node data which can't be changed, so runs sharing it can't leak state into each other """
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('node data is read-only')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(value):
+    """ Read-only copy, dictionaries become FrozenDict and lists tuples """
+    if isinstance(value, dict):
+        frozen = FrozenDict(value)
+        for k, v in value.items():
+            if isinstance(v, (dict, list, tuple)):
+                dict.__setitem__(frozen, k, freeze(v))
+        return frozen
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def key(value):
+    """ Hashable value equal for equal node data, 1 and 1.0 differ """
+    if isinstance(value, dict):
+        return dict, tuple(sorted((k, key(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return list, tuple(key(v) for v in value)
+    return value.__class__, value
+
+
+class NodeSpec(object):
+    """
+    Node definition normalized by its class with defaults filled in, and the messages it publishes rendered
+    on first use. Nodes only keep their run state and refer to the spec.
+    """
+    __slots__ = ('cls', 'data', 'start_time', 'duration', '_rendered', '__weakref__')
+
+    def __init__(self, cls, data):
+        """
+        :param cls: node class
+        :param data: node data normalized by the class
+        """
+        data = freeze(data)
+        set_slot = object.__setattr__
+        set_slot(self, 'cls', cls)
+        set_slot(self, 'data', data)
+        set_slot(self, 'start_time', data['start_time'])
+        set_slot(self, 'duration', max(0.1, float(data['duration'])))
+        set_slot(self, '_rendered', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('node spec is immutable')
+
+    @property
+    def rendered(self):
+        # Rendering fails the same way every time, the node start reports it
+        if self._rendered is None:
+            object.__setattr__(self, '_rendered', self.cls.prepare(self.data))
+        return self._rendered
+
+
+def spec_for(cls, data):
+    """ Spec of the node data, the same object for equal data while any node or loaded performance uses it """
+    data = cls.normalize(data)
+    try:
+        # Most nodes only have scalar values
+        spec_key = (cls, frozenset((k, v.__class__, v) for k, v in data.items()))
+    except TypeError:
+        try:
+            spec_key = (cls, key(data))
+            hash(spec_key)
+        except TypeError:
+            # Unhashable values, the node gets a spec of its own
+            return NodeSpec(cls, data)
+    with _lock:
+        spec = _interned.get(spec_key)
+        if spec is None:
+            spec = _interned[spec_key] = NodeSpec(cls, data)
+    return spec
@@ -0,0 +1,78 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Deferred imports and startup timing of the nodes
+import importlib
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+logger = logging.getLogger('hr.performances.startup')
+
+# Startup profile is written to this file as JSON lines if set
+PROFILE_ENV = 'PERFORMANCES_STARTUP_PROFILE'
+
+
+class LazyModule(object):
+    """ Stands in for a module and imports it when one of its attributes is used first """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        value = getattr(self._module, attr)
+        # Next lookups are plain attribute reads
+        setattr(self, attr, value)
+        return value
+
+
+def process_start_time():
+    """ Wall clock time the process was started, current time if not known """
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the executable name, start time is the 22nd field of the line
+            start_ticks = float(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, ValueError, IndexError):
+        return time.time()
+
+
+class StartupProfile(object):
+    """
+    Seconds from process start to named startup steps of a node. Only the first
+    mark of each name counts. Reported if PERFORMANCES_STARTUP_PROFILE is set.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.started = process_start_time()
+        self.lock = Lock()
+        self.marks = []
+        self.reported = False
+
+    def mark(self, name):
+        with self.lock:
+            if name not in [m[0] for m in self.marks]:
+                self.marks.append((name, time.time() - self.started))
+
+    def get(self, name):
+        with self.lock:
+            return dict(self.marks).get(name)
+
+    def report(self):
+        """ Logs the marks and appends them to the profile file, once """
+        with self.lock:
+            if self.reported:
+                return
+            self.reported = True
+            marks = list(self.marks)
+        logger.info('{} startup: {}'.format(self.node, ', '.join('{} {:.3f}s'.format(*m) for m in marks)))
+        path = os.environ.get(PROFILE_ENV)
+        if path:
+            with open(path, 'a') as f:
+                f.write(json.dumps({'node': self.node, 'pid': os.getpid(), 'marks': dict(marks)}) + '\n')
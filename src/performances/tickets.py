@@ -0,0 +1,63 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Performances loaded in background and run later by ticket
+import itertools
+from collections import OrderedDict
+from threading import Event, Lock
+
+LOADING = 'loading'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class Ticket(object):
+    """ Performance read, validated and prepared ahead of running it """
+
+    def __init__(self, number, id, full=False):
+        """
+        :param number: ticket number
+        :param id: performance id
+        :param full: pick a sub-performance of the folder like run_full_performance
+        """
+        self.number = number
+        self.id = id
+        self.full = full
+        self.state = LOADING
+        self.error = ''
+        self.seconds = 0
+        self.performance = None
+        # Same as the runner keeps for the loaded performance
+        self.prepared = {}
+        self.watched = {}
+        self.regions = []
+        self.done = Event()
+
+    def to_dict(self):
+        return {'ticket': self.number, 'id': self.id, 'state': self.state, 'error': self.error,
+                'performance': self.performance.get('id', '') if self.performance else '',
+                'load_ms': round(self.seconds * 1000, 3)}
+
+
+class Tickets(object):
+    """ Tickets not run yet, the oldest are forgotten beyond size """
+
+    def __init__(self, size=8):
+        self.size = size
+        self.numbers = itertools.count(1)
+        self.lock = Lock()
+        self.tickets = OrderedDict()
+
+    def issue(self, id, full=False):
+        with self.lock:
+            ticket = Ticket(next(self.numbers), id, full)
+            self.tickets[ticket.number] = ticket
+            while len(self.tickets) > self.size:
+                self.tickets.popitem(last=False)
+        return ticket
+
+    def get(self, number):
+        with self.lock:
+            return self.tickets.get(number)
+
+    def take(self, number):
+        with self.lock:
+            return self.tickets.pop(number, None)
@@ -0,0 +1,301 @@
+# Copyright (c) 2013-2018 Hanson Robotics, Ltd, all rights reserved
+# Binary trace of what the runner did: node lifecycle, published outputs and service calls
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+from threading import Lock
+
+from performances.latency import summary
+
+logger = logging.getLogger('hr.performances.trace')
+
+MAGIC = 'HRTRACE1'
+VERSION = 2
+# magic, version, header size, record size, capacity, records written, time opened,
+# payload slot size, payload slots, payloads written
+HEADER = struct.Struct('<8sIIIIQdIIQ')
+COUNT = struct.Struct('<Q')
+COUNT_OFFSET = 24
+PAYLOAD_COUNT_OFFSET = 48
+# wall time, run time, planned run time, lead, node, payload number + 1 or 0, timeline or performance, layer,
+# channel, event, flags
+RECORD = struct.Struct('<ddffIIIIIBB')
+# Event codes are the index. Performance events are named as the report actions.
+EVENTS = ['', 'node_start', 'node_stop', 'node_error', 'publish', 'suppressed', 'blocked', 'service',
+          'run', 'resume', 'paused', 'stop', 'finished', 'reload']
+CODES = dict((name, code) for code, name in enumerate(EVENTS))
+NODE_START, NODE_STOP, NODE_ERROR, PUBLISH, SUPPRESSED, BLOCKED, SERVICE = range(1, 8)
+# Flags
+FAILED = 1
+# String reference of names not recorded once the string table is full
+OVERFLOW = 0xFFFFFFFF
+# Payloads are cut to this many characters, payload slots hold as many bytes
+PAYLOAD_LENGTH = 256
+# Seconds new strings may stay buffered, a crash loses references to them
+FLUSH_INTERVAL = 1.0
+
+
+def payload(msg):
+    """ Message type and field values in definition order, much cheaper than str() of a ROS message """
+    try:
+        fields = [getattr(msg, name) for name in msg.__slots__]
+        text = msg._type + ' ['
+    except AttributeError:
+        return str(msg)[:PAYLOAD_LENGTH]
+    # Fields are cut before formatting, running_performance carries the whole performance JSON
+    for value in fields:
+        if isinstance(value, (basestring, list, tuple)):
+            value = value[:PAYLOAD_LENGTH]
+        text += repr(value) + ', '
+        if len(text) > PAYLOAD_LENGTH:
+            break
+    return (text[:-2] + ']')[:PAYLOAD_LENGTH]
+
+
+def rotate(path):
+    """ Keeps the trace of the previous session, e.g. of the crash the robot was restarted after """
+    for suffix in ['', '.strings']:
+        if os.path.exists(path + suffix):
+            os.rename(path + suffix, path + '.1' + suffix)
+
+
+class Strings(dict):
+    """ Name -> reference, new names are added to the table file, a line each """
+
+    def __init__(self, output, size):
+        dict.__init__(self)
+        self.output = output
+        self.size = size
+        self.overflowed = 0
+        self['']
+
+    def __missing__(self, value):
+        if len(self) >= self.size:
+            self.overflowed += 1
+            return OVERFLOW
+        ref = self[value] = len(self)
+        self.output.write(json.dumps(value) + '\n')
+        return ref
+
+
+class TraceRing(object):
+    """
+    Fixed size records in a preallocated memory mapped file, the oldest are overwritten. The kernel writes the
+    pages back, so the trace survives the process. Names of nodes, timelines, layers and channels are written
+    once to the .strings file next to it, one JSON string per line, and records refer to them by line number.
+    Payloads are written to a ring of fixed size slots after the records, records refer to them by number.
+    """
+
+    def __init__(self, path, capacity=100000, max_strings=50000, payloads=20000):
+        """
+        :param path: trace file, the previous one is moved to path.1
+        :param capacity: records kept
+        :param max_strings: names kept, names are not recorded once the table is full
+        :param payloads: payloads kept
+        """
+        self.path = path
+        self.capacity = capacity
+        self.max_strings = max_strings
+        self.payloads = payloads
+        self.lock = Lock()
+        self.count = 0
+        self.payload_count = 0
+        rotate(path)
+        self.payload_offset = HEADER.size + capacity * RECORD.size
+        size = self.payload_offset + payloads * PAYLOAD_LENGTH
+        with open(path, 'w+b') as f:
+            # Written out, a sparse file could fail on a full disk while playing
+            chunk = '\0' * (1 << 20)
+            for offset in range(0, size, len(chunk)):
+                f.write(chunk[:size - offset])
+            f.flush()
+            self.map = mmap.mmap(f.fileno(), size)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, HEADER.size, RECORD.size, capacity, 0, time.time(),
+                         PAYLOAD_LENGTH, payloads, 0)
+        self.strings_file = open(path + '.strings', 'w')
+        self.flushed = time.time()
+        # Used holding the lock, lines are written in reference order
+        self.strings = Strings(self.strings_file, max_strings)
+
+    def append(self, event, run_time=float('nan'), planned=float('nan'), lead=0.0, node='', payload='',
+               timeline='', layer='', channel='', flags=0):
+        # Wall time as in the other logs of the robot, also cheaper than the runner clock
+        stamp = time.time()
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+        with self.lock:
+            strings = self.strings
+            ref = 0
+            if payload:
+                offset = self.payload_offset + (self.payload_count % self.payloads) * PAYLOAD_LENGTH
+                self.map[offset:offset + PAYLOAD_LENGTH] = payload[:PAYLOAD_LENGTH].ljust(PAYLOAD_LENGTH, '\0')
+                self.payload_count += 1
+                ref = self.payload_count
+                COUNT.pack_into(self.map, PAYLOAD_COUNT_OFFSET, self.payload_count)
+            RECORD.pack_into(self.map, HEADER.size + (self.count % self.capacity) * RECORD.size, stamp, run_time,
+                             planned, lead, strings[node], ref, strings[timeline], strings[layer],
+                             strings[channel], event, flags)
+            self.count += 1
+            COUNT.pack_into(self.map, COUNT_OFFSET, self.count)
+            if stamp - self.flushed > FLUSH_INTERVAL:
+                self.flushed = stamp
+                self.strings_file.flush()
+
+    def flush(self):
+        with self.lock:
+            self.map.flush()
+            self.strings_file.flush()
+
+    def stats(self):
+        with self.lock:
+            return {'enabled': True, 'path': self.path, 'records': self.count, 'capacity': self.capacity,
+                    'payloads': self.payload_count, 'payload_capacity': self.payloads,
+                    'strings': len(self.strings), 'overflowed': self.strings.overflowed}
+
+
+class Trace(object):
+    """ Records of a runner or of one of its layers to the shared ring """
+
+    def __init__(self, ring, layer=''):
+        self.ring = ring
+        self.layer = layer or ''
+
+    def for_layer(self, name):
+        return Trace(self.ring, name)
+
+    def node(self, event, node, run_time, planned, lead=0.0, failed=False):
+        self.ring.append(event, run_time, planned, lead, node.__class__.__name__, '', node.id, self.layer,
+                         node.channel or '', FAILED if failed else 0)
+
+    def output(self, event, channel, msg, layer=None):
+        self.ring.append(event, payload=payload(msg), layer=layer or '', channel=channel)
+
+    def service(self, name, args, failed=False):
+        self.ring.append(SERVICE, payload=repr(args)[:PAYLOAD_LENGTH], layer=self.layer, channel=name,
+                         flags=FAILED if failed else 0)
+
+    def performance(self, action, performance_id, run_time):
+        if action in CODES:
+            self.ring.append(CODES[action], run_time, timeline=performance_id, layer=self.layer)
+
+    def stats(self):
+        return self.ring.stats()
+
+    def flush(self):
+        self.ring.flush()
+
+
+class NullTrace(object):
+    """ Trace turned off """
+
+    def for_layer(self, name):
+        return self
+
+    def node(self, *args, **kwargs):
+        pass
+
+    output = service = performance = flush = node
+
+    def stats(self):
+        return {'enabled': False}
+
+
+class TracedService(object):
+    """ Service proxy recording its calls """
+
+    def __init__(self, trace, name, proxy):
+        self.trace = trace
+        self.name = name
+        self.proxy = proxy
+
+    def __call__(self, *args, **kwargs):
+        try:
+            response = self.proxy(*args, **kwargs)
+        except Exception:
+            self.trace.service(self.name, args, failed=True)
+            raise
+        self.trace.service(self.name, args)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.proxy, name)
+
+
+class TraceReader(object):
+    """ Records of a trace file, oldest first """
+
+    def __init__(self, path):
+        with open(path + '.strings') as f:
+            self.strings = [json.loads(line) for line in f if line.strip()]
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, version, header_size, record_size, self.capacity, self.count, self.opened, self.payload_size, \
+            self.payloads, self.payload_count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError('{} is not a performances trace'.format(path))
+        self.data = data
+        self.header_size = header_size
+        self.payload_offset = header_size + self.capacity * record_size
+        # Records overwritten by newer ones
+        self.lost = max(0, self.count - self.capacity)
+
+    def string(self, ref):
+        return self.strings[ref] if ref < len(self.strings) else None
+
+    def payload(self, ref):
+        # None if overwritten by newer payloads
+        if not ref:
+            return ''
+        if ref <= self.payload_count - self.payloads or ref > self.payload_count:
+            return None
+        offset = self.payload_offset + ((ref - 1) % self.payloads) * self.payload_size
+        return self.data[offset:offset + self.payload_size].rstrip('\0').decode('utf-8', 'replace')
+
+    def records(self):
+        for i in range(self.lost, self.count):
+            stamp, run_time, planned, lead, node, payload, timeline, layer, channel, event, flags = \
+                RECORD.unpack_from(self.data, self.header_size + (i % self.capacity) * RECORD.size)
+            yield {
+                'stamp': stamp,
+                'run_time': None if math.isnan(run_time) else run_time,
+                'planned': None if math.isnan(planned) else planned,
+                'lead': lead,
+                'event': EVENTS[event] if event < len(EVENTS) else event,
+                'node': self.string(node),
+                'payload': self.payload(payload),
+                'timeline': self.string(timeline),
+                'layer': self.string(layer),
+                'channel': self.string(channel),
+                'failed': bool(flags & FAILED),
+            }
+
+    def lateness(self):
+        """
+        Seconds nodes started and stopped after they were due, summarized in ms per node type. A node is due
+        its lead before its start time, so output latency compensation doesn't count as early.
+        """
+        started = {}
+        stopped = {}
+        counts = {}
+        for record in self.records():
+            event = record['event']
+            if event == 'node_start':
+                started.setdefault(record['node'], []).append(record['run_time'] + record['lead'] - record['planned'])
+            elif event == 'node_stop':
+                stopped.setdefault(record['node'], []).append(record['run_time'] - record['planned'])
+            elif event in ('publish', 'suppressed', 'blocked', 'service'):
+                channel = counts.setdefault(record['channel'], {})
+                key = event + '_failed' if record['failed'] else event
+                channel[key] = channel.get(key, 0) + 1
+        return {
+            'records': self.count - self.lost,
+            'lost': self.lost,
+            'start_ms': summary(sum(started.values(), [])),
+            'start_ms_by_node': dict((name, summary(values)) for name, values in started.items()),
+            'stop_ms_by_node': dict((name, summary(values)) for name, values in stopped.items()),
+            'channels': counts,
+        }